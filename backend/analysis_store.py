@@ -0,0 +1,152 @@
+"""
+analysis_store.py — lưu kết quả phân tích dạng cột (mỗi cột một file NumPy .npy) thay vì một chuỗi JSON lớn.
+Mỗi phân tích là một thư mục gồm meta.json + các file <frame>.<i>.npy:
+  - frame "products": bảng tổng hợp theo sản phẩm. product_inventory/sales_summary/profit_analysis
+    chỉ là danh sách cột chọn từ frame này (không lưu 3 lần).
+  - frame "raw": raw_data; các bảng khác (category/brand...) mỗi bảng một frame.
+Cột số -> int64/float64; cột còn lại (chuỗi, tags, None...) -> mã int32 + danh sách nhãn trong meta.json.
+Mảng được mở bằng memory mapping (np.load(mmap_mode='r')); load() dựng lại đúng dict response cũ.
+"""
+import json
+import os
+import shutil
+import numpy as np
+
+PRODUCT_TABLES = ('product_inventory_table', 'sales_summary_table', 'profit_analysis_table')
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+
+class LayoutError(ValueError):
+    """Kết quả không lưu được dạng cột (vd: các dòng của một bảng khác tập cột) -> giữ dạng JSON."""
+
+def _column(values):
+    """(kind, mảng, nhãn) cho một cột."""
+    if values and all(type(v) is int for v in values) and INT64_MIN <= min(values) and max(values) <= INT64_MAX:
+        return 'int', np.array(values, dtype='int64'), None
+    # int lẫn float (vd: 0 và 12.5) lưu float64: 0 đọc lại thành 0.0
+    if values and all(type(v) in (int, float) for v in values):
+        return 'float', np.array(values, dtype='float64'), None
+    index, codes = {}, np.empty(len(values), dtype='int32')
+    labels = []
+    for i, v in enumerate(values):
+        key = json.dumps(v, sort_keys=True)
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(labels)
+            labels.append(v)
+        codes[i] = code
+    return 'cat', codes, labels
+
+def _encode_frame(records):
+    """records (list dict cùng tập cột) -> (spec cho meta.json, list mảng theo cột)."""
+    names = list(records[0]) if records else []
+    if any(r.keys() != set(names) for r in records):
+        raise LayoutError("Các dòng không cùng tập cột")
+    spec, arrays = {'rows': len(records), 'columns': []}, []
+    for name in names:
+        kind, arr, labels = _column([r[name] for r in records])
+        spec['columns'].append({'name': name, 'kind': kind, 'labels': labels})
+        arrays.append(arr)
+    return spec, arrays
+
+def _merge_products(smart):
+    """Gộp các bảng sản phẩm thành một frame nếu cùng thứ tự Product và các cột chung trùng giá trị.
+    Trả về (records gộp, {khóa bảng: danh sách cột}); bảng không gộp được không có trong dict."""
+    merged, views = None, {}
+    for key in PRODUCT_TABLES:
+        rows = smart.get(key)
+        if not rows or any('Product' not in r for r in rows): continue
+        if merged is None:
+            merged, views[key] = [dict(r) for r in rows], list(rows[0])
+            continue
+        if len(rows) != len(merged) or any(list(r) != list(rows[0]) for r in rows): continue
+        if any(m[c] != r[c] for m, r in zip(merged, rows) for c in r if c in m): continue
+        for m, r in zip(merged, rows): m.update(r)
+        views[key] = list(rows[0])
+    return merged, views
+
+def save(path, res):
+    """Ghi kết quả (dict response /analyze, không gồm session_id) vào thư mục path. Ném LayoutError nếu không chuyển được."""
+    smart = res.get('smart_summary', {})
+    frames, tables = {}, {}
+    merged, views = _merge_products(smart)
+    if merged is not None: frames['products'] = merged
+    for key, rows in smart.items():
+        if not key.endswith('_table') or not isinstance(rows, list): continue
+        if key in views: tables[key] = {'frame': 'products', 'columns': views[key]}
+        else:
+            frames[key] = rows
+            tables[key] = {'frame': key, 'columns': list(rows[0]) if rows else []}
+    # "tables" của response là bản sao các *_table trong smart_summary; bản khác thì lưu riêng
+    response_tables = {}
+    for name, rows in res.get('tables', {}).items():
+        alias = next((k for k in tables if smart[k] == rows), None)
+        if alias is None:
+            frames[f'tables.{name}'] = rows
+            tables[f'tables.{name}'] = {'frame': f'tables.{name}', 'columns': list(rows[0]) if rows else []}
+            alias = f'tables.{name}'
+        response_tables[name] = alias
+    frames['raw'] = res.get('raw_data', [])
+
+    meta = {
+        'statistics': res.get('statistics', {}),
+        'smart_summary': {k: v for k, v in smart.items() if k not in tables},
+        'smart_tables': [k for k in smart if k in tables],
+        'tables': tables, 'response_tables': response_tables, 'frames': {},
+        'extra': {k: v for k, v in res.items() if k not in ('statistics', 'smart_summary', 'tables', 'raw_data')},
+        'has_tables': 'tables' in res,
+    }
+    encoded = {}
+    for i, (name, records) in enumerate(frames.items()):
+        spec, arrays = _encode_frame(records)
+        spec['file'] = f'f{i}'
+        meta['frames'][name], encoded[name] = spec, arrays
+
+    tmp = path + '.tmp'
+    if os.path.exists(tmp): shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name, arrays in encoded.items():
+        for j, arr in enumerate(arrays): np.save(os.path.join(tmp, f"{meta['frames'][name]['file']}.{j}.npy"), arr)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as fh: json.dump(meta, fh, ensure_ascii=False)
+    if os.path.exists(path): shutil.rmtree(path)
+    os.replace(tmp, path)
+
+def load_meta(path):
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as fh: return json.load(fh)
+
+def open_column(path, spec, j):
+    """Mảng của cột thứ j trong frame, mở bằng memory mapping."""
+    return np.load(os.path.join(path, f"{spec['file']}.{j}.npy"), mmap_mode='r')
+
+def read_frame(path, spec, columns=None):
+    """Dựng lại list dict của frame (chỉ các cột `columns` nếu có)."""
+    wanted = columns or [c['name'] for c in spec['columns']]
+    pos = {c['name']: j for j, c in enumerate(spec['columns'])}
+    cols = []
+    for name in wanted:
+        j = pos[name]
+        col, arr = spec['columns'][j], open_column(path, spec, j)
+        values = arr.tolist()
+        if col['kind'] == 'cat':
+            labels = col['labels']
+            # nhãn dạng list/dict (vd: tags) phải là bản sao riêng cho mỗi dòng
+            if any(isinstance(l, (list, dict)) for l in labels): values = [json.loads(json.dumps(labels[c])) for c in values]
+            else: values = [labels[c] for c in values]
+        cols.append(values)
+    return [dict(zip(wanted, row)) for row in zip(*cols)] if cols else [{} for _ in range(spec['rows'])]
+
+def load(path):
+    """Dựng lại dict kết quả giống response /analyze ban đầu."""
+    meta = load_meta(path)
+    frames = {}
+    def table(key):
+        t = meta['tables'][key]
+        if t['frame'] not in frames: frames[t['frame']] = read_frame(path, meta['frames'][t['frame']])
+        return [{c: r[c] for c in t['columns']} for r in frames[t['frame']]]
+
+    smart = dict(meta['smart_summary'])
+    for key in meta['smart_tables']: smart[key] = table(key)
+    res = {'statistics': meta['statistics'], 'raw_data': read_frame(path, meta['frames']['raw']), 'smart_summary': smart}
+    if meta['has_tables']:
+        res['tables'] = {name: smart[alias] if alias in smart else table(alias) for name, alias in meta['response_tables'].items()}
+    res.update(meta['extra'])
+    return res
@@ -1,7 +1,28 @@
 import pandas as pd
 import numpy as np
+import hashlib
+import json
+import os
 import re
+import warnings
 from datetime import datetime
+import ingest
+import metrics
+
+# Số dòng mẫu gửi về trình duyệt (raw_data) - tách biệt với tập dùng để tính KPI
+RAW_SAMPLE_ROWS = int(os.environ.get('DATANA_RAW_SAMPLE_ROWS', 3000))
+# Số dòng xử lý mỗi lượt khi tổng hợp, để bộ nhớ tạm không phụ thuộc kích thước file
+AGG_CHUNK_ROWS = int(os.environ.get('DATANA_AGG_CHUNK_ROWS', 250_000))
+# Khối tổng hợp (cube) cho truy vấn lọc: gộp các phần của từng khối dòng khi số dòng chờ gộp vượt ngưỡng này
+CUBE_COMPACT_ROWS = int(os.environ.get('DATANA_CUBE_COMPACT_ROWS', 1_000_000))
+# Số dòng tối đa của cube (0 = không giới hạn). Cube có một dòng cho mỗi tổ hợp sản phẩm x thương hiệu x danh mục x khu vực
+# x tháng nên với dữ liệu nhiều SKU nó gần bằng số dòng gốc; vượt ngưỡng thì sản phẩm doanh thu thấp nhất được gộp vào
+# CUBE_OTHER (tổng vẫn đúng, nhưng lọc / gợi ý không còn thấy riêng các sản phẩm đó)
+CUBE_MAX_ROWS = int(os.environ.get('DATANA_CUBE_MAX_ROWS', 0))
+CUBE_OTHER = '(Khác)'
+# Chống trùng dòng khi nối thêm (/analyze/append): trạng thái giữ 16 byte cho mỗi dòng khác nhau (hash + số lần).
+# Tắt (0) thì bộ nhớ không tăng theo số dòng nhưng dòng đã phân tích mà tải lại sẽ bị cộng thêm lần nữa
+ROW_DEDUPE = os.environ.get('DATANA_ROW_DEDUPE', '1') == '1'
 
 def clean_currency_text(val):
     if isinstance(val, (int, float, np.number)): return float(val)
@@ -34,65 +55,232 @@ def clean_currency_text(val):
         return float(clean_str) * multiplier
     except: return 0.0
 
+_NUMERIC_TYPES = (int, float, np.number)
+_np_str = getattr(np, 'strings', np.char)
+_CURRENCY_MAX_WIDTH = 64
+_CURRENCY_BATCH = 200_000
+_DOT, _COMMA, _MINUS = ord('.'), ord(','), ord('-')
+
+def _compact_codes(codes, keep):
+    """Dồn các ký tự được giữ về đầu mỗi dòng (ma trận mã unicode), phần còn lại = 0."""
+    order = np.argsort(~keep, axis=1, kind='stable')
+    return np.take_along_axis(np.where(keep, codes, 0), order, axis=1)
+
+def _last_pos(mask):
+    """Vị trí xuất hiện cuối cùng của True trên mỗi dòng, -1 nếu không có (giống str.rfind)."""
+    width = mask.shape[1]
+    pos = width - 1 - np.argmax(mask[:, ::-1], axis=1)
+    return np.where(mask.any(axis=1), pos, -1)
+
+def _contains(codes, pattern):
+    """Tương đương `pattern in s` trên ma trận mã unicode."""
+    pat = [ord(ch) for ch in pattern]
+    width = codes.shape[1] - len(pat) + 1
+    if width <= 0: return np.zeros(len(codes), dtype=bool)
+    hit = codes[:, :width] == pat[0]
+    for i, c in enumerate(pat[1:], 1): hit &= codes[:, i:i + width] == c
+    return hit.any(axis=1)
+
+def _parse_currency_text(s):
+    """Phân tích mảng chuỗi gốc (chưa lower). Trả về (giá trị, mask các dòng phải dùng bản scalar)."""
+    n = len(s)
+    result = np.zeros(n, dtype='float64')
+    width = s.dtype.itemsize // 4
+    if not n or not width: return result, np.zeros(n, dtype=bool)
+    codes = np.ascontiguousarray(s).view(np.uint32).reshape(n, width).copy()
+
+    # lower(): ASCII cộng 32, ký tự unicode tra bảng; \d của re khớp cả chữ số unicode (٣, １...)
+    # -> những dòng đó (và dòng có ký tự lower ra nhiều ký tự) để bản scalar xử lý
+    upper = (codes >= 65) & (codes <= 90)
+    codes[upper] += 32
+    fallback = np.zeros(n, dtype=bool)
+    high = np.unique(codes[codes >= 128])
+    if len(high):
+        lowered = [chr(c).lower() for c in high.tolist()]
+        special = [c for c, low in zip(high.tolist(), lowered) if len(low) != 1 or chr(c).isdecimal()]
+        if special: fallback = np.isin(codes, special).any(axis=1)
+        mask = codes >= 128
+        codes[mask] = np.array([ord(low) if len(low) == 1 else 0 for low in lowered], dtype=np.uint32)[np.searchsorted(high, codes[mask])]
+
+    multiplier = np.ones(n, dtype='float64')
+    is_ty = _contains(codes, 'ty') | _contains(codes, 'tỷ') | _contains(codes, 'b')
+    is_tr = ~is_ty & (_contains(codes, 'tr') | _contains(codes, 'm'))
+    is_k = ~is_ty & ~is_tr & (_contains(codes, 'k') | _contains(codes, 'nghìn'))
+    multiplier[is_ty] = 1_000_000_000
+    multiplier[is_tr] = 1_000_000
+    multiplier[is_k] = 1_000
+
+    # re.sub(r'[^\d.,-]', '', s)
+    is_digit = (codes >= 48) & (codes <= 57)
+    codes = _compact_codes(codes, is_digit | (codes == _DOT) | (codes == _COMMA) | (codes == _MINUS))
+    length = (codes != 0).sum(axis=1)
+    last_comma, last_dot = _last_pos(codes == _COMMA), _last_pos(codes == _DOT)
+    has_comma, has_dot = last_comma >= 0, last_dot >= 0
+
+    # Phân biệt dấu phẩy/chấm giống hệt bản scalar
+    eu = has_comma & has_dot & (last_comma > last_dot)
+    drop_comma = (has_comma & has_dot & ~eu) | (has_comma & ~has_dot & (length - last_comma - 1 == 3) & (length > 4))
+    comma_to_dot = eu | (has_comma & ~has_dot & ~drop_comma)
+    drop_dot = eu | (has_dot & ~has_comma & (length - last_dot - 1 == 3))
+
+    keep = (codes != 0) & ~((codes == _DOT) & drop_dot[:, None]) & ~((codes == _COMMA) & drop_comma[:, None])
+    codes = _compact_codes(codes, keep)
+    codes[(codes == _COMMA) & comma_to_dot[:, None]] = _DOT
+
+    # Dạng số đơn giản: -?(\d+\.?\d*|\.\d+) -> float() trực tiếp, còn lại là lỗi (0.0) hoặc scalar
+    n_minus = (codes == _MINUS).sum(axis=1)
+    simple = ((codes >= 48) & (codes <= 57)).any(axis=1) & ((codes == _DOT).sum(axis=1) <= 1) \
+        & ~(codes == _COMMA).any(axis=1) & ((n_minus == 0) | ((n_minus == 1) & (codes[:, 0] == _MINUS)))
+    simple &= ~fallback
+    if simple.any():
+        num_str = np.ascontiguousarray(codes[simple]).view(f'<U{width}').ravel()
+        result[simple] = num_str.astype('float64') * multiplier[simple]
+    return result, fallback
+
+def by_category(series, fn):
+    """fn (Series -> Series số) trên các giá trị khác nhau của cột categorical rồi trải lại theo mã."""
+    values = fn(pd.Series(np.append(series.cat.categories.to_numpy(dtype=object), np.nan))).to_numpy(dtype='float64')
+    return pd.Series(values[series.cat.codes.to_numpy()], index=series.index)
+
+def parse_currency_series(series):
+    """Bản vector hóa của clean_currency_text cho cả một cột.
+    Kết quả giống hệt bản scalar; chỉ những dòng không phân loại được mới quay về clean_currency_text."""
+    if isinstance(series.dtype, pd.CategoricalDtype): return by_category(series, parse_currency_series)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.astype('float64')
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        return series.apply(clean_currency_text).astype('float64')
+
+    out = np.zeros(len(series), dtype='float64')
+
+    # Ô đã là số (int/float/NaN) -> float(val) như bản scalar
+    values = series.to_numpy(dtype=object)
+    is_num = np.zeros(len(series), dtype=bool)
+    if pd.api.types.is_object_dtype(series.dtype) and pd.api.types.infer_dtype(series, skipna=False) not in ('string', 'empty'):
+        is_num[:] = np.fromiter((isinstance(v, _NUMERIC_TYPES) for v in values), dtype=bool, count=len(values))
+    else:
+        na_idx = np.flatnonzero(series.isna().to_numpy())
+        is_num[na_idx] = [isinstance(values[i], _NUMERIC_TYPES) for i in na_idx]
+    if is_num.any():
+        out[is_num] = values[is_num].astype('float64')
+
+    # Ô dạng chữ: chỉ phân tích mỗi giá trị khác nhau một lần, theo lô để ma trận ký tự không quá lớn
+    text_idx = np.flatnonzero(~is_num)
+    if not len(text_idx): return pd.Series(out, index=series.index)
+    labels, uniques = pd.factorize(values[text_idx], use_na_sentinel=False)
+    uniques = np.asarray(uniques, dtype=object)
+    parsed_u = np.zeros(len(uniques), dtype='float64')
+    for b in range(0, len(uniques), _CURRENCY_BATCH):
+        chunk = uniques[b:b + _CURRENCY_BATCH]
+        s = chunk.astype(str)
+        too_long = _np_str.str_len(s) > _CURRENCY_MAX_WIDTH
+        short = np.flatnonzero(~too_long)
+        parsed, fallback = _parse_currency_text(s[short].astype(f'<U{_CURRENCY_MAX_WIDTH}') if too_long.any() else s)
+        parsed_u[b + short] = parsed
+        slow = short[fallback].tolist() + np.flatnonzero(too_long).tolist()
+        if slow: parsed_u[[b + i for i in slow]] = [clean_currency_text(chunk[i]) for i in slow]
+    out[text_idx] = parsed_u[labels]
+    return pd.Series(out, index=series.index)
+
+# --- DÒNG TIÊU ĐỀ ---
+HEADER_KEYWORDS = ['ngày', 'date', 'sản phẩm', 'product', 'doanh thu', 'revenue', 'số lượng', 'quantity', 'khu vực', 'region']
+HEADER_SCAN_ROWS = 10
+_HEADER_RE = re.compile('|'.join(map(re.escape, HEADER_KEYWORDS)))
+
+def find_header_row(rows, scan_rows=HEADER_SCAN_ROWS):
+    """Vị trí dòng tiêu đề trong các dòng đầu file (rows[0] = tiêu đề mặc định). Giữ dòng 0 nếu ít nhất 2 ô
+    chứa từ khóa; ngược lại chọn dòng (trong scan_rows dòng sau) có nhiều từ khóa khác nhau nhất, tối thiểu 2."""
+    if not rows: return 0
+    if sum(1 for c in rows[0] if _HEADER_RE.search(str(c).lower())) >= 2: return 0
+    best, best_matches = 0, 1
+    for i, row in enumerate(rows[1:scan_rows + 1], 1):
+        matches = len(set(_HEADER_RE.findall(" ".join(str(v) for v in row).lower())))
+        if matches > best_matches: best, best_matches = i, matches
+    return best
+
 def smart_preprocess(df):
     df.columns = [str(c).strip() for c in df.columns]
-    keywords = ['ngày', 'date', 'sản phẩm', 'product', 'doanh thu', 'revenue', 'số lượng', 'quantity', 'khu vực', 'region']
-    best_header_idx = -1
-    max_matches = 0
-    
-    current_matches = sum(1 for c in df.columns if any(k in str(c).lower() for k in keywords))
-    if current_matches >= 2: return df
-    
-    for idx, row in df.head(10).iterrows():
-        row_str = " ".join([str(val).lower() for val in row.values])
-        matches = sum(1 for k in keywords if k in row_str)
-        if matches > max_matches and matches >= 2:
-            max_matches = matches
-            best_header_idx = idx
-            
-    if best_header_idx != -1:
-        new_header = df.iloc[best_header_idx]
-        df = df[best_header_idx + 1:]
+    head = df.head(HEADER_SCAN_ROWS).astype(str).to_numpy().tolist()
+    idx = find_header_row([list(df.columns)] + head)
+    if idx:
+        new_header = df.iloc[idx - 1]
+        df = df[idx:]
         df.columns = new_header
         df.reset_index(drop=True, inplace=True)
     return df
 
 # --- THUẬT TOÁN DỰ BÁO (NEW) ---
-def calculate_trend_forecast(df, date_col, rev_col):
-    """Dự báo doanh thu 3 kỳ tiếp theo bằng Linear Regression đơn giản"""
+def infer_date_format(values, sample_size=1000):
+    """Định dạng ngày (strftime) khớp nhiều giá trị mẫu nhất, None nếu cột không phải ngày dạng chữ.
+    Ứng viên lấy từ pandas cho từng mẫu: ngày trước tháng được ưu tiên khi hòa (dd/mm/yyyy như dayfirst=True),
+    riêng dạng bắt đầu bằng năm luôn là năm-tháng-ngày (dayfirst=True sẽ đọc '2024-03-05' thành 3/5)."""
+    from pandas.tseries.api import guess_datetime_format
+    sample = pd.Series(pd.unique(pd.Series(values, dtype=object).dropna().to_numpy())[:sample_size], dtype=object)
+    sample = sample[sample.map(lambda v: isinstance(v, str) and bool(v.strip()))]
+    if not len(sample): return None
+    candidates = []
+    # Thử cả hai dayfirst có chủ ý: pandas cảnh báo (UserWarning) mỗi khi mẫu không khớp dayfirst đã chọn
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        for v in sample.head(20):
+            for dayfirst in (True, False):
+                fmt = guess_datetime_format(v.strip(), dayfirst=dayfirst)
+                if fmt and fmt.startswith('%Y'): fmt = guess_datetime_format(v.strip(), dayfirst=False) or fmt
+                if fmt and fmt not in candidates: candidates.append(fmt)
+    if not candidates: return None
+    return max(candidates, key=lambda f: pd.to_datetime(sample, format=f, errors='coerce').notna().sum())
+
+def month_periods(dates, date_format=None):
+    """Cột ngày -> Period 'M' (NaT nếu không đọc được). date_format: định dạng đã suy ra một lần cho cả file
+    (infer_date_format), không có thì pandas tự đoán với dayfirst=True. Cột categorical: mỗi giá trị khác nhau
+    chỉ được chuyển một lần."""
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        periods = month_periods(pd.Series(dates.cat.categories.to_numpy(dtype=object)), date_format)
+        return pd.Series(periods.array.take(dates.cat.codes.to_numpy(), allow_fill=True), index=dates.index)
+    if date_format: parsed = pd.to_datetime(dates, format=date_format, errors='coerce')
+    else: parsed = pd.to_datetime(dates, dayfirst=True, errors='coerce')
+    return parsed.dt.to_period('M')
+
+def month_labels(periods):
+    """Period 'M' -> nhãn 'YYYY-MM', NaT -> 'N/A'. Mỗi tháng chỉ định dạng một lần."""
+    codes, uniques = pd.factorize(periods)
+    return np.array([str(u) for u in uniques] + ['N/A'], dtype=object)[codes]
+
+def monthly_revenue(dates, revenue, periods=None):
+    """Doanh thu theo tháng (Series index Period 'M'), bỏ các dòng không đọc được ngày."""
+    if periods is None: periods = month_periods(dates)
+    valid = periods.notna().to_numpy()
+    # Nhóm theo số thứ tự tháng (int64) thay vì từng đối tượng Period
+    ordinals = periods.array.asi8[valid]
+    sums = pd.Series(np.asarray(revenue, dtype='float64')[valid]).groupby(ordinals).sum()
+    sums.index = pd.PeriodIndex.from_ordinals(sums.index.to_numpy(), freq='M')
+    return sums
+
+def forecast_from_monthly(monthly):
+    """Dự báo doanh thu 3 kỳ tiếp theo từ chuỗi doanh thu tháng bằng Linear Regression đơn giản"""
     try:
-        if not date_col or not rev_col: return None
-        
-        # Chuẩn bị dữ liệu time series
-        ts_df = df.copy()
-        ts_df[date_col] = pd.to_datetime(ts_df[date_col], dayfirst=True, errors='coerce')
-        ts_df = ts_df.dropna(subset=[date_col])
-        
-        # Group theo tháng
-        ts_df['period'] = ts_df[date_col].dt.to_period('M')
-        monthly_data = ts_df.groupby('period')[rev_col].sum().reset_index()
-        monthly_data['timestamp'] = monthly_data['period'].dt.to_timestamp()
-        
+        if monthly is None: return None
+        monthly = monthly.sort_index()
+
         # Cần ít nhất 3 điểm dữ liệu để dự báo
-        if len(monthly_data) < 3: return None
+        if len(monthly) < 3: return None
         
         # Tạo biến X (thời gian dạng số) và Y (doanh thu)
-        monthly_data['x'] = np.arange(len(monthly_data))
-        x = monthly_data['x'].values
-        y = monthly_data[rev_col].values
+        x = np.arange(len(monthly))
+        y = monthly.values
         
         # Fit đường thẳng (y = mx + c)
         m, c = np.polyfit(x, y, 1)
         
         # Dự báo 3 tháng tới
-        future_x = np.arange(len(monthly_data), len(monthly_data) + 3)
+        future_x = np.arange(len(monthly), len(monthly) + 3)
         future_y = m * future_x + c
         
         # Format dữ liệu trả về cho Frontend
-        history_labels = monthly_data['period'].astype(str).tolist()
-        history_values = monthly_data[rev_col].tolist()
+        history_labels = [str(p) for p in monthly.index]
+        history_values = monthly.tolist()
         
-        last_period = monthly_data['period'].iloc[-1]
+        last_period = monthly.index[-1]
         future_labels = [(last_period + i).strftime('%Y-%m') for i in range(1, 4)]
         future_values = [max(0, val) for val in future_y] # Không để số âm
         
@@ -106,103 +294,501 @@ def calculate_trend_forecast(df, date_col, rev_col):
         print(f"Forecast Error: {e}")
         return None
 
-def analyze_data(df):
+def calculate_trend_forecast(df, date_col, rev_col):
+    """Dự báo doanh thu 3 kỳ tiếp theo bằng Linear Regression đơn giản"""
     try:
-        df = smart_preprocess(df)
-        df.columns = [str(c).strip().lower() for c in df.columns]
-        
-        col_map = {
-            'product': ['product', 'tên hàng', 'sản phẩm', 'sku', 'name'],
-            'revenue': ['revenue', 'doanh thu', 'thành tiền', 'total', 'sales'],
-            'profit': ['profit', 'lợi nhuận', 'lãi', 'margin'],
-            'quantity': ['quantity', 'số lượng', 'sl', 'qty'],
-            'date': ['date', 'ngày', 'thời gian', 'time'],
-            'category': ['category', 'nhóm', 'loại', 'ngành'],
-            'brand': ['brand', 'thương hiệu', 'hãng'],
-            'region': ['region', 'khu vực', 'tỉnh', 'thành']
-        }
-        
-        detected = {}
-        for key, keywords in col_map.items():
-            detected[key] = None
-            for col in df.columns:
-                if any(k in col for k in keywords):
-                    detected[key] = col
-                    break
-
-        p_col, r_col = detected['product'], detected['revenue']
-        q_col, pr_col = detected['quantity'], detected['profit']
-        
-        if r_col: df[r_col] = df[r_col].apply(clean_currency_text)
-        if pr_col: df[pr_col] = df[pr_col].apply(clean_currency_text)
-        if q_col: df[q_col] = pd.to_numeric(df[q_col], errors='coerce').fillna(0)
-        
-        if not r_col and q_col:
-             price_col = None
-             for col in df.columns:
-                 if any(k in col for k in ['price', 'giá', 'đơn giá']):
-                     price_col = col; break
-             if price_col:
-                 df[price_col] = df[price_col].apply(clean_currency_text)
-                 df['calc_revenue'] = df[q_col] * df[price_col]
-                 r_col = 'calc_revenue'
-
-        # --- TÍNH TOÁN DỰ BÁO ---
-        forecast_data = calculate_trend_forecast(df, detected['date'], r_col)
-
-        universal_data = []
-        export_df = df.head(3000).fillna('')
-        for _, row in export_df.iterrows():
-            rev = float(row[r_col]) if r_col and pd.notnull(row[r_col]) else 0
-            prof = float(row[pr_col]) if pr_col and pd.notnull(row[pr_col]) else 0
-            qty = float(row[q_col]) if q_col and pd.notnull(row[q_col]) else 0
-            
-            # Smart Tags Logic
-            tags = []
-            if prof < 0: tags.append('LỖ')
-            elif prof > 0 and (prof/rev > 0.3): tags.append('LÃI CAO')
-            
-            item = {
-                'product': str(row[p_col]) if p_col else 'Unknown',
-                'revenue': rev, 'profit': prof, 'quantity': qty,
-                'category': str(row[detected['category']]) if detected['category'] else 'Khác',
-                'brand': str(row[detected['brand']]) if detected['brand'] else 'Khác',
-                'region': str(row[detected['region']]) if detected['region'] else 'Khác',
-                'month': str(row[detected['date']]) if detected['date'] else 'N/A',
-                'tags': tags
-            }
-            universal_data.append(item)
-
-        total_rev = sum(x['revenue'] for x in universal_data)
-        total_prof = sum(x['profit'] for x in universal_data)
-        total_qty = sum(x['quantity'] for x in universal_data)
-        
-        stats = {'total_revenue': total_rev, 'total_profit': total_prof, 'total_quantity': total_qty}
-        
-        def get_group(k):
-            grp = {}
-            for x in universal_data:
-                key = x.get(k, 'Khác')
-                if key not in grp: grp[key] = {'rev':0, 'qty':0, 'prof':0}
-                grp[key]['rev'] += x['revenue']
-                grp[key]['qty'] += x['quantity']
-                grp[key]['prof'] += x['profit']
-            return grp
-
-        smart_summary = {
-            'average_margin': (total_prof / total_rev * 100) if total_rev > 0 else 0,
-            'forecast_data': forecast_data, # Dữ liệu dự báo mới
-            'product_details': sorted([{'product': k, 'revenue': v['rev'], 'profit': v['prof'], 'quantity': v['qty']} for k,v in get_group('product').items()], key=lambda x: x['revenue'], reverse=True)[:15],
-            'brand': {k: v['rev'] for k,v in get_group('brand').items()},
-            'category': {k: v['rev'] for k,v in get_group('category').items()},
-            'product_inventory_table': [{'Product':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in get_group('product').items()],
-            'sales_summary_table': [{'Product':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in get_group('product').items()],
-            'profit_analysis_table': [{'Product':k, 'Revenue':v['rev'], 'Profit':v['prof']} for k,v in get_group('product').items()],
-            'category_overview_table': [{'Category':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in get_group('category').items()],
-            'brand_performance_table': [{'Brand':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in get_group('brand').items()]
-        }
+        if not date_col or not rev_col: return None
+        with metrics.span('analyze.forecast', rows=len(df)): return forecast_from_monthly(monthly_revenue(df[date_col], df[rev_col]))
+    except Exception as e:
+        print(f"Forecast Error: {e}")
+        return None
+
+# --- NHẬN DIỆN CỘT ---
+COL_MAP = {
+    'product': ['product', 'tên hàng', 'sản phẩm', 'sku', 'name'],
+    'revenue': ['revenue', 'doanh thu', 'thành tiền', 'total', 'sales'],
+    'profit': ['profit', 'lợi nhuận', 'lãi', 'margin'],
+    'quantity': ['quantity', 'số lượng', 'sl', 'qty'],
+    'date': ['date', 'ngày', 'thời gian', 'time'],
+    'category': ['category', 'nhóm', 'loại', 'ngành'],
+    'brand': ['brand', 'thương hiệu', 'hãng'],
+    'region': ['region', 'khu vực', 'tỉnh', 'thành']
+}
+PRICE_KEYWORDS = ['price', 'giá', 'đơn giá']
+# Mỗi vai trò một regex dạng alternation (một cột có thể khớp nhiều vai trò, như vòng lặp từ khóa trước đây)
+_ROLE_RES = {key: re.compile('|'.join(map(re.escape, keywords))) for key, keywords in COL_MAP.items()}
+_PRICE_RE = re.compile('|'.join(map(re.escape, PRICE_KEYWORDS)))
+
+def detect_columns(columns):
+    """Gán vai trò (product, revenue, ...) cho các cột theo từ khóa. Nếu không có cột doanh thu
+    nhưng có số lượng + đơn giá thì doanh thu = calc_revenue."""
+    detected = {key: next((col for col in columns if rx.search(col)), None) for key, rx in _ROLE_RES.items()}
+    detected['price'] = None
+    if not detected['revenue'] and detected['quantity']:
+        detected['price'] = next((col for col in columns if _PRICE_RE.search(col)), None)
+        if detected['price']: detected['revenue'] = 'calc_revenue'
+    return detected
+
+# --- BỐ CỤC FILE (LAYOUT) ---
+# Cùng một nguồn (cửa hàng, phần mềm xuất) luôn gửi cùng bố cục: vị trí dòng tiêu đề + tên cột.
+# Dấu vân tay bố cục -> vai trò các cột được lưu bền (SQLite), lần sau không phải nhận diện lại.
+LAYOUT_SNIFF_ROWS = HEADER_SCAN_ROWS + 1
+LAYOUT_CACHE_PATH = os.environ.get('DATANA_LAYOUT_CACHE', 'cache/layouts.db')
+LAYOUT_CACHE_TTL = int(os.environ.get('DATANA_LAYOUT_CACHE_TTL', 90 * 24 * 3600))
+# Đổi từ khóa nhận diện -> dấu vân tay đổi theo, mapping cũ tự mất hiệu lực
+_LAYOUT_VERSION = hashlib.sha1(json.dumps([COL_MAP, PRICE_KEYWORDS], ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+_layout_cache = None
+_layout_stats = {'hits': 0, 'misses': 0}
+
+def _layout_store():
+    global _layout_cache
+    if _layout_cache is None:
+        from session_store import SessionStore
+        os.makedirs(os.path.dirname(LAYOUT_CACHE_PATH) or '.', exist_ok=True)
+        _layout_cache = SessionStore(LAYOUT_CACHE_PATH, 'layouts', ttl=LAYOUT_CACHE_TTL, max_bytes=16 * 1024 * 1024)
+    return _layout_cache
 
-        return (stats, {}, {}, {}, {}, [], {}, {}, universal_data, list(df.columns), smart_summary)
+def layout_fingerprint(columns, header_row):
+    """Dấu vân tay bố cục: tên cột đã chuẩn hóa (strip + lower) theo thứ tự + vị trí dòng tiêu đề."""
+    sig = '\x1f'.join(columns)
+    return hashlib.sha1(f"{_LAYOUT_VERSION}\x1e{header_row}\x1e{sig}".encode('utf-8')).hexdigest()
+
+def resolve_layout(rows):
+    """Bố cục từ các dòng đầu file (ingest.sniff_rows): {'fingerprint', 'header' (vị trí dòng tiêu đề),
+    'columns' (tên cột chuẩn hóa), 'detected' (vai trò cột), 'usecols' (vị trí các cột được dùng, None = tất cả)}."""
+    header_row = find_header_row(rows)
+    raw = rows[header_row] if header_row < len(rows) else []
+    columns = [str(c).strip().lower() for c in ingest.header_names(raw)]
+    fingerprint = layout_fingerprint(columns, header_row)
+    store = _layout_store()
+    detected = store.get(fingerprint)
+    _layout_stats['hits' if detected is not None else 'misses'] += 1
+    if detected is None:
+        detected = detect_columns(columns)
+        store[fingerprint] = detected
+    used = {v for v in detected.values() if v and v != 'calc_revenue'}
+    usecols = [i for i, c in enumerate(columns) if c in used]
+    return {'fingerprint': fingerprint, 'header': header_row, 'columns': columns, 'detected': detected,
+            'usecols': usecols or None, 'dtype': column_dtypes(rows[header_row + 1:], usecols or range(len(columns)))}
+
+def column_dtypes(sample_rows, positions):
+    """Kiểu đọc cho từng cột (theo vị trí) từ các dòng mẫu: cột mà mọi ô mẫu đều là chữ không phải số
+    (tên sản phẩm, khu vực, ngày 'dd/mm/yyyy', tiền '1.500.000đ'...) đọc thẳng thành 'category' - mỗi giá trị khác nhau
+    chỉ lưu và xử lý một lần. Cột số để parser tự nhận int64/float64; cột mẫu trống hoặc lẫn số giữ nguyên."""
+    out = {}
+    for i in positions:
+        values = [r[i] for r in sample_rows if i < len(r) and r[i] is not None]
+        if not values or not all(isinstance(v, str) for v in values): continue
+        if pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').notna().any(): continue
+        out[i] = 'category'
+    return out
+
+def sniff_layout(path):
+    """Đọc vài dòng đầu file và xác định bố cục, trước khi đọc đầy đủ (ingest.open_chunks(layout=...))."""
+    with metrics.span('ingest.sniff'): return resolve_layout(ingest.sniff_rows(path, LAYOUT_SNIFF_ROWS))
+
+def layout_cache_stats():
+    out = _layout_store().stats()
+    out.update(_layout_stats)
+    return out
+
+def clean_measures(df, detected):
+    """Chuẩn hóa các cột số (doanh thu, lợi nhuận, số lượng, đơn giá) của một khối dòng."""
+    r_col, pr_col, q_col, price_col = detected['revenue'], detected['profit'], detected['quantity'], detected['price']
+    if r_col and not price_col: df[r_col] = parse_currency_series(df[r_col])
+    if pr_col: df[pr_col] = parse_currency_series(df[pr_col])
+    if q_col:
+        to_qty = lambda s: pd.to_numeric(s, errors='coerce').fillna(0)
+        df[q_col] = by_category(df[q_col], to_qty) if isinstance(df[q_col].dtype, pd.CategoricalDtype) else to_qty(df[q_col])
+    if price_col:
+        df[price_col] = parse_currency_series(df[price_col])
+        df['calc_revenue'] = df[q_col] * df[price_col]
+    return df
+
+# --- TỔNG HỢP TOÀN BỘ DỮ LIỆU ---
+AGG_DIMENSIONS = ('product', 'brand', 'category', 'region')
+MEASURES = ['revenue', 'profit', 'quantity']
+# Chiều của cube: month ở đây là tháng thật 'YYYY-MM' (cột month của raw_data là nhãn ngày gốc)
+CUBE_DIMENSIONS = AGG_DIMENSIONS + ('month',)
+
+def _as_labels(series):
+    """str(giá trị) cho cột phân loại, ô trống -> '' (giống fillna('') + str()). Mỗi giá trị chỉ str() một lần."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    labels = np.array(['' if pd.isna(u) else str(u) for u in uniques], dtype=object)
+    return labels[codes]
+
+def normalize_rows(df, cols):
+    """Chuyển một khối dòng về lược đồ chung: product, revenue, profit, quantity, category, brand, region, month."""
+    n = len(df)
+    def measure(c): return df[c].to_numpy(dtype='float64', na_value=0.0) if c else np.zeros(n)
+    def label(c, default): return _as_labels(df[c]) if c else np.full(n, default, dtype=object)
+    return pd.DataFrame({
+        'product': label(cols.get('product'), 'Unknown'),
+        'revenue': measure(cols.get('revenue')),
+        'profit': measure(cols.get('profit')),
+        'quantity': measure(cols.get('quantity')),
+        'category': label(cols.get('category'), 'Khác'),
+        'brand': label(cols.get('brand'), 'Khác'),
+        'region': label(cols.get('region'), 'Khác'),
+        'month': label(cols.get('date'), 'N/A'),
+    })
+
+def tag_masks(rows):
+    """Smart tags: LỖ khi lợi nhuận âm, LÃI CAO khi lợi nhuận / doanh thu > 30%."""
+    rev, prof = rows['revenue'].to_numpy(), rows['profit'].to_numpy()
+    ratio = np.divide(prof, rev, out=np.full(len(rows), np.inf), where=rev != 0)
+    loss = prof < 0
+    return loss, ~loss & (prof > 0) & (ratio > 0.3)
+
+def rows_to_records(rows):
+    """Các dòng đã chuẩn hóa -> list dict (kèm tags) cho raw_data."""
+    loss, high = tag_masks(rows)
+    records = rows.to_dict('records')
+    for rec, is_loss, is_high in zip(records, loss, high):
+        rec['tags'] = ['LỖ'] if is_loss else (['LÃI CAO'] if is_high else [])
+    return records
+
+def _value_hashes(values):
+    """Hash của từng giá trị: (giá trị số, phần chữ) -> 5, 5.0 và '5' cho cùng hash."""
+    values = pd.Series(values, dtype=object)
+    num = pd.to_numeric(values.map(lambda v: v if isinstance(v, (str, int, float, np.number)) and not isinstance(v, bool) else None),
+                        errors='coerce').astype('float64')
+    text = values.astype(str).where(num.isna(), '')
+    return pd.util.hash_pandas_object(pd.DataFrame({'n': num, 's': text}), index=False).to_numpy()
+
+def row_hashes(df):
+    """Hash 64-bit của từng dòng gốc, dùng để phát hiện dòng đã phân tích khi nối thêm dữ liệu.
+    Mỗi cột chỉ băm các giá trị khác nhau (factorize) rồi tra theo mã; các cột được kết hợp theo kiểu FNV."""
+    h = np.full(len(df), 0xcbf29ce484222325, dtype='uint64')
+    for i in range(df.shape[1]):
+        codes, uniques = pd.factorize(df.iloc[:, i], use_na_sentinel=False)
+        h = (h ^ _value_hashes(uniques)[codes]) * np.uint64(0x100000001b3)
+    return h
+
+def _lookup_counts(keys, counts, query):
+    pos = np.searchsorted(keys, query)
+    pos_ok = np.minimum(pos, max(len(keys) - 1, 0))
+    found = (pos < len(keys)) & (keys[pos_ok] == query) if len(keys) else np.zeros(len(query), dtype=bool)
+    return np.where(found, counts[pos_ok] if len(keys) else 0, 0)
+
+def _combine_counts(keys_a, counts_a, keys_b, counts_b, how):
+    """Gộp hai bảng (hash đã sắp xếp, số lần) bằng phép cộng ('sum') hoặc lấy lớn nhất ('max')."""
+    keys, inv = np.unique(np.concatenate([keys_a, keys_b]), return_inverse=True)
+    if how == 'sum': return keys, np.bincount(inv, weights=np.concatenate([counts_a, counts_b]), minlength=len(keys)).astype('int64')
+    out = np.zeros(len(keys), dtype='int64')
+    np.maximum.at(out, inv, np.concatenate([counts_a, counts_b]))
+    return keys, out
+
+class RowIndex:
+    """Số lần mỗi hash dòng đã được phân tích. Một lần tải file (begin -> new_rows... -> commit) chỉ giữ
+    những dòng vượt quá số lần đã có: tải lại file cũ + dòng mới thì chỉ dòng mới được cộng."""
+    def __init__(self):
+        self.keys, self.counts = np.array([], dtype='uint64'), np.array([], dtype='int64')
+        self.begin()
+
+    def begin(self):
+        self._up_keys, self._up_counts = np.array([], dtype='uint64'), np.array([], dtype='int64')
+
+    def new_rows(self, hashes):
+        """Mask các dòng mới của một khối (thứ tự xuất hiện trong lần tải hiện tại được tính tiếp giữa các khối)."""
+        codes, uniq = pd.factorize(hashes)
+        uniq = np.asarray(uniq, dtype='uint64')
+        rank = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+        before = _lookup_counts(self._up_keys, self._up_counts, uniq)[codes]
+        seen = _lookup_counts(self.keys, self.counts, uniq)[codes]
+        order = np.argsort(uniq)
+        self._up_keys, self._up_counts = _combine_counts(self._up_keys, self._up_counts, uniq[order],
+                                                         np.bincount(codes, minlength=len(uniq))[order], 'sum')
+        return before + rank >= seen
+
+    def commit(self):
+        self.keys, self.counts = _combine_counts(self.keys, self.counts, self._up_keys, self._up_counts, 'max')
+        self.begin()
+
+    def merge(self, other):
+        """Cộng số lần của một RowIndex khác (file khác trong cùng lô)."""
+        self.keys, self.counts = _combine_counts(self.keys, self.counts, other.keys, other.counts, 'sum')
+
+def _merge_sums(a, b):
+    """Cộng hai bảng tổng theo nhãn, giữ thứ tự xuất hiện đầu tiên."""
+    if a is None: return b
+    if b is None: return a
+    return pd.concat([a, b]).groupby(level=list(range(a.index.nlevels)), sort=False).sum()
+
+class SalesAggregate:
+    """Tổng hợp KPI + nhóm theo product/brand/category/region + doanh thu tháng.
+    Cộng dồn theo từng khối dòng (update) và gộp được với nhau (merge)."""
+    def __init__(self):
+        self.row_count = 0
+        self.totals = {m: 0.0 for m in MEASURES}
+        self.tag_counts = {'LỖ': 0, 'LÃI CAO': 0}
+        self.groups = {k: None for k in AGG_DIMENSIONS}
+        self.monthly = None
+        self._group_cache = {}
+        self._cube = None
+        self._cube_parts = []
+        # Trạng thái để nối thêm dữ liệu sau này (xem analyze_chunks(aggregate=...))
+        self.header, self.detected = None, None
+        self.sample = []
+        self.date_format = None
+        self.memory = {}
+        self.seen_rows = RowIndex()
+        self.last_batch = {'rows_read': 0, 'rows_added': 0, 'duplicates': 0}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_group_cache'] = {}
+        return state
+
+    def update(self, rows, monthly=None, months=None):
+        """Cộng một khối dòng đã chuẩn hóa (xem normalize_rows), doanh thu tháng của khối đó
+        và nhãn tháng 'YYYY-MM' của từng dòng (cho cube, mặc định 'N/A')."""
+        if monthly is not None and len(monthly): self.monthly = _merge_sums(self.monthly, monthly)
+        if not len(rows): return self
+        self.row_count += len(rows)
+        for m in MEASURES: self.totals[m] += float(rows[m].sum())
+        loss, high = tag_masks(rows)
+        self.tag_counts['LỖ'] += int(loss.sum())
+        self.tag_counts['LÃI CAO'] += int(high.sum())
+        for k in AGG_DIMENSIONS:
+            self.groups[k] = _merge_sums(self.groups[k], rows.groupby(k, sort=False)[MEASURES].sum())
+        if months is None: months = np.full(len(rows), 'N/A', dtype=object)
+        keys = [rows[k] for k in AGG_DIMENSIONS] + [pd.Series(months, index=rows.index, name='month')]
+        self._add_cube_part(rows[MEASURES].assign(rows=1).groupby(keys, sort=False).sum())
+        self._group_cache.clear()
+        return self
+
+    def _add_cube_part(self, part):
+        if part is None: return
+        self._cube_parts.append(part)
+        if sum(len(p) for p in self._cube_parts) > CUBE_COMPACT_ROWS: self._compact_cube()
+
+    def _compact_cube(self):
+        parts = ([self._cube] if self._cube is not None else []) + self._cube_parts
+        if parts: self._cube = pd.concat(parts).groupby(level=list(range(len(CUBE_DIMENSIONS))), sort=False).sum()
+        self._cube_parts = []
+        if CUBE_MAX_ROWS and self._cube is not None and len(self._cube) > CUBE_MAX_ROWS: self._roll_up_cube()
+
+    def _roll_up_cube(self):
+        """Giữ các sản phẩm doanh thu cao nhất sao cho số ô của chúng <= CUBE_MAX_ROWS / 2, phần còn lại gộp vào CUBE_OTHER
+        (lần gộp tiếp theo chỉ xảy ra khi cube lại vượt ngưỡng). Chỉ chiều sản phẩm được gộp: các ô của CUBE_OTHER
+        vẫn tăng theo số tổ hợp thương hiệu x danh mục x khu vực x tháng."""
+        product = self._cube.index.get_level_values('product')
+        revenue = self._cube['revenue'].groupby(product, sort=False).sum().sort_values(ascending=False, kind='stable')
+        cells = product.value_counts().reindex(revenue.index).cumsum().to_numpy()
+        keep = revenue.index[(cells <= CUBE_MAX_ROWS // 2) & (revenue.index != CUBE_OTHER)]
+        cube = self._cube.reset_index()
+        tail = ~cube['product'].isin(keep)
+        self.cube_rolled_up = self.__dict__.get('cube_rolled_up', 0) + int(cube.loc[tail & (cube['product'] != CUBE_OTHER), 'product'].nunique())
+        cube.loc[tail, 'product'] = CUBE_OTHER
+        self._cube = cube.groupby(list(CUBE_DIMENSIONS), sort=False).sum()
+
+    def cube(self):
+        """DataFrame một dòng cho mỗi tổ hợp (product, brand, category, region, month) đã gặp,
+        với tổng revenue/profit/quantity và số dòng gốc (rows). Xem cube.py."""
+        self._compact_cube()
+        if self._cube is None: return pd.DataFrame(columns=list(CUBE_DIMENSIONS) + MEASURES + ['rows'])
+        return self._cube.reset_index()
+
+    def merge(self, other):
+        """Gộp kết quả của một SalesAggregate khác (vd: từ khối/file khác) vào đây."""
+        self.row_count += other.row_count
+        for m in MEASURES: self.totals[m] += other.totals[m]
+        for t in self.tag_counts: self.tag_counts[t] += other.tag_counts[t]
+        for k in AGG_DIMENSIONS: self.groups[k] = _merge_sums(self.groups[k], other.groups[k])
+        self.monthly = _merge_sums(self.monthly, other.monthly)
+        for part in ([other._cube] if other._cube is not None else []) + other._cube_parts: self._add_cube_part(part)
+        self.seen_rows.merge(other.seen_rows)
+        self.sample = self.sample + other.sample[:max(RAW_SAMPLE_ROWS - len(self.sample), 0)]
+        self._group_cache.clear()
+        return self
+
+    def memory_report(self):
+        """Bộ nhớ dùng cho phân tích: khối dòng đầu tiên sau khi áp kiểu cột (category/số) và các bảng tổng hợp giữ lại."""
+        size = lambda frame: int(frame.memory_usage(deep=True, index=True).sum())
+        cube_parts = ([self._cube] if self._cube is not None else []) + self._cube_parts
+        report = dict(self.__dict__.get('memory', {}))
+        report.update({
+            'groups_bytes': sum(size(g) for g in self.groups.values() if g is not None),
+            'cube_rows': sum(len(p) for p in cube_parts),
+            'cube_bytes': sum(size(p) for p in cube_parts),
+            'row_index_bytes': int(self.seen_rows.keys.nbytes + self.seen_rows.counts.nbytes),
+            'cube_rolled_up_products': self.__dict__.get('cube_rolled_up', 0),
+        })
+        return report
+
+    def get_group(self, k):
+        """{nhãn: {'rev', 'qty', 'prof'}} theo thứ tự xuất hiện, giống cấu trúc cũ.
+        Mỗi chiều chỉ dựng một lần cho tới lần update tiếp theo."""
+        if k in self._group_cache: return self._group_cache[k]
+        grp = self.groups.get(k)
+        if grp is None: return {}
+        self._group_cache[k] = {key: {'rev': r, 'qty': q, 'prof': p} for key, r, q, p in zip(grp.index, grp['revenue'].tolist(), grp['quantity'].tolist(), grp['profit'].tolist())}
+        return self._group_cache[k]
+
+    def top(self, k, n, by='revenue'):
+        """n nhóm lớn nhất theo `by` (giữ thứ tự xuất hiện khi bằng nhau, như sorted())."""
+        grp = self.groups.get(k)
+        if grp is None: return pd.DataFrame(columns=MEASURES)
+        return grp.sort_values(by, ascending=False, kind='stable').head(n)
+
+def build_smart_summary(aggregate, forecast_data):
+    """statistics + smart_summary từ kết quả tổng hợp."""
+    total_rev = aggregate.totals['revenue']
+    total_prof = aggregate.totals['profit']
+    total_qty = aggregate.totals['quantity']
+    
+    stats = {'total_revenue': total_rev, 'total_profit': total_prof, 'total_quantity': total_qty, 'row_count': aggregate.row_count}
+
+    # Mỗi chiều được nhóm đúng một lần; mọi bảng bên dưới đọc từ cùng kết quả
+    products, brands, categories, regions = (aggregate.get_group(k) for k in AGG_DIMENSIONS)
+    top_products = aggregate.top('product', 15)
+
+    smart_summary = {
+        'average_margin': (total_prof / total_rev * 100) if total_rev > 0 else 0,
+        'forecast_data': forecast_data, # Dữ liệu dự báo mới
+        'tag_counts': aggregate.tag_counts,
+        'product_details': [{'product': k, 'revenue': r, 'profit': p, 'quantity': q} for k, r, p, q in zip(top_products.index, top_products['revenue'].tolist(), top_products['profit'].tolist(), top_products['quantity'].tolist())],
+        'brand': {k: v['rev'] for k,v in brands.items()},
+        'category': {k: v['rev'] for k,v in categories.items()},
+        'region': {k: v['rev'] for k,v in regions.items()},
+        'product_inventory_table': [{'Product':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in products.items()],
+        'sales_summary_table': [{'Product':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in products.items()],
+        'profit_analysis_table': [{'Product':k, 'Revenue':v['rev'], 'Profit':v['prof']} for k,v in products.items()],
+        'category_overview_table': [{'Category':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in categories.items()],
+        'brand_performance_table': [{'Brand':k, 'Revenue':v['rev'], 'Quantity':v['qty']} for k,v in brands.items()]
+    }
+    return stats, smart_summary
+
+class AnalysisCancelled(Exception):
+    """on_progress ném lỗi này để dừng phân tích giữa chừng (job bị hủy)."""
+
+class ColumnMismatch(ValueError):
+    """File nối thêm có dòng tiêu đề khác với phân tích ban đầu."""
+
+def analyze_chunks(chunks, sample_rows=None, on_progress=None, aggregate=None):
+    """Phân tích dữ liệu đến theo từng khối (DataFrame) - bộ nhớ tạm chỉ phụ thuộc kích thước một khối.
+    Trạng thái giữ lại (SalesAggregate) tăng theo số nhãn khác nhau, không theo số dòng, trừ hai phần: cube (một dòng
+    cho mỗi tổ hợp nhãn + tháng, giới hạn bằng DATANA_CUBE_MAX_ROWS) và hash dòng chống trùng (16 byte / dòng, tắt bằng
+    DATANA_ROW_DEDUPE=0).
+    Khối đầu tiên quyết định dòng tiêu đề và vai trò các cột; các khối sau dùng lại.
+    on_progress(stage, fraction) được gọi theo các giai đoạn preprocess -> aggregate -> forecast;
+    fraction lấy từ chunks.fraction nếu có (xem ingest.ChunkStream).
+    Tuple kết quả gồm thêm cube (SalesAggregate.cube) cho truy vấn lọc và chính SalesAggregate.
+    chunks.layout (nếu có, xem sniff_layout): dòng tiêu đề + vai trò cột đã xác định trước, các khối chỉ gồm cột được dùng.
+    aggregate: trạng thái của một phân tích trước -> chế độ nối thêm: chỉ các dòng chưa gặp (theo hash dòng)
+    được cộng vào, dự báo tính lại từ doanh thu tháng đã gộp; thời gian tỉ lệ với dữ liệu mới."""
+    report = on_progress or (lambda stage, fraction=None: None)
+    try:
+        aggregate = aggregate or SalesAggregate()
+        appending = aggregate.header is not None
+        universal_data = list(aggregate.sample)
+        sample_rows = RAW_SAMPLE_ROWS if sample_rows is None else sample_rows
+        header, detected = aggregate.header, aggregate.detected
+        batch = {'rows_read': 0, 'rows_added': 0, 'duplicates': 0}
+        aggregate.seen_rows.begin()
+        layout = getattr(chunks, 'layout', None)
+        date_format = getattr(aggregate, 'date_format', None)
+        first = True
+
+        # Mỗi bước được đo theo tên giai đoạn (metrics.py); thời gian đọc file được đo trong ingest.ChunkStream
+        for df in chunks:
+            if first:
+                report('preprocess', getattr(chunks, 'fraction', None))
+                if layout is None:
+                    with metrics.span('analyze.preprocess', rows=len(df)): df = smart_preprocess(df)
+                    names = columns = [str(c).strip().lower() for c in df.columns]
+                else:
+                    # Đã đọc đúng dòng tiêu đề và chỉ các cột được dùng (xem sniff_layout)
+                    columns = layout['columns']
+                    names = columns if layout['usecols'] is None else [columns[i] for i in layout['usecols']]
+                if appending and columns != header: raise ColumnMismatch("Các cột của file không khớp với phân tích ban đầu")
+                header = columns
+                if not appending: detected = layout['detected'] if layout else detect_columns(header)
+                df.columns = names
+                # Định dạng ngày suy ra một lần từ khối đầu, dùng cho mọi khối (và các lần nối thêm)
+                if detected['date'] and not date_format: date_format = infer_date_format(df[detected['date']])
+                aggregate.memory = {'chunk_rows': len(df), 'chunk_bytes': int(df.memory_usage(deep=True).sum()),
+                                    'dtypes': {str(c): str(t) for c, t in df.dtypes.items()}}
+                aggregate.memory['bytes_per_row'] = aggregate.memory['chunk_bytes'] / len(df) if len(df) else 0
+                first = False
+            df.columns = names
+            if not len(df): continue
+
+            batch['rows_read'] += len(df)
+            if ROW_DEDUPE:
+                with metrics.span('analyze.dedupe', rows=len(df)): fresh = aggregate.seen_rows.new_rows(row_hashes(df))
+                if not fresh.all(): df = df[fresh]
+            batch['rows_added'] += len(df)
+            if not len(df): continue
+
+            with metrics.span('analyze.clean_currency', rows=len(df)): df = clean_measures(df, detected)
+            with metrics.span('analyze.aggregate', rows=len(df)):
+                rows = normalize_rows(df, detected)
+                periods = month_periods(df[detected['date']], date_format) if detected['date'] else None
+                monthly = monthly_revenue(None, rows['revenue'], periods) if periods is not None and detected['revenue'] else None
+                aggregate.update(rows, monthly, month_labels(periods) if periods is not None else None)
+            if len(universal_data) < sample_rows:
+                universal_data.extend(rows_to_records(rows.head(sample_rows - len(universal_data))))
+            report('aggregate', getattr(chunks, 'fraction', None))
+
+        if header is None: raise ValueError("File không có dữ liệu")
+        aggregate.seen_rows.commit()
+        batch['duplicates'] = batch['rows_read'] - batch['rows_added']
+        aggregate.header, aggregate.detected, aggregate.sample, aggregate.last_batch = header, detected, universal_data, batch
+        aggregate.date_format = date_format
+
+        report('forecast', 1.0)
+        return aggregate_result(aggregate)
+    except (AnalysisCancelled, ColumnMismatch): raise
     except Exception as e:
         print(f"Analyzer Error: {e}")
-        return ({}, {}, {}, {}, {}, [], {}, {}, [], [], {})
\ No newline at end of file
+        return ({}, {}, {}, {}, {}, [], {}, {}, [], [], {}, None, None)
+
+def aggregate_result(aggregate, columns=None):
+    """Tuple kết quả của analyze_chunks từ một SalesAggregate đã tổng hợp xong (dự báo tính ở đây)."""
+    with metrics.span('analyze.forecast'): forecast_data = forecast_from_monthly(aggregate.monthly)
+    with metrics.span('analyze.summary', rows=aggregate.row_count): stats, smart_summary = build_smart_summary(aggregate, forecast_data)
+    if columns is None: columns = aggregate.header + (['calc_revenue'] if aggregate.detected['price'] else [])
+    with metrics.span('analyze.cube') as s:
+        c = aggregate.cube()
+        s.rows = len(c)
+    return (stats, {}, {}, {}, {}, [], {}, {}, aggregate.sample, columns, smart_summary, c, aggregate)
+
+def source_summary(name, aggregate, top=5):
+    """Tóm tắt một nguồn (file) trong phân tích gộp: KPI, vai trò các cột đã nhận diện, sản phẩm dẫn đầu."""
+    top_products = aggregate.top('product', top)
+    return {
+        'source': name,
+        'row_count': aggregate.row_count,
+        'total_revenue': aggregate.totals['revenue'],
+        'total_profit': aggregate.totals['profit'],
+        'total_quantity': aggregate.totals['quantity'],
+        'columns': {k: v for k, v in aggregate.detected.items() if v},
+        'region': {k: v['rev'] for k, v in aggregate.get_group('region').items()},
+        'top_products': [{'product': k, 'revenue': r} for k, r in zip(top_products.index, top_products['revenue'].tolist())],
+    }
+
+def analyze_sources(parts):
+    """Gộp kết quả của nhiều file (mỗi file một SalesAggregate, phân tích độc lập - có thể song song,
+    mỗi file tự dò dòng tiêu đề và vai trò cột) thành một phân tích.
+    parts: list (tên nguồn, SalesAggregate). Trả về (tuple giống analyze_chunks, list source_summary theo thứ tự).
+    Các file khác tiêu đề vẫn gộp được vì đều đã chuẩn hóa về normalize_rows; khi đó trạng thái gộp không giữ
+    header (lần nối thêm sau sẽ dò lại cột theo file mới)."""
+    total = SalesAggregate()
+    for _, agg in parts: total.merge(agg)
+    headers = [agg.header for _, agg in parts]
+    if all(h == headers[0] for h in headers): total.header, total.detected = headers[0], parts[0][1].detected
+    columns = []
+    for _, agg in parts:
+        columns += [c for c in agg.header + (['calc_revenue'] if agg.detected['price'] else []) if c not in columns]
+    return aggregate_result(total, columns), [source_summary(name, agg) for name, agg in parts]
+
+def iter_frame_chunks(df, chunk_rows=None):
+    """Chia DataFrame đã nằm trong bộ nhớ thành các khối AGG_CHUNK_ROWS dòng."""
+    chunk_rows = chunk_rows or AGG_CHUNK_ROWS
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def analyze_data(df, sample_rows=None):
+    return analyze_chunks(iter_frame_chunks(df), sample_rows)
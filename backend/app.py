@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
@@ -7,14 +7,13 @@ from werkzeug.utils import secure_filename
 from datetime import datetime, timezone 
 import os
 import uuid
-import pandas as pd
+import importlib
 import json
-import requests
+import pickle
 import re
+import sys
 import time
-from bs4 import BeautifulSoup
 import traceback
-import numpy as np 
 
 # --- CẤU HÌNH ---
 from dotenv import load_dotenv
@@ -25,50 +24,74 @@ MY_GROQ_KEY = os.environ.get("GROQ_API_KEY", "gsk_j86uKSZdfwEVUc0CvH3MWGdyb3FYCO
 GROQ_MODEL_ID = "llama-3.3-70b-versatile" 
 GROQ_TITLE_MODEL_ID = "llama-3.1-8b-instant" 
 
-# --- JSON ENCODER FIX QUAN TRỌNG ---
-class CustomJsonEncoder(json.JSONEncoder):
-    """Buộc các kiểu dữ liệu NumPy phải chuyển đổi sang Python gốc."""
-    def default(self, obj):
-        if isinstance(obj, (np.integer, np.int64)): return int(obj)
-        elif isinstance(obj, (np.floating, np.float64)): return float(obj)
-        elif isinstance(obj, np.ndarray): return obj.tolist()
-        elif isinstance(obj, datetime): return obj.isoformat()
-        return super(CustomJsonEncoder, self).default(obj)
+# --- JSON: serialization.py (orjson, hiểu sẵn kiểu NumPy) cho jsonify, request.get_json và lưu trữ ---
+import serialization
+from flask.json.provider import JSONProvider
+
+class FastJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs): return serialization.dumps_text(obj)
+    def loads(self, s, **kwargs): return serialization.loads(s)
+    def response(self, *args, **kwargs):
+        # bytes từ bộ mã hóa dùng thẳng làm body (không qua str)
+        return json_response(serialization.dumps(self._prepare_response_obj(args, kwargs)))
 
 app = Flask(__name__, static_folder="../frontend", static_url_path="/")
-app.json_encoder = CustomJsonEncoder 
-
-# Config cho Flask 2.2+ (Optional)
-try:
-    from flask.json.provider import DefaultJSONProvider
-    class CustomJSONProvider(DefaultJSONProvider):
-        def default(self, obj):
-            if isinstance(obj, (np.integer, np.int64)): return int(obj)
-            elif isinstance(obj, (np.floating, np.float64)): return float(obj)
-            elif isinstance(obj, np.ndarray): return obj.tolist()
-            elif isinstance(obj, datetime): return obj.isoformat()
-            return super().default(obj)
-    app.json = CustomJSONProvider(app)
-except: pass
+app.json = FastJSONProvider(app)
+
+# Response từ JSON đã mã hóa sẵn (vd kết quả phân tích: mã hóa một lần, vừa lưu vừa trả về)
+def json_response(body, status=200):
+    return app.response_class(body, status=status, mimetype='application/json')
 
 # --- KẾT NỐI AI ---
-GROQ_AVAILABLE = False
-client = None
-try:
-    from groq import Groq
-    if MY_GROQ_KEY and "gsk_" in MY_GROQ_KEY:
-        client = Groq(api_key=MY_GROQ_KEY)
-        GROQ_AVAILABLE = True
-        print("✅ Đã kết nối Groq AI")
-except: pass
+import llm_client
+llm = llm_client.LLMClient(MY_GROQ_KEY, GROQ_MODEL_ID, cache=llm_client.PromptCache())
+GROQ_AVAILABLE = llm.available
+if GROQ_AVAILABLE: print("✅ Đã cấu hình Groq AI (kết nối ở lời gọi đầu tiên)")
 
 # --- IMPORT ANALYZER ---
-try: import analyzer
-except: print("⚠️ Chưa có module analyzer")
+# Các module cần pandas / NumPy (~250ms import) chỉ được nạp ở request đầu tiên dùng tới chúng: app khởi động nhanh,
+# request không phân tích (đăng nhập, lịch sử, chat theo bản tóm tắt) không phải chờ. serve.py nạp sẵn trước khi fork.
+class LazyModule:
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None: self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+    @property
+    def loaded(self):
+        return self.__name in sys.modules
+
+    @property
+    def available(self):
+        """Nạp module nếu chưa nạp; False nếu không import được (vd thiếu pandas)."""
+        try:
+            if self.__module is None: self.__module = importlib.import_module(self.__name)
+        except ImportError: return False
+        return True
+
+HEAVY_MODULES = ('analyzer', 'ingest', 'analysis_store', 'cube', 'forecasting', 'prompt_context', 'recommendations')
+analyzer, ingest, analysis_store, cube, forecasting, prompt_context, recommendations = map(LazyModule, HEAVY_MODULES)
+np = LazyModule('numpy')
+import jobs
+import result_cache
+import news
+import metrics
+from session_store import SessionStore, LRUCache, SESSION_TTL_SECONDS
 
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'datana-super-secret-2025')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATANA_DATABASE_URL', 'sqlite:///database.db')
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# SQLite dùng chung giữa nhiều worker: WAL (đọc không chặn ghi), chờ khóa tới DB_BUSY_TIMEOUT giây thay vì lỗi
+# "database is locked", kết nối được giữ trong pool thay vì mở lại mỗi request
+DB_BUSY_TIMEOUT = float(os.environ.get('DATANA_DB_BUSY_TIMEOUT', 30))
+DB_CACHE_MB = int(os.environ.get('DATANA_DB_CACHE_MB', 16))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DATANA_DB_POOL_SIZE', 5)), 'max_overflow': 10,
+    'connect_args': {'timeout': DB_BUSY_TIMEOUT, 'check_same_thread': False},
+} if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') else {}
 CORS(app) 
 
 db = SQLAlchemy(app)
@@ -85,9 +108,15 @@ class Analysis(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     filename = db.Column(db.String(200))
-    result_json = db.Column(db.Text)
+    # Bản tóm tắt nhỏ (statistics + các chỉ số smart_summary) cho chat/forecast;
+    # raw_data + bảng nằm trong thư mục dạng cột data_path (analysis_store), result_json chỉ còn cho bản ghi chưa chuyển
+    summary_json = db.Column(db.Text)
+    data_path = db.Column(db.String(255))
+    result_json = db.deferred(db.Column(db.Text))
     title = db.Column(db.String(255), default='Phân tích mới')
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Danh sách phiên của user, mới nhất trước (SQLite tự thêm rowid = id vào cuối index -> đủ cho keyset (timestamp, id))
+    __table_args__ = (db.Index('ix_analysis_user_timestamp', 'user_id', 'timestamp'),)
 
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -96,61 +125,222 @@ class ChatHistory(db.Model):
     sender = db.Column(db.String(10), nullable=False) 
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    __table_args__ = (db.Index('ix_chat_history_session_timestamp', 'session_id', 'timestamp'),)
+
+def sqlite_pragmas(conn, _):
+    cur = conn.cursor()
+    for pragma in ("journal_mode=WAL", "synchronous=NORMAL", f"busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}",
+                   "temp_store=MEMORY", f"cache_size=-{DB_CACHE_MB * 1024}"):
+        cur.execute(f"PRAGMA {pragma}")
+    cur.close()
+
+# Thêm cột / index mới cho database cũ (create_all không tự ALTER TABLE, không thêm index vào bảng đã có)
+def ensure_schema():
+    db.create_all()
+    cols = [r[1] for r in db.session.execute(db.text("PRAGMA table_info(analysis)"))]
+    for name, kind in (('summary_json', 'TEXT'), ('data_path', 'VARCHAR(255)')):
+        if name not in cols: db.session.execute(db.text(f"ALTER TABLE analysis ADD COLUMN {name} {kind}"))
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes: index.create(db.engine, checkfirst=True)
 
 @login_manager.user_loader
 def load_user(uid): return db.session.get(User, int(uid))
 
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite': db.event.listen(db.engine, 'connect', sqlite_pragmas)
+    ensure_schema()
+    # Worker fork từ process đã nạp sẵn (serve.py) không dùng lại kết nối trong pool của process cha
+    engine = db.engine
+    if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
 if not os.path.exists(app.config['UPLOAD_FOLDER']): os.makedirs(app.config['UPLOAD_FOLDER'])
 
-TEMP_SESSIONS = {}
-TEMP_CHAT_HISTORY = {} 
+# Phiên của khách (chưa đăng nhập): SQLite cục bộ, dùng chung giữa các worker, có TTL + giới hạn dung lượng
+os.makedirs(app.instance_path, exist_ok=True)
+TEMP_STORE_PATH = os.path.join(app.instance_path, 'temp_sessions.db')
+TEMP_SESSIONS = SessionStore(TEMP_STORE_PATH, 'temp_sessions')
+TEMP_CHAT_HISTORY = SessionStore(TEMP_STORE_PATH, 'temp_chat_history')
+TEMP_SUMMARIES = SessionStore(TEMP_STORE_PATH, 'temp_summaries')
+# Khóa nối thêm dữ liệu theo phiên (xem claim_append), tự hết hạn nếu worker giữ khóa chết giữa chừng
+APPEND_LOCKS = SessionStore(TEMP_STORE_PATH, 'append_locks', ttl=int(os.environ.get('DATANA_APPEND_LOCK_TTL', 600)))
 
-# --- HÀM TÌM KIẾM THÔNG MINH ---
-def search_google_trends(keyword):
-    """Tìm tin tức thị trường để bổ sung kiến thức cho AI"""
-    if not keyword or len(keyword) < 2: return "Không có dữ liệu tìm kiếm cụ thể."
-    try:
-        url = "https://html.duckduckgo.com/html/"
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        # Tìm kiếm tin tức tiếng Việt mới nhất 2024-2025
-        res = requests.post(url, data={'q': f"thị trường {keyword} việt nam xu hướng 2025"}, headers=headers, timeout=4) 
-        soup = BeautifulSoup(res.text, 'html.parser')
-        
-        results = []
-        for a in soup.find_all('a', class_='result__a', limit=3):
-            results.append(f"- {a.get_text(strip=True)}")
-            
-        return "\n".join(results) if results else "Không tìm thấy tin tức mới."
-    except: return "Hệ thống tìm kiếm đang bảo trì."
+# Dữ liệu phân tích đã lưu (dạng cột, .npy) của user đăng nhập
+ANALYSIS_DATA_DIR = os.environ.get('DATANA_ANALYSIS_DIR', os.path.join(app.instance_path, 'analyses'))
+# Cube cho API lọc/drill-down, theo session id (phiên tạm bị xóa sau SESSION_TTL_SECONDS)
+CUBE_DIR = os.environ.get('DATANA_CUBE_DIR', os.path.join(app.instance_path, 'cubes'))
+CUBE_CACHE = LRUCache(int(os.environ.get('DATANA_CUBE_CACHE_SIZE', 64)))
+BATCH_MAX_FILES = int(os.environ.get('DATANA_BATCH_MAX_FILES', 200))
+STATE_DIR = os.environ.get('DATANA_STATE_DIR', os.path.join(app.instance_path, 'states'))
 
 # --- HÀM GỌI AI (CORE) ---
-def call_ai_with_retry(sys_msg, usr_msg):
-    if not GROQ_AVAILABLE: return "Lỗi: Chưa kết nối AI. Vui lòng kiểm tra API Key."
-    for _ in range(3): # Thử lại 3 lần nếu lỗi mạng
+AI_PARAMS = {'temperature': 0.6, 'max_tokens': 2500}  # Tăng token để trả lời dài hơn
+
+# cache=True: prompt giống hệt (cùng dữ liệu phiên + câu hỏi) trả lại câu trả lời đã lưu, không gọi LLM
+# Token / số lần thử lại được llm_client ghi vào metrics; ở đây đếm kết quả và thời gian cả lời gọi
+def call_ai_with_retry(sys_msg, usr_msg, cache=False):
+    if not GROQ_AVAILABLE:
+        metrics.count('datana_llm_calls_total', outcome='unavailable')
+        return "Lỗi: Chưa kết nối AI. Vui lòng kiểm tra API Key."
+    try:
+        with metrics.span('llm.complete'): text = llm.complete(sys_msg, usr_msg, cache=cache, **AI_PARAMS)
+        metrics.count('datana_llm_calls_total', outcome='ok')
+        return text
+    except llm_client.LLMError as e:
+        metrics.count('datana_llm_calls_total', outcome='busy' if isinstance(e, llm_client.LLMBusy) else 'error')
+        return AI_BUSY_REPLY
+
+# Các trường smart_summary mà chat/forecast cần (không gồm các *_table lớn)
+SUMMARY_KEYS = ('average_margin', 'forecast_data', 'tag_counts', 'product_details', 'brand', 'category', 'region')
+SUMMARY_CACHE = LRUCache(int(os.environ.get('DATANA_SUMMARY_CACHE_SIZE', 512)))
+
+def summarize_result(res):
+    smart = res.get('smart_summary', {})
+    return {'statistics': res.get('statistics', {}), 'smart_summary': {k: smart[k] for k in SUMMARY_KEYS if k in smart}}
+
+# Dấu cube của phiên, giống cube.stamp nhưng không import cube (pandas / NumPy): chat theo bản tóm tắt không nạp chúng
+def cube_stamp(sid):
+    try: st = os.stat(os.path.join(CUBE_DIR, sid, 'meta.json'))
+    except OSError: return None
+    return st.st_ino, st.st_mtime_ns
+
+# Khóa LRU theo dấu cube của phiên: nối thêm dữ liệu ở worker nào thì cube đổi dấu, mọi worker đọc lại bản mới
+def summary_key(sid):
+    return sid, cube_stamp(sid)
+
+# Bản tóm tắt của phiên (statistics + smart_summary rút gọn), giải mã một lần rồi giữ trong LRU
+def get_session_summary(sid):
+    if not sid: return {}, "Phân tích mới", ""
+    is_db = sid.startswith("db_")
+    if is_db and not owns_analysis(sid): return {}, "Phân tích mới", ""
+    key = summary_key(sid)
+    hit = SUMMARY_CACHE.get(key)
+    if hit: return hit
+    if is_db:
         try:
-            return client.chat.completions.create(
-                model=GROQ_MODEL_ID,
-                messages=[{"role":"system","content":sys_msg},{"role":"user","content":usr_msg}],
-                temperature=0.6, 
-                max_tokens=2500 # Tăng token để trả lời dài hơn
-            ).choices[0].message.content
-        except: time.sleep(1)
-    return "AI đang quá tải, vui lòng thử lại sau giây lát."
-
-# Hàm lấy dữ liệu phiên làm việc
+            rec = db.session.get(Analysis, int(sid.split("_")[1]))
+            if not rec: return {}, "Phân tích mới", ""
+            if rec.summary_json is None:
+                # Bản ghi cũ: tạo tóm tắt từ result_json một lần và lưu lại
+                rec.summary_json = serialization.dumps_text(summarize_result(serialization.loads(rec.result_json or '{}')))
+                db.session.commit()
+            entry = (serialization.loads(rec.summary_json), rec.title, rec.filename)
+        except: return {}, "Phân tích mới", ""
+    else:
+        sess = TEMP_SUMMARIES.get(sid)
+        if not sess: return {}, "Phân tích mới", ""
+        entry = (sess, sess.get('title'), sess.get('filename'))
+    SUMMARY_CACHE.set(key, entry)
+    return entry
+
+def set_session_title(sid, title):
+    if sid.startswith("db_"):
+        rec = own_analysis(sid)
+        if rec: 
+            rec.title = title
+            db.session.commit()
+    else:
+        TEMP_SESSIONS.patch(sid, title=title)
+        TEMP_SUMMARIES.patch(sid, title=title)
+    key = summary_key(sid)
+    hit = SUMMARY_CACHE.get(key)
+    if hit: SUMMARY_CACHE.set(key, (hit[0], title, hit[2]))
+
+# Hàm lấy dữ liệu phiên làm việc (toàn bộ kết quả, gồm raw_data + bảng).
+# "db_<id>" đoán được -> chỉ trả cho user sở hữu phân tích; phiên khách dùng id ngẫu nhiên (uuid4) làm khóa truy cập
 def get_session_data(sid):
-    if sid.startswith("db_") and current_user.is_authenticated:
+    if not sid: return {}, "Phân tích mới", ""
+    if sid.startswith("db_"):
         try:
-            rec = db.session.get(Analysis, int(sid.split("_")[1]))
-            if rec: return json.loads(rec.result_json), rec.title, rec.filename
+            rec = own_analysis(sid)
+            if rec: return load_analysis_data(rec), rec.title, rec.filename
         except: pass
-    elif sid in TEMP_SESSIONS:
-        sess = TEMP_SESSIONS[sid]
-        return sess, sess.get('title'), sess.get('filename')
+    else:
+        sess = TEMP_SESSIONS.get(sid)
+        if sess: return sess, sess.get('title'), sess.get('filename')
     return {}, "Phân tích mới", ""
 
 # --- API ROUTES ---
 
+NO_DATA_REPLY = "⚠️ Tôi chưa thấy file dữ liệu nào. Vui lòng tải lên file Excel/CSV để tôi phân tích số liệu giúp bạn."
+AI_BUSY_REPLY = "AI đang quá tải, vui lòng thử lại sau giây lát."
+
+# Phần dữ liệu khi phiên chưa có cube: KPI + top 5 sản phẩm từ bản tóm tắt
+def summary_context(ctx, filename):
+    stats = ctx.get('statistics', {})
+    smart_sum = ctx.get('smart_summary', {})
+    top_products = smart_sum.get('product_details', [])[:5]
+    top_categories = list(smart_sum.get('category', {}).keys())[:3]
+    return f"""
+    [DỮ LIỆU TỪ FILE CỦA NGƯỜI DÙNG - {filename}]
+    - Tổng doanh thu: {stats.get('total_revenue', 0):,.0f} VNĐ
+    - Tổng lợi nhuận: {stats.get('total_profit', 0):,.0f} VNĐ
+    - Tổng số lượng bán: {stats.get('total_quantity', 0):,.0f} sản phẩm
+    - Biên lợi nhuận trung bình: {smart_sum.get('average_margin', 0):.1f}%
+
+    [TOP SẢN PHẨM BÁN CHẠY NHẤT]
+    {json.dumps([{ 'Tên': p['product'], 'Doanh thu': f"{p['revenue']:,.0f}", 'Lợi nhuận': f"{p['profit']:,.0f}" } for p in top_products], ensure_ascii=False)}
+
+    [DANH MỤC CHÍNH]: {', '.join(top_categories)}
+    """
+
+# System prompt cho chat: dữ liệu liên quan tới câu hỏi (trong ngân sách token) + tin thị trường nếu câu hỏi liên quan
+def build_chat_prompt(msg, ctx, filename, sid=None):
+    top_products = ctx.get('smart_summary', {}).get('product_details', [])[:1]
+
+    # Tin thị trường (nếu câu hỏi liên quan) được tải song song trong lúc dựng phần dữ liệu bên dưới
+    pending_news = None
+    if any(kw in msg.lower() for kw in ['thị trường', 'xu hướng', 'trend', 'bên ngoài', 'đối thủ', 'tương lai', 'dự báo']):
+        pending_news = news.lookup(top_products[0]['product'] if top_products else "kinh doanh")
+
+    # Chỉ đưa vào prompt các lát dữ liệu liên quan tới câu hỏi (digest + chỉ mục từ khóa của cube)
+    with metrics.span('chat.context'):
+        c = get_cube(sid)
+        data_context = prompt_context.context(c, msg, filename) if c is not None else summary_context(ctx, filename)
+
+    # 2. Tìm kiếm thông tin thị trường (Nếu câu hỏi liên quan)
+    market_info = ""
+    if pending_news is not None:
+        with metrics.span('news.wait'): news_text = pending_news.result()
+        market_info = f"\n[TIN TỨC THỊ TRƯỜNG THỰC TẾ 2024-2025]\n{news_text}\n(Hãy kết hợp tin tức này với dữ liệu nội bộ để đưa ra lời khuyên)."
+
+    # 3. System Prompt (Luật chơi cho AI)
+    system_prompt = f"""Bạn là Chuyên gia Tư vấn Chiến lược Kinh doanh (Senior Business Analyst). 
+    Bạn đang nói chuyện với chủ doanh nghiệp.
+
+    NHIỆM VỤ CỦA BẠN:
+    1. Trả lời câu hỏi dựa trên DỮ LIỆU THẬT từ file Excel (được cung cấp bên dưới).
+    2. Luôn dẫn chứng bằng số liệu cụ thể (Ví dụ: thay vì nói "bán tốt", hãy nói "đạt doanh thu 500 triệu").
+    3. Nếu người dùng hỏi về chiến lược, hãy kết hợp dữ liệu nội bộ với kiến thức thị trường.
+    4. Phong cách: Chuyên nghiệp, sắc sảo, ngắn gọn, dùng định dạng Markdown (in đậm số liệu quan trọng).
+
+    DỮ LIỆU CẦN PHÂN TÍCH:
+    {data_context}
+    {market_info}
+    """
+    return system_prompt
+
+# Lưu lịch sử chat + tự đặt tiêu đề phiên. Trả về tiêu đề hiện tại
+def record_chat(sid, msg, ai_response, title):
+    # Lưu lịch sử
+    if current_user.is_authenticated and sid.startswith("db_"):
+        db.session.add(ChatHistory(user_id=current_user.id, session_id=sid, sender='user', message=msg))
+        db.session.add(ChatHistory(user_id=current_user.id, session_id=sid, sender='ai', message=ai_response))
+        with metrics.span('db.commit'): db.session.commit()
+    elif sid:
+        TEMP_CHAT_HISTORY.append(sid,
+            {'sender': 'user', 'message': msg, 'timestamp': datetime.now(timezone.utc).isoformat()},
+            {'sender': 'ai', 'message': ai_response, 'timestamp': datetime.now(timezone.utc).isoformat()})
+
+    # Tự động đặt tiêu đề phiên nếu chưa có
+    session_title = title
+    if title == "Phân tích mới" and len(msg) > 5:
+        # Logic đơn giản: Lấy 5-6 từ đầu làm tiêu đề
+        session_title = " ".join(msg.split()[:6]) + "..."
+        if not sid.startswith("db_") or current_user.is_authenticated:
+            set_session_title(sid, session_title)
+    return session_title
+
 # 1. API CHAT (NÂNG CẤP MẠNH MẼ)
 @app.route("/api/chat", methods=["POST"])
 def chat_endpoint():
@@ -161,98 +351,75 @@ def chat_endpoint():
         msg = data.get("message", "").strip()
         sid = data.get("session_id")
         
-        # 1. Lấy Dữ liệu từ File Excel của người dùng
-        ctx, title, filename = get_session_data(sid)
-        
-        if not ctx: 
-            return jsonify({"response": "⚠️ Tôi chưa thấy file dữ liệu nào. Vui lòng tải lên file Excel/CSV để tôi phân tích số liệu giúp bạn."})
-
-        # Trích xuất các chỉ số quan trọng (KPIs)
-        stats = ctx.get('statistics', {})
-        smart_sum = ctx.get('smart_summary', {})
-        
-        # Lấy Top sản phẩm & Ngành hàng để AI hiểu ngữ cảnh
-        top_products = smart_sum.get('product_details', [])[:5]
-        top_categories = list(smart_sum.get('category', {}).keys())[:3]
-        
-        # Chuẩn bị dữ liệu dạng văn bản để "mớm" cho AI
-        data_context = f"""
-        [DỮ LIỆU TỪ FILE CỦA NGƯỜI DÙNG - {filename}]
-        - Tổng doanh thu: {stats.get('total_revenue', 0):,.0f} VNĐ
-        - Tổng lợi nhuận: {stats.get('total_profit', 0):,.0f} VNĐ
-        - Tổng số lượng bán: {stats.get('total_quantity', 0):,.0f} sản phẩm
-        - Biên lợi nhuận trung bình: {smart_sum.get('average_margin', 0):.1f}%
-        
-        [TOP SẢN PHẨM BÁN CHẠY NHẤT]
-        {json.dumps([{ 'Tên': p['product'], 'Doanh thu': f"{p['revenue']:,.0f}", 'Lợi nhuận': f"{p['profit']:,.0f}" } for p in top_products], ensure_ascii=False)}
-        
-        [DANH MỤC CHÍNH]: {', '.join(top_categories)}
-        """
-
-        # 2. Tìm kiếm thông tin thị trường (Nếu câu hỏi liên quan)
-        market_info = ""
-        if any(kw in msg.lower() for kw in ['thị trường', 'xu hướng', 'trend', 'bên ngoài', 'đối thủ', 'tương lai', 'dự báo']):
-            keyword = top_products[0]['product'] if top_products else "kinh doanh"
-            news = search_google_trends(keyword)
-            market_info = f"\n[TIN TỨC THỊ TRƯỜNG THỰC TẾ 2024-2025]\n{news}\n(Hãy kết hợp tin tức này với dữ liệu nội bộ để đưa ra lời khuyên)."
-
-        # 3. System Prompt (Luật chơi cho AI)
-        system_prompt = f"""Bạn là Chuyên gia Tư vấn Chiến lược Kinh doanh (Senior Business Analyst). 
-        Bạn đang nói chuyện với chủ doanh nghiệp.
-        
-        NHIỆM VỤ CỦA BẠN:
-        1. Trả lời câu hỏi dựa trên DỮ LIỆU THẬT từ file Excel (được cung cấp bên dưới).
-        2. Luôn dẫn chứng bằng số liệu cụ thể (Ví dụ: thay vì nói "bán tốt", hãy nói "đạt doanh thu 500 triệu").
-        3. Nếu người dùng hỏi về chiến lược, hãy kết hợp dữ liệu nội bộ với kiến thức thị trường.
-        4. Phong cách: Chuyên nghiệp, sắc sảo, ngắn gọn, dùng định dạng Markdown (in đậm số liệu quan trọng).
-        
-        DỮ LIỆU CẦN PHÂN TÍCH:
-        {data_context}
-        {market_info}
-        """
-
-        # Gọi AI
-        ai_response = call_ai_with_retry(system_prompt, msg)
-        
-        # Lưu lịch sử
-        if current_user.is_authenticated and sid.startswith("db_"):
-            db.session.add(ChatHistory(user_id=current_user.id, session_id=sid, sender='user', message=msg))
-            db.session.add(ChatHistory(user_id=current_user.id, session_id=sid, sender='ai', message=ai_response))
-            db.session.commit()
-        elif sid:
-            if sid not in TEMP_CHAT_HISTORY: TEMP_CHAT_HISTORY[sid] = []
-            TEMP_CHAT_HISTORY[sid].append({'sender': 'user', 'message': msg, 'timestamp': datetime.now(timezone.utc).isoformat()})
-            TEMP_CHAT_HISTORY[sid].append({'sender': 'ai', 'message': ai_response, 'timestamp': datetime.now(timezone.utc).isoformat()})
-
-        # Tự động đặt tiêu đề phiên nếu chưa có
-        session_title = title
-        if title == "Phân tích mới" and len(msg) > 5:
-            # Logic đơn giản: Lấy 5-6 từ đầu làm tiêu đề
-            session_title = " ".join(msg.split()[:6]) + "..."
-            if current_user.is_authenticated and sid.startswith("db_"):
-                rec = db.session.get(Analysis, int(sid.split("_")[1]))
-                if rec: 
-                    rec.title = session_title
-                    db.session.commit()
-            elif sid in TEMP_SESSIONS:
-                TEMP_SESSIONS[sid]['title'] = session_title
+        # Lấy Dữ liệu từ File Excel của người dùng (chỉ bản tóm tắt, không tải raw_data)
+        ctx, title, filename = get_session_summary(sid)
+        if not ctx: return jsonify({"response": NO_DATA_REPLY})
 
+        ai_response = call_ai_with_retry(build_chat_prompt(msg, ctx, filename, sid), msg, cache=True)
         return jsonify({
             "response": ai_response,
-            "session_title": session_title
+            "session_title": record_chat(sid, msg, ai_response, title)
         })
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {serialization.dumps_text(payload)}\n\n"
+
+# 1b. API CHAT STREAM (SSE): gửi từng đoạn câu trả lời ngay khi model sinh ra.
+# Sự kiện: delta {text} ... rồi done {response, session_title} hoặc error {error}.
+# Trình duyệt ngắt kết nối -> lần ghi kế tiếp thất bại, generator bị đóng và stream tới LLM đóng theo.
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream_endpoint():
+    data = request.get_json(force=True, silent=True)
+    if not data: return jsonify({"error": "No data"}), 400
+    msg = data.get("message", "").strip()
+    sid = data.get("session_id")
+    ctx, title, filename = get_session_summary(sid)
+
+    @stream_with_context
+    def events():
+        yield ": open\n\n"  # gửi header ngay, trước khi tìm tin thị trường / chờ token đầu
+        if not ctx:
+            yield sse_event("done", {"response": NO_DATA_REPLY})
+            return
+        if not GROQ_AVAILABLE:
+            yield sse_event("error", {"error": "Lỗi: Chưa kết nối AI. Vui lòng kiểm tra API Key."})
+            return
+        parts, tokens = [], None
+        try:
+            # Dựng prompt (digest cube, tin thị trường) cũng trong try: lỗi ở đây vẫn báo cho client bằng sự kiện error
+            tokens = llm.stream(build_chat_prompt(msg, ctx, filename, sid), msg, cache=True, **AI_PARAMS)
+            for text in tokens:
+                if not text:
+                    yield ": keep-alive\n\n"
+                    continue
+                parts.append(text)
+                yield sse_event("delta", {"text": text})
+        except llm_client.LLMError as e:
+            yield sse_event("error", {"error": AI_BUSY_REPLY if isinstance(e, llm_client.LLMBusy) or not parts else str(e)})
+            return
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+            return
+        finally:
+            if tokens is not None: tokens.close()
+        ai_response = "".join(parts)
+        yield sse_event("done", {"response": ai_response, "session_title": record_chat(sid, msg, ai_response, title)})
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # 2. API FORECAST (Dự báo chuyên sâu)
 @app.route("/api/forecast", methods=["POST"])
 def forecast_endpoint():
     try:
         data = request.get_json(force=True, silent=True)
         sid = data.get("session_id")
-        ctx, _, _ = get_session_data(sid)
+        ctx, _, _ = get_session_summary(sid)
         
         if not ctx: return jsonify({"error": "Không tìm thấy dữ liệu phân tích."}), 404
         
@@ -260,9 +427,9 @@ def forecast_endpoint():
         smart_sum = ctx.get('smart_summary', {})
         top_prods = smart_sum.get('product_details', [])[:5]
         
-        # Tìm tin tức thị trường cho sản phẩm Top 1
+        # Tìm tin tức thị trường cho sản phẩm Top 1 (cache theo từ khóa, làm mới ở nền)
         keyword = top_prods[0]['product'] if top_prods else "bán lẻ"
-        news = search_google_trends(keyword)
+        with metrics.span('news.wait'): market_news = news.lookup(keyword).result()
         
         # Prompt chuyên dụng cho Báo cáo HTML
         sys_msg = f"""Bạn là Giám đốc Chiến lược (CSO). Hãy viết một báo cáo HTML ngắn gọn (chỉ lấy phần body content) phân tích tình hình kinh doanh.
@@ -270,7 +437,7 @@ def forecast_endpoint():
         DỮ LIỆU: 
         - Doanh thu: {stats.get('total_revenue',0):,.0f} | Lợi nhuận: {stats.get('total_profit',0):,.0f}
         - Top sản phẩm: {', '.join([p['product'] for p in top_prods])}
-        - Tin thị trường ({keyword}): {news}
+        - Tin thị trường ({keyword}): {market_news}
         
         YÊU CẦU ĐẦU RA (HTML):
         <div class="ai-report">
@@ -283,63 +450,491 @@ def forecast_endpoint():
         </div>
         """
         
-        html = call_ai_with_retry(sys_msg, "Hãy phân tích ngay.")
+        html = call_ai_with_retry(sys_msg, "Hãy phân tích ngay.", cache=True)
         return jsonify({"html_content": html.replace("```html","").replace("```","").strip()})
     except Exception as e: return jsonify({"error":str(e)}), 500
 
+# Dạng kết quả do app dựng (build_analysis_result, summarize_result): tăng khi đổi để cache kết quả cũ mất hiệu lực
+RESULT_SCHEMA_VERSION = 2
+
+# Dựng response /analyze từ kết quả analyzer
+def build_analysis_result(data_tuple):
+    smart_summary = data_tuple[10]
+    res = {
+        "statistics": data_tuple[0],
+        "raw_data": data_tuple[8],
+        "smart_summary": smart_summary,
+        "tables": {
+            "product_inventory": smart_summary.get('product_inventory_table', []),
+            "sales_summary": smart_summary.get('sales_summary_table', []),
+            "profit_analysis": smart_summary.get('profit_analysis_table', []),
+            "category_overview": smart_summary.get('category_overview_table', []),
+            "brand_performance": smart_summary.get('brand_performance_table', [])
+        }
+    }
+    if data_tuple[12] is not None: res["memory"] = data_tuple[12].memory_report()
+    return res
+
+# Ghi raw_data + bảng của bản ghi Analysis ra thư mục dạng cột. False nếu kết quả không chuyển được (giữ result_json)
+def store_analysis_data(rec, res):
+    os.makedirs(ANALYSIS_DATA_DIR, exist_ok=True)
+    try: analysis_store.save(os.path.join(ANALYSIS_DATA_DIR, str(rec.id)), res)
+    except analysis_store.LayoutError: return False
+    rec.data_path = str(rec.id)
+    return True
+
+def load_analysis_data(rec):
+    if rec.data_path: return analysis_store.load(os.path.join(ANALYSIS_DATA_DIR, rec.data_path))
+    return serialization.loads(rec.result_json or '{}')
+
+# Chuyển các bản ghi cũ (result_json) sang dạng cột; bản ghi không chuyển được giữ nguyên
+def migrate_analyses(batch=50):
+    moved = kept = 0
+    ids = [r[0] for r in db.session.query(Analysis.id).filter(Analysis.data_path.is_(None), Analysis.result_json.isnot(None))]
+    for i, aid in enumerate(ids, 1):
+        rec = db.session.get(Analysis, aid)
+        res = serialization.loads(rec.result_json)
+        if rec.summary_json is None: rec.summary_json = serialization.dumps_text(summarize_result(res))
+        if store_analysis_data(rec, res):
+            rec.result_json = None
+            moved += 1
+        else: kept += 1
+        if i % batch == 0: db.session.commit()
+    db.session.commit()
+    return moved, kept
+
+# Kết quả phân tích -> JSON bytes (một lần; cùng bytes này được cache, lưu vào phiên và trả về client)
+def encode_result(res):
+    with metrics.span('analyze.json_encode') as s:
+        out = serialization.dumps(res)
+        s.bytes = len(out)
+    return out
+
+# Lưu kết quả: user đăng nhập -> bảng Analysis, khách -> TEMP_SESSIONS. Trả về session_id
+def save_analysis(res, filename, user_id=None, json_res=None, aggregate=None):
+    if json_res is None: json_res = encode_result(res)
+    sid = str(uuid.uuid4())
+    
+    title = f"Phân tích: {filename}"
+    
+    if user_id is not None:
+        new_rec = Analysis(user_id=user_id, filename=filename, title=title,
+                           summary_json=serialization.dumps_text(summarize_result(res)))
+        db.session.add(new_rec)
+        db.session.flush()
+        # analysis_store cần kiểu Python gốc -> giải mã lại từ chính bytes đã mã hóa
+        if not store_analysis_data(new_rec, serialization.loads(json_res)): new_rec.result_json = json_res.decode('utf-8')
+        with metrics.span('db.commit'): db.session.commit()
+        sid = f"db_{new_rec.id}"
+        if aggregate is not None: save_state(sid, aggregate)
+    else:
+        with metrics.span('session.save', nbytes=len(json_res)):
+            TEMP_SESSIONS.set_json(sid, serialization.with_fields(json_res, title=title, filename=filename))
+            TEMP_SUMMARIES[sid] = dict(summarize_result(res), title=title, filename=filename)
+    if aggregate is not None: save_cube(sid, aggregate.cube())
+    return sid
+
+# Trạng thái tổng hợp (SalesAggregate) của phân tích đã lưu, để nối thêm dữ liệu (/analyze/append)
+def state_path(sid):
+    return os.path.join(STATE_DIR, f"{sid}.pkl")
+
+def save_state(sid, aggregate):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp = state_path(sid) + f".{os.getpid()}.tmp"
+    with open(tmp, 'wb') as fh: pickle.dump(aggregate, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, state_path(sid))
+
+def load_state(sid):
+    try:
+        with open(state_path(sid), 'rb') as fh: return pickle.load(fh)
+    except FileNotFoundError: return None
+
+# Chủ của phân tích "db_<id>" không đổi sau khi tạo -> giữ trong LRU, mỗi lượt chat không phải truy vấn lại
+ANALYSIS_OWNERS = LRUCache(int(os.environ.get('DATANA_OWNER_CACHE_SIZE', 4096)))
+
+def analysis_owner(sid):
+    try: aid = int(sid.split("_")[1])
+    except (IndexError, ValueError): return None
+    owner = ANALYSIS_OWNERS.get(aid)
+    if owner is None:
+        row = db.session.query(Analysis.user_id).filter(Analysis.id == aid).first()
+        if row is None or row[0] is None: return None
+        owner = row[0]
+        ANALYSIS_OWNERS.set(aid, owner)
+    return owner
+
+def owns_analysis(sid):
+    return bool(sid and sid.startswith("db_") and current_user.is_authenticated and analysis_owner(sid) == current_user.id)
+
+# Bản ghi Analysis của user hiện tại theo session id "db_<id>"
+def own_analysis(sid):
+    if not sid or not sid.startswith("db_") or not current_user.is_authenticated: return None
+    try: rec = db.session.get(Analysis, int(sid.split("_")[1]))
+    except ValueError: return None
+    return rec if rec and rec.user_id == current_user.id else None
+
+def save_cube(sid, frame):
+    os.makedirs(CUBE_DIR, exist_ok=True)
+    if not sid.startswith("db_"): cube.prune(CUBE_DIR, SESSION_TTL_SECONDS)
+    with metrics.span('cube.save', rows=len(frame)): cube.save(os.path.join(CUBE_DIR, sid), frame)
+    # Digest cho prompt chat được tính sẵn cùng lúc với cube
+    try:
+        with metrics.span('cube.digest'): prompt_context.save_digest(cube.Cube(os.path.join(CUBE_DIR, sid)))
+    except Exception: traceback.print_exc()
+
+# Cube của phiên; phân tích cũ chưa có cube được dựng một lần từ raw_data.
+# LRU theo (sid, dấu cube): cube được ghi lại (nối thêm dữ liệu, ở bất kỳ worker nào) thì mở lại bản mới
+def get_cube(sid):
+    if not sid: return None
+    if sid.startswith("db_"):
+        if not owns_analysis(sid): return None
+    elif sid not in TEMP_SUMMARIES: return None
+    path = os.path.join(CUBE_DIR, sid)
+    stamp = cube_stamp(sid)
+    hit = CUBE_CACHE.get((sid, stamp)) if stamp else None
+    if hit: return hit
+    if stamp is None:
+        res, _, _ = get_session_data(sid)
+        if not res: return None
+        save_cube(sid, cube.from_records(res.get('raw_data', [])))
+    c = cube.Cube(path)
+    CUBE_CACHE.set((sid, c.stamp), c)
+    return c
+
+def current_user_id():
+    return current_user.id if current_user.is_authenticated else None
+
+# Kết quả + trạng thái tổng hợp được cache theo nội dung file (trạng thái là mục riêng, không nằm trong response;
+# cube và dữ liệu để nối thêm đều dựng lại từ nó)
+def result_key(file_hash, *extra):
+    return result_cache.make_key(file_hash, RESULT_SCHEMA_VERSION, analyzer.RAW_SAMPLE_ROWS, *extra)
+
+def cache_result(file_hash, json_res, aggregate):
+    result_cache.put(result_key(file_hash), json_res)
+    if aggregate is not None: cache_state(file_hash, aggregate)
+
+def cache_state(file_hash, aggregate):
+    result_cache.put_blob(result_key(file_hash, 'state'), pickle.dumps(aggregate, protocol=pickle.HIGHEST_PROTOCOL))
+
+def cached_state(file_hash):
+    blob = result_cache.get_blob(result_key(file_hash, 'state'))
+    return pickle.loads(blob) if blob is not None else None
+
+# (JSON kết quả, trạng thái tổng hợp) đã cache của file trong một lượt tra; (None, None) nếu chưa có
+def cached_analysis(file_hash):
+    data, blob = result_cache.get_with_blob(result_key(file_hash), result_key(file_hash, 'state'))
+    return data, (pickle.loads(blob) if blob is not None else None)
+
 # 3. CÁC API KHÁC (GIỮ NGUYÊN)
 @app.route("/analyze", methods=["POST"])
 def analyze_endpoint():
     try:
         f = request.files.get('file')
         if not f: return jsonify({"error":"No file"}),400
-        path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f.filename))
-        f.save(path)
-        
+        if not analyzer.available: return jsonify({"error":"Lỗi module analyzer"}), 500
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(f.filename)}")
+        file_hash = ingest.save_upload(f, path)
+
+        # File đã từng phân tích (cùng nội dung + cùng phiên bản analyzer) -> dùng lại kết quả
+        cached, cached_aggregate = cached_analysis(file_hash)
+        if cached is not None:
+            os.remove(path)
+            sid = save_analysis(serialization.loads(cached), f.filename, current_user_id(), json_res=cached, aggregate=cached_aggregate)
+            return json_response(serialization.with_fields(cached, session_id=sid))
+
+        # Đọc + phân tích theo từng khối: bộ nhớ không phụ thuộc kích thước file
         try:
-            if path.endswith('.csv'): 
-                try: df = pd.read_csv(path, encoding='utf-8')
-                except: df = pd.read_csv(path, encoding='cp1258')
-            else: df = pd.read_excel(path)
-        except: return jsonify({"error":"Lỗi đọc file"}),400
+            try: chunks = ingest.open_chunks(path, layout=analyzer.sniff_layout(path))
+            except: return jsonify({"error":"Lỗi đọc file"}),400
+            data_tuple = analyzer.analyze_chunks(chunks)
         finally: 
             if os.path.exists(path): os.remove(path)
 
-        if not analyzer: return jsonify({"error":"Lỗi module analyzer"}), 500
-        
-        data_tuple = analyzer.analyze_data(df)
-        smart_summary = data_tuple[10]
-        
-        res = {
-            "statistics": data_tuple[0],
-            "raw_data": data_tuple[8],
-            "smart_summary": smart_summary,
-            "tables": {
-                "product_inventory": smart_summary.get('product_inventory_table', []),
-                "sales_summary": smart_summary.get('sales_summary_table', []),
-                "profit_analysis": smart_summary.get('profit_analysis_table', []),
-                "category_overview": smart_summary.get('category_overview_table', []),
-                "brand_performance": smart_summary.get('brand_performance_table', [])
-            }
-        }
-        
-        json_res = json.dumps(res, cls=CustomJsonEncoder)
-        sid = str(uuid.uuid4())
-        
-        if current_user.is_authenticated:
-            new_rec = Analysis(user_id=current_user.id, filename=f.filename, result_json=json_res, title=f"Phân tích: {f.filename}")
-            db.session.add(new_rec)
-            db.session.commit()
-            sid = f"db_{new_rec.id}"
-        else:
-            res_dict = json.loads(json_res)
-            res_dict['title'] = f"Phân tích: {f.filename}"
-            res_dict['filename'] = f.filename
-            TEMP_SESSIONS[sid] = res_dict
-            
-        res['session_id'] = sid
-        return jsonify(res)
+        res = build_analysis_result(data_tuple)
+        json_res = encode_result(res)
+        if data_tuple[0]: cache_result(file_hash, json_res, data_tuple[12])
+        sid = save_analysis(res, f.filename, current_user_id(), json_res=json_res, aggregate=data_tuple[12])
+        return json_response(serialization.with_fields(json_res, session_id=sid))
+    except Exception as e: return jsonify({"error":str(e)}),500
+
+# Phân tích gộp nhiều file (mỗi cửa hàng một file) hoặc file zip: các file được phân tích song song trong
+# process pool của jobs (mỗi file tự dò tiêu đề + cột), rồi gộp thành một phân tích kèm bảng theo từng nguồn
+@app.route("/analyze/batch", methods=["POST"])
+def analyze_batch_endpoint():
+    tmp_paths = []
+    try:
+        files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f and f.filename]
+        if not files: return jsonify({"error":"No file"}),400
+        if not analyzer.available: return jsonify({"error":"Lỗi module analyzer"}), 500
+        sources = []  # (tên nguồn, đường dẫn, sha256)
+        for f in files:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(f.filename)}")
+            tmp_paths.append(path)
+            file_hash = ingest.save_upload(f, path)
+            if not f.filename.lower().endswith('.zip'):
+                sources.append((f.filename, path, file_hash))
+                continue
+            try: members = ingest.extract_zip(path, app.config['UPLOAD_FOLDER'])
+            except ValueError as e: return jsonify({"error": f"{f.filename}: {e}"}), 400
+            tmp_paths += [p for _, p, _ in members]
+            sources += [(f"{f.filename}/{name}", p, h) for name, p, h in members]
+        if not sources: return jsonify({"error": "Không có file dữ liệu (csv/xlsx/xls)"}), 400
+        if len(sources) > BATCH_MAX_FILES: return jsonify({"error": f"Tối đa {BATCH_MAX_FILES} file mỗi lần"}), 400
+
+        # File đã phân tích trước đó (cùng nội dung) lấy trạng thái từ cache, còn lại phân tích song song
+        states = [cached_state(h) for _, _, h in sources]
+        todo = [i for i, s in enumerate(states) if s is None]
+        errors = []
+        for i, result in zip(todo, jobs.analyze_files([sources[i][1] for i in todo])):
+            if isinstance(result, Exception): errors.append({'source': sources[i][0], 'error': str(result)})
+            else:
+                states[i] = result
+                cache_state(sources[i][2], result)
+        parts = [(name, state) for (name, _, _), state in zip(sources, states) if state is not None]
+        if not parts: return jsonify({"error": "Không phân tích được file nào", "errors": errors}), 400
+
+        data_tuple, breakdown = analyzer.analyze_sources(parts)
+        res = build_analysis_result(data_tuple)
+        res['sources'] = breakdown
+        if errors: res['errors'] = errors
+        json_res = encode_result(res)
+        name = parts[0][0] if len(parts) == 1 else f"{parts[0][0]} (+{len(parts) - 1} file)"
+        sid = save_analysis(res, name[:200], current_user_id(), json_res=json_res, aggregate=data_tuple[12])
+        return json_response(serialization.with_fields(json_res, session_id=sid))
     except Exception as e: return jsonify({"error":str(e)}),500
+    finally:
+        for p in tmp_paths:
+            if os.path.exists(p): os.remove(p)
+
+# Hai lượt nối thêm đồng thời vào cùng phân tích đều bắt đầu từ cùng trạng thái và lượt ghi sau làm mất dòng của lượt
+# trước: mỗi phiên chỉ một lượt nối thêm tại một thời điểm (khóa trong SQLite dùng chung giữa các worker), lượt khác nhận 409
+def claim_append(sid):
+    token = uuid.uuid4().hex
+    return APPEND_LOCKS.update(sid, lambda held: token if held is None else None) == token
+
+# Nối thêm dữ liệu vào một phân tích đã lưu: chỉ các dòng mới được cộng vào trạng thái tổng hợp
+def append_analysis(sid, rec, f):
+    aggregate = load_state(sid)
+    if aggregate is None: return jsonify({"error": "Phân tích này không có dữ liệu tổng hợp để nối thêm, hãy tải lại file đầy đủ"}), 409
+
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(f.filename)}")
+    ingest.save_upload(f, path)
+    try:
+        try: chunks = ingest.open_chunks(path, layout=analyzer.sniff_layout(path))
+        except: return jsonify({"error":"Lỗi đọc file"}),400
+        data_tuple = analyzer.analyze_chunks(chunks, aggregate=aggregate)
+    except analyzer.ColumnMismatch as e: return jsonify({"error": str(e)}), 400
+    finally:
+        if os.path.exists(path): os.remove(path)
+    if not data_tuple[0]: return jsonify({"error": "Lỗi phân tích file"}), 400
+
+    res = build_analysis_result(data_tuple)
+    json_res = encode_result(res)
+    rec.summary_json = serialization.dumps_text(summarize_result(res))
+    rec.result_json = None if store_analysis_data(rec, serialization.loads(json_res)) else json_res.decode('utf-8')
+    with metrics.span('db.commit'): db.session.commit()
+    save_cube(sid, aggregate.cube())
+    save_state(sid, aggregate)
+    return json_response(serialization.with_fields(json_res, session_id=sid, append=aggregate.last_batch))
+
+@app.route("/analyze/append", methods=["POST"])
+def analyze_append_endpoint():
+    try:
+        f = request.files.get('file')
+        if not f: return jsonify({"error":"No file"}),400
+        sid = request.form.get('session_id')
+        rec = own_analysis(sid)
+        if not rec: return jsonify({"error": "Không tìm thấy phiên phân tích"}), 404
+        if not claim_append(sid): return jsonify({"error": "Phân tích này đang được nối thêm dữ liệu, hãy thử lại sau"}), 409
+        try: return append_analysis(sid, rec, f)
+        finally: del APPEND_LOCKS[sid]
+    except Exception as e: return jsonify({"error":str(e)}),500
+
+# 4. PHÂN TÍCH CHẠY NỀN (JOB QUEUE)
+@app.route("/analyze/async", methods=["POST"])
+def analyze_async_endpoint():
+    try:
+        f = request.files.get('file')
+        if not f: return jsonify({"error":"No file"}),400
+        # Tên file duy nhất vì job chạy sau khi request đã trả về
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(f.filename)}")
+        file_hash = ingest.save_upload(f, path)
+
+        cached, cached_aggregate = cached_analysis(file_hash)
+        if cached is not None:
+            os.remove(path)
+            sid = save_analysis(serialization.loads(cached), f.filename, current_user_id(), json_res=cached, aggregate=cached_aggregate)
+            return jsonify({"job_id": None, "status": "done", "session_id": sid, "cached": True})
+
+        def on_done(job, data_tuple):
+            res = build_analysis_result(data_tuple)
+            json_res = encode_result(res)
+            if data_tuple[0]: cache_result(file_hash, json_res, data_tuple[12])
+            with app.app_context():
+                return save_analysis(res, job['filename'], job['user_id'], json_res=json_res, aggregate=data_tuple[12])
+
+        job_id = jobs.submit(path, on_done=on_done, filename=f.filename, user_id=current_user_id())
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+    except Exception as e: return jsonify({"error":str(e)}),500
+
+def get_own_job(job_id):
+    job = jobs.get(job_id)
+    if job is None or (job['user_id'] is not None and job['user_id'] != current_user_id()): return None
+    return job
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    if not get_own_job(job_id): return jsonify({"error": "Không tìm thấy job"}), 404
+    return jsonify(jobs.status(job_id))
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = get_own_job(job_id)
+    if not job: return jsonify({"error": "Không tìm thấy job"}), 404
+    st = jobs.status(job_id)
+    if st['status'] == 'error': return jsonify(st), 500
+    if st['status'] != 'done': return jsonify(st), 202
+    res, _, _ = get_session_data(job['session_id'])
+    res = {k: v for k, v in res.items() if k not in ('title', 'filename')}
+    res['session_id'] = job['session_id']
+    return jsonify(res)
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    if not get_own_job(job_id): return jsonify({"error": "Không tìm thấy job"}), 404
+    return jsonify({"success": jobs.cancel(job_id), "status": jobs.status(job_id)['status']})
+
+# 5. TRUY VẤN LỌC / DRILL-DOWN TRÊN CUBE
+@app.route("/api/query", methods=["POST"])
+def query_endpoint():
+    try:
+        data = request.get_json(force=True)
+        c = get_cube(data.get("session_id"))
+        if c is None: return jsonify({"error": "Không tìm thấy phiên phân tích"}), 404
+        try:
+            out = c.query(data.get("group_by", "product"), filters=data.get("filters"),
+                          date_from=data.get("date_from"), date_to=data.get("date_to"), limit=data.get("limit"))
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+        return jsonify(out)
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+@app.route("/api/query/dimensions", methods=["POST"])
+def query_dimensions():
+    c = get_cube((request.get_json(force=True) or {}).get("session_id"))
+    if c is None: return jsonify({"error": "Không tìm thấy phiên phân tích"}), 404
+    return jsonify({"dimensions": c.labels, "rows": c.rows})
+
+# 6. DỰ BÁO THEO TỪNG CHUỖI (sản phẩm / danh mục / khu vực / thương hiệu) trên cube: theo tháng, hoặc quý / năm
+# gộp từ tháng (cube chỉ lưu tới tháng nên không có chuỗi theo tuần)
+FORECAST_MAX_SERIES = int(os.environ.get('DATANA_FORECAST_MAX_SERIES', 500))
+FORECAST_PERIODS = ('M', 'Q', 'Y')
+
+@app.route("/api/forecast/series", methods=["POST"])
+def forecast_series_endpoint():
+    try:
+        data = request.get_json(force=True)
+        c = get_cube(data.get("session_id"))
+        if c is None: return jsonify({"error": "Không tìm thấy phiên phân tích"}), 404
+        dim, measure, period = data.get("dimension", "product"), data.get("measure", "revenue"), data.get("period", "M")
+        try:
+            if period not in FORECAST_PERIODS: raise ValueError(f"period phải thuộc {FORECAST_PERIODS} (dữ liệu được tổng hợp theo tháng)")
+            labels, periods, matrix = c.series_matrix(dim, filters=data.get("filters"), date_from=data.get("date_from"),
+                                                      date_to=data.get("date_to"), measure=measure)
+            if period != 'M': periods, matrix = forecasting.resample_matrix(matrix, periods, period)
+            # Chọn chuỗi: danh sách `series` nếu có, ngược lại top N theo tổng measure
+            totals = matrix.sum(axis=1)
+            if data.get("series"):
+                wanted = set(map(str, data["series"]))
+                rows = [i for i, l in enumerate(labels) if l in wanted]
+            else:
+                rows = np.argsort(-totals, kind='stable')[:min(int(data.get("top", 20)), FORECAST_MAX_SERIES)].tolist()
+            results = forecasting.forecast_matrix(matrix[rows], periods, method=data.get("method", "linear"),
+                                                  horizon=min(int(data.get("horizon", 3)), 24), season_length=data.get("season_length"))
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+        return jsonify({"dimension": dim, "measure": measure, "method": data.get("method", "linear"), "period": period,
+                        "series": [{"label": labels[i], "total": float(totals[i]), "forecast_data": r} for i, r in zip(rows, results)]})
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+# 7. GỢI Ý CHIẾN LƯỢC: luật vector hóa trên cube (mọi SKU), tính một lần cho mỗi phân tích rồi cache
+@app.route("/api/recommendations", methods=["POST"])
+def recommendations_endpoint():
+    try:
+        c = get_cube((request.get_json(force=True) or {}).get("session_id"))
+        if c is None: return jsonify({"error": "Không tìm thấy phiên phân tích"}), 404
+        return jsonify(recommendations.recommendations_for(c))
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify(dict(result_cache.stats(), layouts=analyzer.layout_cache_stats() if analyzer.loaded else {}, llm=llm.stats(), news=news.stats()))
+
+# 8. METRICS (Prometheus text) + PROFILE THEO REQUEST
+# GET /metrics: histogram thời gian / số dòng / số byte theo giai đoạn (metrics.span), thời gian request theo
+# endpoint, token + số lần thử lại của LLM, và stats() của các cache. Chỉ trả cho request từ máy cục bộ
+# trừ khi DATANA_METRICS_PUBLIC=1.
+METRICS_PUBLIC = os.environ.get('DATANA_METRICS_PUBLIC', '0') == '1'
+metrics.register('llm', llm.stats)
+metrics.register('result_cache', result_cache.stats)
+metrics.register('layouts', lambda: analyzer.layout_cache_stats() if analyzer.loaded else {})
+metrics.register('news', news.stats)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    # DATANA_PROFILE=1: request có ?profile=1 hoặc header X-Profile: 1 được chạy dưới cProfile
+    if metrics.PROFILE_ENABLED and '1' in (request.args.get('profile'), request.headers.get('X-Profile')):
+        try: g.profile = metrics.Profile()
+        except ValueError: pass  # đã có profiler khác trên thread này
+
+# Nén response lớn (JSON, text) theo Accept-Encoding: br nếu có brotli và client nhận, không thì gzip.
+# Response stream (SSE) và file tĩnh (direct_passthrough) giữ nguyên.
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in serialization.COMPRESS_TYPES or not 200 <= response.status_code < 300):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < serialization.COMPRESS_MIN_BYTES: return response
+    encoding = request.accept_encodings.best_match(serialization.ENCODINGS)
+    if encoding is None: return response
+    with metrics.span('response.compress', nbytes=len(data)): response.set_data(serialization.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def finish_request_metrics(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        # Các giai đoạn trong header Server-Timing; response JSON dạng object có thêm '_profile'
+        # (response stream như /api/chat/stream chỉ đo tới lúc trả header)
+        report = profile.stop()
+        response.headers['Server-Timing'] = metrics.server_timing(report['stages'])
+        if response.is_json and not response.is_streamed:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                body['_profile'] = report
+                response.set_data(serialization.dumps(body))
+    response = compress_response(response)
+    start = g.get('request_start')
+    if start is not None: g.request_timing = (time.perf_counter() - start, response.status_code)
+    return response
+
+# Luôn chạy, kể cả khi view ném lỗi không được xử lý (after_request bị bỏ qua): tắt profiler của thread và ghi thời gian
+# request (đo tới khi trả header nếu after_request đã chạy, không thì tới lúc này với status 500)
+@app.teardown_request
+def close_request_metrics(exc):
+    profile = g.pop('profile', None)
+    if profile is not None: profile.stop()
+    start = g.pop('request_start', None)
+    if start is None: return
+    seconds, status = g.pop('request_timing', None) or (time.perf_counter() - start, 500)
+    metrics.observe('datana_request_seconds', seconds, endpoint=request.endpoint or 'unknown', status=status)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    if not METRICS_PUBLIC and request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"error": "Forbidden"}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route("/api/new_session", methods=["POST"])
 def new_session():
@@ -351,6 +946,36 @@ def user_info():
         return jsonify({"authenticated": True, "username": current_user.username})
     return jsonify({"authenticated": False})
 
+# Phân trang keyset theo (timestamp, id): cursor "<timestamp ISO>|<id>" của dòng cuối trang trước,
+# truy vấn đi thẳng theo index (user_id, timestamp) / (session_id, timestamp), không OFFSET
+SESSIONS_PAGE = int(os.environ.get('DATANA_SESSIONS_PAGE', 50))
+HISTORY_PAGE = int(os.environ.get('DATANA_HISTORY_PAGE', 200))
+PAGE_MAX = 1000
+
+def make_cursor(timestamp, row_id):
+    return f"{timestamp.isoformat()}|{row_id}"
+
+def parse_cursor(cursor):
+    ts, _, row_id = cursor.rpartition('|')
+    return datetime.fromisoformat(ts), int(row_id)
+
+def page_limit(value, default):
+    return max(0, min(int(default if value is None else value), PAGE_MAX))
+
+# -> (các dòng của trang, cursor trang tiếp hoặc None); chỉ đọc các cột cần (không summary_json / result_json)
+def keyset_page(model, columns, where, cursor, limit, newest_first=True):
+    if limit == 0: return [], None
+    key = db.tuple_(model.timestamp, model.id)
+    q = db.session.query(*columns, model.timestamp, model.id).filter(*where)
+    if cursor: q = q.filter(key < parse_cursor(cursor) if newest_first else key > parse_cursor(cursor))
+    order = (model.timestamp.desc(), model.id.desc()) if newest_first else (model.timestamp, model.id)
+    rows = q.order_by(*order).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, make_cursor(rows[-1].timestamp, rows[-1].id) if more else None
+
+# Body: session_id, limit + cursor (danh sách phiên, mới nhất trước), history_limit + history_cursor (tin nhắn:
+# trang cuối cùng trước, trả về theo thứ tự thời gian). limit / history_limit = 0 để bỏ qua phần đó.
 @app.route("/api/chat_history", methods=["POST"])
 def chat_history():
     try:
@@ -359,17 +984,24 @@ def chat_history():
         
         sessions = []
         history = []
+        next_cursor = history_cursor = None
         
         if current_user.is_authenticated:
-            recs = Analysis.query.filter_by(user_id=current_user.id).order_by(Analysis.timestamp.desc()).all()
-            sessions = [{'session_id': f"db_{r.id}", 'title': r.title, 'created_at': r.timestamp.isoformat()} for r in recs]
+            with metrics.span('db.sessions_page'):
+                rows, next_cursor = keyset_page(Analysis, (Analysis.title,), (Analysis.user_id == current_user.id,),
+                                                data.get("cursor"), page_limit(data.get("limit"), SESSIONS_PAGE))
+            sessions = [{'session_id': f"db_{r.id}", 'title': r.title, 'created_at': r.timestamp.isoformat()} for r in rows]
             
             if sid and sid.startswith("db_"):
-                msgs = ChatHistory.query.filter_by(session_id=sid).order_by(ChatHistory.timestamp).all()
-                history = [{'sender': m.sender, 'message': m.message} for m in msgs]
+                with metrics.span('db.history_page'):
+                    msgs, history_cursor = keyset_page(
+                        ChatHistory, (ChatHistory.sender, ChatHistory.message),
+                        (ChatHistory.session_id == sid, ChatHistory.user_id == current_user.id),
+                        data.get("history_cursor"), page_limit(data.get("history_limit"), HISTORY_PAGE))
+                history = [{'sender': m.sender, 'message': m.message} for m in reversed(msgs)]
         
-        return jsonify({"history": history, "sessions": sessions})
-    except: return jsonify({"history": [], "sessions": []})
+        return jsonify({"history": history, "sessions": sessions, "next_cursor": next_cursor, "history_cursor": history_cursor})
+    except: return jsonify({"history": [], "sessions": [], "next_cursor": None, "history_cursor": None})
 
 @app.route("/api/login", methods=["POST"])
 def login_ep():
@@ -399,6 +1031,7 @@ def index(): return send_from_directory(app.static_folder, "index.html")
 def static_files(path): return send_from_directory(app.static_folder, path)
 
 if __name__ == "__main__":
-    with app.app_context(): db.create_all()
+    with app.app_context(): ensure_schema()
+    jobs.recover()
     # Chạy trên cổng 5001 để tránh xung đột
     app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+bench_chat.py — đo độ trễ chat với LLM giả (stub_llm.py), không cần key thật:
+  - /api/chat (chờ đủ câu trả lời) so với /api/chat/stream (thời gian tới token đầu = độ trễ người dùng cảm nhận)
+  - --clients request stream đồng thời: TTFT p50/p95 và số lời gọi LLM đồng thời tối đa (<= DATANA_LLM_CONCURRENCY)
+  - cache theo prompt: hỏi lại cùng câu -> không gọi LLM; nhiều client cùng hỏi một câu -> một lời gọi LLM
+  - LLM trả 429/503 vài lần đầu: stream vẫn thành công nhờ thử lại có backoff
+  - client ngắt giữa chừng: stream tới LLM phải bị đóng (stub đếm 'disconnected')
+App chạy thật trên werkzeug (threaded) ở cổng ngẫu nhiên; phiên chat là phiên khách tạo bằng /analyze với CSV nhỏ.
+Chạy: python benchmarks/bench_chat.py [--tokens 200] [--ttft 0.3] [--token-delay 0.02] [--clients 16] [--json out.json]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def read_stream(resp, stop_after=None):
+    """Đọc SSE của /api/chat/stream -> (giây tới delta đầu, số delta, sự kiện cuối, payload cuối)."""
+    t0, ttft, deltas, buf = time.perf_counter(), None, 0, b''
+    for chunk in resp.iter_content(chunk_size=None):
+        buf += chunk
+        while b'\n\n' in buf:
+            raw, buf = buf.split(b'\n\n', 1)
+            lines = raw.decode('utf-8').split('\n')
+            event = next((l[7:] for l in lines if l.startswith('event: ')), None)
+            data = next((l[6:] for l in lines if l.startswith('data: ')), None)
+            if event == 'delta':
+                deltas += 1
+                if ttft is None: ttft = time.perf_counter() - t0
+                if stop_after and deltas >= stop_after: return ttft, deltas, 'aborted', None
+            elif event in ('done', 'error'):
+                return ttft, deltas, event, json.loads(data)
+    return ttft, deltas, None, None
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--tokens', type=int, default=200)
+    ap.add_argument('--ttft', type=float, default=0.3)
+    ap.add_argument('--token-delay', type=float, default=0.02)
+    ap.add_argument('--clients', type=int, default=16)
+    ap.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = ap.parse_args()
+
+    import stub_llm
+    stub = stub_llm.serve(0, tokens=args.tokens, ttft=args.ttft, token_delay=args.token_delay)
+    os.environ['DATANA_LLM_BASE_URL'] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ.setdefault('GROQ_API_KEY', 'stub')
+    os.environ['DATANA_LLM_CACHE'] = os.path.join(tempfile.mkdtemp(), 'llm.db')  # cache trống cho mỗi lần đo
+    os.chdir(BACKEND)
+    import requests
+    from werkzeug.serving import make_server
+    import app as app_module
+    with app_module.app.app_context(): app_module.db.create_all()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    http = requests.Session()
+    csv = "Ngày,Sản phẩm,Số lượng,Doanh thu,Lợi nhuận\n" + "".join(
+        f"0{1 + i % 9}/0{1 + i % 9}/2024,SP {i % 7},{1 + i % 5},{(i % 13 + 1) * 100000},{(i % 11) * 10000}\n" for i in range(200))
+    sid = http.post(base + '/analyze', files={'file': ('bench_chat.csv', csv.encode('utf-8'))}).json()['session_id']
+    ask = lambda message: {'message': message, 'session_id': sid}
+    results = {'config': vars(args), 'llm_concurrency': app_module.llm_client.LLM_CONCURRENCY}
+
+    t0 = time.perf_counter()
+    blocking = http.post(base + '/api/chat', json=ask('Tổng quan kinh doanh tháng này')).json()
+    results['blocking_total_s'] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    with http.post(base + '/api/chat/stream', json=ask('Sản phẩm nào bán chạy nhất?'), stream=True) as r:
+        ttft, deltas, event, payload = read_stream(r)
+    results['stream_ttft_s'] = round(ttft, 3)
+    results['stream_total_s'] = round(time.perf_counter() - t0, 3)
+
+    def run_clients(messages):
+        ttfts, totals, texts, lock = [], [], [], threading.Lock()
+        def client(message):
+            s = requests.Session()
+            t = time.perf_counter()
+            with s.post(base + '/api/chat/stream', json=ask(message), stream=True) as r:
+                first, _, ev, payload = read_stream(r)
+            with lock:
+                if ev == 'done': ttfts.append(first); texts.append(payload['response'])
+                totals.append(time.perf_counter() - t)
+        threads = [threading.Thread(target=client, args=(m,)) for m in messages]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return ttfts, totals, texts
+
+    ttfts, totals, _ = run_clients([f'Phân tích rủi ro nhóm hàng {i}' for i in range(args.clients)])
+    results['concurrent'] = {'clients': args.clients, 'ok': len(ttfts),
+                             'ttft_p50_s': round(pct(ttfts, 0.5), 3), 'ttft_p95_s': round(pct(ttfts, 0.95), 3),
+                             'total_p95_s': round(pct(totals, 0.95), 3), 'llm_max_active': stub.count()['max_active']}
+
+    # Cache: hỏi lại (khác khoảng trắng / hoa thường) -> trả ngay, không gọi LLM
+    calls = stub.count()['requests']
+    t0 = time.perf_counter()
+    with http.post(base + '/api/chat/stream', json=ask('  tổng quan   KINH DOANH tháng này '), stream=True) as r:
+        ttft, _, event, payload = read_stream(r)
+    results['cache_hit'] = {'ttft_s': round(ttft, 3), 'total_s': round(time.perf_counter() - t0, 3),
+                            'same_text': event == 'done' and payload['response'] == blocking['response'],
+                            'llm_calls': stub.count()['requests'] - calls}
+
+    # Gộp request: nhiều client cùng hỏi một câu mới cùng lúc -> một lời gọi LLM
+    calls = stub.count()['requests']
+    ttfts, _, texts = run_clients(['Soi biên lợi nhuận'] * args.clients)
+    results['coalesced'] = {'clients': args.clients, 'ok': len(texts), 'llm_calls': stub.count()['requests'] - calls,
+                            'same_text': len(set(texts)) == 1, 'ttft_p95_s': round(pct(ttfts, 0.95), 3)}
+
+    stub.fail, stub.rate_limit = 2, 1
+    retries = app_module.llm.stats()['retries']
+    with http.post(base + '/api/chat/stream', json=ask('Dự báo xu hướng quý tới'), stream=True) as r:
+        _, _, event, _ = read_stream(r)
+    results['retry'] = {'event': event, 'retries': app_module.llm.stats()['retries'] - retries}
+
+    before = stub.count()['disconnected']
+    r = http.post(base + '/api/chat/stream', json=ask('Khu vực nào tăng trưởng tốt?'), stream=True)
+    read_stream(r, stop_after=5)
+    r.close()
+    deadline = time.time() + 10
+    while stub.count()['disconnected'] == before and time.time() < deadline: time.sleep(0.05)
+    results['disconnect'] = {'upstream_closed': stub.count()['disconnected'] > before,
+                             'seconds': round(10 - (deadline - time.time()), 2)}
+    results['llm_stats'] = app_module.llm.stats()
+
+    c = results['concurrent']
+    print(f"/api/chat (chờ đủ):        {results['blocking_total_s']:.2f}s")
+    print(f"/api/chat/stream:          token đầu {results['stream_ttft_s']:.2f}s, xong {results['stream_total_s']:.2f}s")
+    print(f"{c['clients']} client đồng thời:      TTFT p50 {c['ttft_p50_s']:.2f}s, p95 {c['ttft_p95_s']:.2f}s, "
+          f"tổng p95 {c['total_p95_s']:.2f}s, LLM đồng thời tối đa {c['llm_max_active']} (giới hạn {results['llm_concurrency']})")
+    h, g, cs = results['cache_hit'], results['coalesced'], results['llm_stats']['cache']
+    print(f"Hỏi lại (cache):           token đầu {h['ttft_s']:.3f}s, {h['llm_calls']} lời gọi LLM, cùng nội dung: {h['same_text']}")
+    print(f"{g['clients']} client cùng câu hỏi:   {g['llm_calls']} lời gọi LLM, {g['ok']} trả lời giống nhau: {g['same_text']}, "
+          f"TTFT p95 {g['ttft_p95_s']:.2f}s")
+    print(f"Cache:                     hit rate {cs['hit_rate']:.0%}, tiết kiệm {cs['saved_tokens']:,} token")
+    print(f"LLM lỗi 429 + 2×503:       {results['retry']['event']} sau {results['retry']['retries']} lần thử lại")
+    print(f"Client ngắt giữa chừng:    stream tới LLM đóng = {results['disconnect']['upstream_closed']} "
+          f"(sau {results['disconnect']['seconds']:.2f}s)")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh: json.dump(results, fh, ensure_ascii=False, indent=2)
+    server.shutdown()
+    stub.shutdown()
+
+if __name__ == "__main__":
+    main()
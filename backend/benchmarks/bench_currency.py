@@ -0,0 +1,38 @@
+"""
+bench_currency.py — so sánh parse_currency_series (vector hóa) với clean_currency_text (scalar).
+Chạy: python benchmarks/bench_currency.py [số dòng]
+Script chạy các kiểm tra của check_currency.py (kết quả giống hệt nhau) rồi mới đo thời gian.
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from analyzer import clean_currency_text, parse_currency_series
+from check_currency import CORPUS, run as run_checks
+
+def make_column(n, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.integers(1, 5_000, n) * 1000
+    fmt = rng.integers(0, 5, n)
+    out = np.empty(n, dtype=object)
+    out[fmt == 0] = [f"{v:,}".replace(',', '.') + 'đ' for v in base[fmt == 0]]
+    out[fmt == 1] = [f"{v / 1e6:.1f} tr".replace('.', ',') for v in base[fmt == 1]]
+    out[fmt == 2] = [f"{v:,}" for v in base[fmt == 2]]
+    out[fmt == 3] = [str(v) for v in base[fmt == 3]]
+    out[fmt == 4] = [f"{v // 1000}k" for v in base[fmt == 4]]
+    return pd.Series(out)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    if run_checks(): sys.exit(1)
+    print(f"✅ Corpus đối chiếu ({len(CORPUS)} giá trị) + 20.000 chuỗi ngẫu nhiên: khớp tuyệt đối")
+
+    col = make_column(n)
+    t0 = time.perf_counter(); scalar = col.apply(clean_currency_text); t_scalar = time.perf_counter() - t0
+    t0 = time.perf_counter(); vector = parse_currency_series(col); t_vector = time.perf_counter() - t0
+    assert np.array_equal(scalar.to_numpy(dtype='float64'), vector.to_numpy()), "Kết quả khác nhau trên dữ liệu sinh ngẫu nhiên"
+    print(f"{n:,} dòng | scalar: {t_scalar:.3f}s | vector: {t_vector:.3f}s | x{t_scalar / max(t_vector, 1e-9):.1f}")
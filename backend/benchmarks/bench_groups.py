@@ -0,0 +1,63 @@
+"""
+bench_groups.py — đo thời gian analyze_data theo số dòng và số lượng sản phẩm khác nhau.
+Chạy: python benchmarks/bench_groups.py [--compare đường_dẫn/analyzer_cũ.py]
+Ví dụ so sánh với bản trước: git show <commit>:backend/analyzer.py > /tmp/analyzer_old.py
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analyzer
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('analyzer_compare', path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def make_frame(rows, products, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Ngày': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 730, rows), unit='D'),
+        'Sản phẩm': np.array([f'SP-{i:06d}' for i in range(products)], dtype=object)[rng.integers(0, products, rows)],
+        'Thương hiệu': rng.choice([f'Hãng {i}' for i in range(20)], rows),
+        'Nhóm': rng.choice([f'Nhóm {i}' for i in range(12)], rows),
+        'Khu vực': rng.choice(['Hà Nội', 'TP.HCM', 'Đà Nẵng', 'Cần Thơ', 'Hải Phòng'], rows),
+        'Số lượng': rng.integers(1, 50, rows),
+        'Doanh thu': rng.integers(10, 5000, rows) * 1000.0,
+        'Lợi nhuận': rng.integers(-500, 1500, rows) * 1000.0,
+    })
+
+def timed(mod, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        mod.analyze_data(df.copy())
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--compare', help='analyzer.py của phiên bản cũ để so sánh')
+    ap.add_argument('--rows', default='1000,10000,100000')
+    ap.add_argument('--products', default='10,1000,50000')
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+    old = load_module(args.compare) if args.compare else None
+
+    print(f"{'rows':>9} {'products':>9} {'hiện tại (s)':>13}" + (f" {'bản cũ (s)':>11} {'x':>6}" if old else ''))
+    for rows in map(int, args.rows.split(',')):
+        for products in map(int, args.products.split(',')):
+            if products > rows: continue
+            df = make_frame(rows, products)
+            cur = timed(analyzer, df, args.repeat)
+            line = f"{rows:>9,} {products:>9,} {cur:>13.4f}"
+            if old:
+                prev = timed(old, df, args.repeat)
+                line += f" {prev:>11.4f} {prev / cur:>6.1f}"
+            print(line)
@@ -0,0 +1,196 @@
+"""
+bench_history.py — danh sách phiên + lịch sử chat (/api/chat_history) trên SQLite với --sessions phiên của một user
+(mặc định 100k) cộng dữ liệu của các user khác, trên database tạm (DATANA_DATABASE_URL):
+  - cách cũ: tải mọi Analysis của user (mọi cột trừ result_json) + toàn bộ ChatHistory của phiên, không có index mới
+    và có index mới
+  - keyset: trang đầu, trang sâu (đi theo cursor) và trang tin nhắn qua endpoint thật (Flask test client)
+  - đồng thời: --readers thread đọc trang qua endpoint trong lúc --writers kết nối khác (như worker khác) ghi tin nhắn
+Chạy: python benchmarks/bench_history.py [--sessions 100000] [--messages 5000] [--other-users 20] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+SUMMARY = json.dumps({'statistics': {'total_revenue': 1.5e9, 'total_profit': 2.1e8, 'total_quantity': 12000, 'row_count': 50000},
+                      'smart_summary': {'product_details': [{'product': f'Sản phẩm {i}', 'revenue': 1e7 * i} for i in range(40)]}},
+                     ensure_ascii=False)
+
+def timed(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return round(min(runs), 2), round(statistics.median(runs), 2)
+
+def populate(path, uid, args):
+    """Ghi thẳng bằng sqlite3 (executemany) cho nhanh; phiên của user và của user khác xen kẽ theo thời gian.
+    Thời gian ghi đúng dạng SQLAlchemy lưu ('YYYY-MM-DD HH:MM:SS.ffffff') để so sánh chuỗi với cursor đúng thứ tự."""
+    rng = random.Random(0)
+    t0 = datetime(2023, 1, 1)
+    conn = sqlite3.connect(path)
+    total = args.sessions * (1 + args.other_users)
+    owners = [uid] * args.sessions + [uid + 1 + i % args.other_users for i in range(args.sessions * args.other_users)]
+    rng.shuffle(owners)
+    conn.executemany("INSERT INTO analysis (user_id, filename, summary_json, title, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     ((owner, f'file_{i}.xlsx', SUMMARY, f'Phân tích: file_{i}.xlsx', (t0 + timedelta(seconds=30 * i)).isoformat(' ', 'microseconds'))
+                      for i, owner in enumerate(owners)))
+    sid = f"db_{conn.execute('SELECT MAX(id) FROM analysis WHERE user_id = ?', (uid,)).fetchone()[0]}"
+    # Tin nhắn: --messages cho phiên đang mở, phần còn lại rải trên các phiên khác
+    msgs = [(uid, sid, 'user' if i % 2 == 0 else 'ai', f'Tin nhắn {i} ' + 'x' * 200, (t0 + timedelta(seconds=i)).isoformat(' ', 'microseconds'))
+            for i in range(args.messages)]
+    msgs += [(rng.randint(1, args.other_users + 1), f'db_{rng.randint(1, total)}', 'ai', 'y' * 200,
+              (t0 + timedelta(seconds=i)).isoformat(' ', 'microseconds')) for i in range(args.other_messages)]
+    conn.executemany("INSERT INTO chat_history (user_id, session_id, sender, message, timestamp) VALUES (?, ?, ?, ?, ?)", msgs)
+    conn.commit()
+    conn.close()
+    return sid
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sessions', type=int, default=100_000, help='số phiên của user được đo')
+    ap.add_argument('--other-users', type=int, default=1, help='số user khác, mỗi user cũng --sessions phiên')
+    ap.add_argument('--messages', type=int, default=5000, help='số tin nhắn của phiên đang mở')
+    ap.add_argument('--other-messages', type=int, default=200_000)
+    ap.add_argument('--pages', type=int, default=20, help='số trang đi theo cursor')
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--readers', type=int, default=4)
+    ap.add_argument('--writers', type=int, default=2)
+    ap.add_argument('--seconds', type=float, default=5)
+    ap.add_argument('--json', action='store_true', help='in kết quả dạng JSON')
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='datana_bench_history_')
+    path = os.path.join(tmp, 'bench.db')
+    os.environ['DATANA_DATABASE_URL'] = f'sqlite:///{path}'
+    os.chdir(BACKEND)
+    import app as A
+
+    client = A.app.test_client()
+    client.post('/api/register', json={'username': 'bench', 'password': 'bench'})
+    client.post('/api/login', json={'username': 'bench', 'password': 'bench'})
+    with A.app.app_context(): uid = A.User.query.filter_by(username='bench').one().id
+    t0 = time.perf_counter()
+    sid = populate(path, uid, args)
+    out = {'sessions': args.sessions, 'total_sessions': args.sessions * (1 + args.other_users), 'messages': args.messages,
+           'total_messages': args.messages + args.other_messages, 'populate_s': round(time.perf_counter() - t0, 1)}
+
+    def legacy():
+        # Truy vấn của /api/chat_history trước khi phân trang
+        recs = A.Analysis.query.filter_by(user_id=uid).order_by(A.Analysis.timestamp.desc()).all()
+        sessions = [{'session_id': f"db_{r.id}", 'title': r.title, 'created_at': r.timestamp.isoformat()} for r in recs]
+        msgs = A.ChatHistory.query.filter_by(session_id=sid).order_by(A.ChatHistory.timestamp).all()
+        history = [{'sender': m.sender, 'message': m.message} for m in msgs]
+        A.db.session.remove()
+        return sessions, history
+
+    indexes = ('ix_analysis_user_timestamp', 'ix_chat_history_session_timestamp')
+    with A.app.app_context():
+        for name in indexes: A.db.session.execute(A.db.text(f"DROP INDEX IF EXISTS {name}"))
+        A.db.session.commit()
+        out['legacy_no_index_ms'] = timed(legacy, args.repeat)
+        A.ensure_schema()
+        A.db.session.execute(A.db.text("ANALYZE"))
+        A.db.session.commit()
+        out['legacy_indexed_ms'] = timed(legacy, args.repeat)
+        sessions, history = legacy()
+        out['legacy_response_kb'] = round(len(json.dumps({'sessions': sessions, 'history': history}, ensure_ascii=False)) / 1024)
+
+    def page(body):
+        r = client.post('/api/chat_history', json=body)
+        assert r.status_code == 200
+        return r.get_json()
+
+    out['first_page_ms'] = timed(lambda: page({'session_id': sid}), args.repeat)
+    first = page({'session_id': sid})
+    out['first_page_kb'] = round(len(json.dumps(first, ensure_ascii=False)) / 1024)
+    assert [s['session_id'] for s in first['sessions']] == [s['session_id'] for s in sessions[:len(first['sessions'])]]
+    assert first['history'] == history[-len(first['history']):]
+
+    cursor, times, seen = first['next_cursor'], [], len(first['sessions'])
+    for _ in range(args.pages):
+        if not cursor: break
+        t = time.perf_counter()
+        data = page({'cursor': cursor, 'history_limit': 0})
+        times.append((time.perf_counter() - t) * 1000)
+        assert data['sessions'][0]['session_id'] == sessions[seen]['session_id']
+        seen += len(data['sessions'])
+        cursor = data['next_cursor']
+    out['next_page_ms'] = round(statistics.median(times), 2) if times else None
+    # Trang sâu: cursor ở khoảng 90% danh sách
+    deep = sessions[int(len(sessions) * 0.9)]
+    with A.app.app_context():
+        rec = A.db.session.get(A.Analysis, int(deep['session_id'][3:]))
+        deep_cursor = A.make_cursor(rec.timestamp, rec.id)
+    out['deep_page_ms'] = timed(lambda: page({'cursor': deep_cursor, 'history_limit': 0}), args.repeat)
+    out['history_page_ms'] = timed(lambda: page({'session_id': sid, 'limit': 0, 'history_cursor': first['history_cursor']}), args.repeat)
+
+    with A.app.app_context():
+        plans = {}
+        params = {'uid': uid, 'sid': sid, 'ts': datetime(2024, 1, 1), 'id': 1}
+        for label, sql in (('sessions', "SELECT title, timestamp, id FROM analysis WHERE user_id = :uid AND (timestamp, id) < (:ts, :id) "
+                                        "ORDER BY timestamp DESC, id DESC LIMIT 51"),
+                           ('history', "SELECT sender, message, timestamp, id FROM chat_history WHERE session_id = :sid AND user_id = :uid "
+                                       "ORDER BY timestamp DESC, id DESC LIMIT 201")):
+            plans[label] = [r[3] for r in A.db.session.execute(A.db.text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+        out['query_plans'] = plans
+
+    # Đọc trong lúc các kết nối khác ghi (WAL + busy_timeout: không có lỗi "database is locked")
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def reader():
+        c = A.app.test_client()
+        c.post('/api/login', json={'username': 'bench', 'password': 'bench'})
+        while not stop.is_set():
+            r = c.post('/api/chat_history', json={'session_id': sid})
+            with lock: counts['reads' if r.status_code == 200 and r.get_json()['sessions'] else 'errors'] += 1
+
+    def writer():
+        conn = sqlite3.connect(path, timeout=A.DB_BUSY_TIMEOUT)
+        while not stop.is_set():
+            try:
+                with conn: conn.execute("INSERT INTO chat_history (user_id, session_id, sender, message, timestamp) VALUES (?, ?, 'user', 'z', ?)",
+                                        (uid, sid, datetime.now().isoformat(' ', 'microseconds')))
+                with lock: counts['writes'] += 1
+            except sqlite3.OperationalError:
+                with lock: counts['errors'] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)] + [threading.Thread(target=writer) for _ in range(args.writers)]
+    for t in threads: t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads: t.join()
+    out['concurrent'] = {'readers': args.readers, 'writers': args.writers, 'reads_per_s': round(counts['reads'] / args.seconds, 1),
+                         'writes_per_s': round(counts['writes'] / args.seconds, 1), 'errors': counts['errors']}
+
+    if args.json:
+        print(json.dumps(out, indent=2, ensure_ascii=False))
+        return
+    print(f"{args.sessions:,} phiên / user ({out['total_sessions']:,} tổng), {args.messages:,} tin nhắn trong phiên "
+          f"({out['total_messages']:,} tổng); tạo dữ liệu {out['populate_s']}s")
+    print(f"  cách cũ, không index      {out['legacy_no_index_ms'][0]:>9.1f} ms (min)  {out['legacy_response_kb']:,} KB")
+    print(f"  cách cũ, có index         {out['legacy_indexed_ms'][0]:>9.1f} ms")
+    print(f"  keyset trang đầu          {out['first_page_ms'][0]:>9.1f} ms           {out['first_page_kb']:,} KB")
+    print(f"  keyset trang tiếp (median){out['next_page_ms']:>9.1f} ms")
+    print(f"  keyset trang sâu (90%)    {out['deep_page_ms'][0]:>9.1f} ms")
+    print(f"  trang tin nhắn cũ hơn     {out['history_page_ms'][0]:>9.1f} ms")
+    for label, plan in out['query_plans'].items(): print(f"  plan {label}: {'; '.join(plan)}")
+    c = out['concurrent']
+    print(f"  đồng thời {c['readers']} đọc + {c['writers']} ghi: {c['reads_per_s']} trang/s, {c['writes_per_s']} ghi/s, lỗi {c['errors']}")
+
+if __name__ == "__main__":
+    main()
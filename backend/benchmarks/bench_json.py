@@ -0,0 +1,100 @@
+"""
+bench_json.py — mã hóa kết quả phân tích: đường cũ (json.dumps + CustomJsonEncoder, json.loads vào phiên tạm,
+jsonify mã hóa lần nữa) so với serialization.py (orjson, mã hóa một lần, bytes dùng cho cache + phiên + response),
+và kích thước / thời gian nén response (gzip, br nếu có brotli).
+Kết quả lấy từ /analyze thật trên file tổng hợp (datagen.py) --rows dòng, --products sản phẩm.
+Chạy: python benchmarks/bench_json.py [--rows 200000] [--products 5000] [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+class LegacyEncoder(json.JSONEncoder):
+    """Bộ mã hóa cũ của app.py (mọi giá trị NumPy qua default())."""
+    def default(self, obj):
+        if isinstance(obj, (np.integer, np.int64)): return int(obj)
+        elif isinstance(obj, (np.floating, np.float64)): return float(obj)
+        elif isinstance(obj, np.ndarray): return obj.tolist()
+        elif isinstance(obj, datetime): return obj.isoformat()
+        return super().default(obj)
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=200_000)
+    ap.add_argument('--products', type=int, default=5000)
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--json', action='store_true', help='in kết quả dạng JSON')
+    args = ap.parse_args()
+
+    import datagen
+    tmp = tempfile.mkdtemp(prefix='datana_bench_json_')
+    for name in ('DATANA_CUBE_DIR', 'DATANA_ANALYSIS_DIR', 'DATANA_STATE_DIR', 'DATANA_RESULT_CACHE_DIR'):
+        os.environ[name] = os.path.join(tmp, name.lower())
+    path = os.path.join(tempfile.gettempdir(), 'datana_bench', f"sales_{args.rows}_{args.products}p_34r_3y_s0.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    datagen.ensure(path, args.rows, fmt='csv', products=args.products, regions=34, years=3, seed=0)
+    os.chdir(BACKEND)
+    import analyzer
+    import ingest
+    import app as app_module
+    import serialization
+    res = app_module.build_analysis_result(analyzer.analyze_chunks(ingest.open_chunks(path, layout=analyzer.sniff_layout(path))))
+    meta = {'title': 'Phân tích: bench.csv', 'filename': 'bench.csv'}
+
+    def legacy():
+        text = json.dumps(res, cls=LegacyEncoder)                        # encode_result (cache)
+        session = dict(json.loads(text), **meta)                          # json.loads vào TEMP_SESSIONS
+        blob = zlib.compress(json.dumps(session, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 1)
+        body = json.dumps(dict(res, session_id='x'), cls=LegacyEncoder)   # jsonify(res)
+        return text, blob, body
+
+    def single_pass():
+        data = serialization.dumps(res)
+        blob = zlib.compress(serialization.with_fields(data, **meta), 1)
+        body = serialization.with_fields(data, session_id='x')
+        return data, blob, body
+
+    t_legacy, (_, _, body_old) = best(legacy, args.repeat)
+    t_new, (data, _, body) = best(single_pass, args.repeat)
+    t_encode_old, _ = best(lambda: json.dumps(res, cls=LegacyEncoder), args.repeat)
+    t_encode_new, _ = best(lambda: serialization.dumps(res), args.repeat)
+    assert json.loads(body) == json.loads(body_old)
+    out = {'rows': args.rows, 'products': args.products, 'orjson': serialization.orjson is not None,
+           'response_bytes': len(body), 'encode_legacy_ms': round(t_encode_old * 1000, 2), 'encode_ms': round(t_encode_new * 1000, 2),
+           'pipeline_legacy_ms': round(t_legacy * 1000, 2), 'pipeline_ms': round(t_new * 1000, 2), 'compression': {}}
+    for encoding in serialization.ENCODINGS:
+        t, packed = best(lambda: serialization.compress(body, encoding), args.repeat)
+        out['compression'][encoding] = {'bytes': len(packed), 'ratio': round(len(body) / len(packed), 1), 'ms': round(t * 1000, 2)}
+
+    if args.json:
+        print(json.dumps(out, indent=2))
+        return
+    print(f"Kết quả {args.rows:,} dòng / {args.products:,} sản phẩm: response {len(body) / 2**20:.2f} MB, "
+          f"orjson {'có' if out['orjson'] else 'không'}")
+    print(f"  mã hóa một lần       json+encoder {out['encode_legacy_ms']:>8.1f} ms   serialization {out['encode_ms']:>8.1f} ms")
+    print(f"  cache+phiên+response cũ          {out['pipeline_legacy_ms']:>8.1f} ms   mới          {out['pipeline_ms']:>8.1f} ms "
+          f"({t_legacy / t_new:.1f}x)")
+    for encoding, c in out['compression'].items():
+        print(f"  {encoding:<5} {c['bytes'] / 1024:>8.0f} KB (x{c['ratio']}) trong {c['ms']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
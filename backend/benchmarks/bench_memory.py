@@ -0,0 +1,99 @@
+"""
+bench_memory.py — đo thời gian + bộ nhớ đỉnh (peak RSS) khi phân tích một file CSV tổng hợp lớn (mặc định 5 triệu dòng).
+Mỗi chế độ chạy trong một process riêng để RSS không lẫn nhau:
+  - stream: pipeline hiện tại (sniff_layout -> đọc theo khối với usecols + kiểu cột category)
+  - stream-untyped: như trên nhưng bỏ kiểu cột (mọi cột chữ là str/object như trước)
+  - load / load-untyped: đọc cả file vào một DataFrame (có / không áp kiểu) để thấy số byte mỗi dòng
+Chạy: python benchmarks/bench_memory.py [--rows 5000000] [--path /tmp/bench_5m.csv] [--compare thư_mục_bản_cũ]
+--compare: thư mục chứa analyzer.py + ingest.py của phiên bản cũ, vd:
+  mkdir /tmp/old && git show <commit>:backend/analyzer.py > /tmp/old/analyzer.py && git show <commit>:backend/ingest.py > /tmp/old/ingest.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def write_csv(path, rows, seed=0, block=500_000):
+    """CSV kiểu file xuất bán hàng: ngày dd/mm/yyyy, tên sản phẩm/thương hiệu/khu vực, tiền dạng '1.500.000đ', vài cột không dùng."""
+    rng = np.random.default_rng(seed)
+    products = np.array([f'Sản phẩm {i:05d}' for i in range(5000)], dtype=object)
+    with open(path, 'w', encoding='utf-8', newline='') as fh:
+        for start in range(0, rows, block):
+            n = min(block, rows - start)
+            df = pd.DataFrame({
+                'Mã đơn': np.arange(start, start + n),
+                'Ngày': (pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 730, n), unit='D')).strftime('%d/%m/%Y'),
+                'Sản phẩm': products[rng.integers(0, len(products), n)],
+                'Thương hiệu': rng.choice([f'Hãng {i}' for i in range(30)], n),
+                'Nhóm': rng.choice([f'Nhóm {i}' for i in range(12)], n),
+                'Khu vực': rng.choice(['Hà Nội', 'TP.HCM', 'Đà Nẵng', 'Cần Thơ', 'Hải Phòng'], n),
+                'Số lượng': rng.integers(1, 50, n),
+                'Doanh thu': [f'{v:,}'.replace(',', '.') + 'đ' for v in (rng.integers(10, 5000, n) * 1000).tolist()],
+                'Lợi nhuận': rng.integers(-500, 1500, n) * 1000,
+                'Ghi chú': rng.choice(['', 'Giao nhanh', 'Khách quen', 'Đổi trả'], n),
+            })
+            df.to_csv(fh, index=False, header=start == 0)
+
+# Chạy trong process con: in JSON {seconds, peak_rss_mb, ...}
+CHILD = r'''
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+import pandas as pd, analyzer, ingest
+mode, path = sys.argv[2], sys.argv[3]
+t0 = time.perf_counter()
+out = {}
+if mode.startswith('stream'):
+    layout = analyzer.sniff_layout(path) if hasattr(analyzer, 'sniff_layout') else None
+    if layout is not None and mode == 'stream-untyped': layout['dtype'] = {}
+    res = analyzer.analyze_chunks(ingest.open_chunks(path, layout=layout) if layout is not None else ingest.open_chunks(path))
+    out['rows'] = res[0].get('row_count')
+    out['total_revenue'] = res[0].get('total_revenue')
+else:
+    layout = analyzer.sniff_layout(path)
+    df = pd.read_csv(path, usecols=layout['usecols'], dtype=None if mode == 'load-untyped' else layout['dtype'])
+    out['rows'] = len(df)
+    out['bytes_per_row'] = round(df.memory_usage(deep=True).sum() / max(len(df), 1), 1)
+out['seconds'] = round(time.perf_counter() - t0, 2)
+out['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+print(json.dumps(out))
+'''
+
+def run(mode, path, code_dir):
+    proc = subprocess.run([sys.executable, '-W', 'ignore', '-c', CHILD, code_dir, mode, path],
+                          capture_output=True, text=True, cwd=BACKEND)
+    if proc.returncode != 0: raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=5_000_000)
+    ap.add_argument('--path', default='/tmp/bench_memory.csv', help='file CSV dùng lại nếu đã có đúng số dòng')
+    ap.add_argument('--modes', default='stream,stream-untyped,load,load-untyped')
+    ap.add_argument('--compare', help='thư mục analyzer.py + ingest.py của phiên bản cũ (chạy chế độ stream)')
+    ap.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = ap.parse_args()
+
+    marker = args.path + '.rows'
+    if not (os.path.exists(args.path) and os.path.exists(marker) and open(marker).read() == str(args.rows)):
+        t0 = time.perf_counter()
+        write_csv(args.path, args.rows)
+        with open(marker, 'w') as fh: fh.write(str(args.rows))
+        print(f"Tạo {args.path}: {args.rows:,} dòng, {os.path.getsize(args.path) / 2**20:.0f} MB ({time.perf_counter() - t0:.1f}s)")
+
+    runs = [(m, BACKEND) for m in args.modes.split(',')]
+    if args.compare: runs.append(('stream', os.path.abspath(args.compare)))
+    results = []
+    print(f"{'chế độ':<16} {'mã nguồn':<10} {'thời gian (s)':>13} {'peak RSS (MB)':>14} {'byte/dòng':>10}")
+    for mode, code_dir in runs:
+        r = run(mode, args.path, code_dir)
+        label = 'hiện tại' if code_dir == BACKEND else 'bản cũ'
+        results.append(dict(r, mode=mode, code=label))
+        print(f"{mode:<16} {label:<10} {r['seconds']:>13.2f} {r['peak_rss_mb']:>14.1f} {r.get('bytes_per_row', ''):>10}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh: json.dump({'rows': args.rows, 'results': results}, fh, ensure_ascii=False, indent=2)
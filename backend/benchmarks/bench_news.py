@@ -0,0 +1,126 @@
+"""
+bench_news.py — đo news.py với một trang kết quả giả (kiểu DuckDuckGo HTML) phục vụ ở máy cục bộ:
+  - tốc độ phân tích HTML: BeautifulSoup dựng cả trang (cách cũ) / BeautifulSoup + SoupStrainer / lxml
+  - độ trễ trên luồng request: lần đầu (chưa cache), còn mới, đã cũ (trả ngay + làm mới nền), nhiều request cùng lúc
+Chạy: python benchmarks/bench_news.py [--delay 1.0] [--results 30] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+def fake_page(n_results):
+    """Trang kết quả cỡ thật (~ vài chục KB): mỗi kết quả có tiêu đề, link, đoạn trích, icon."""
+    rows = []
+    for i in range(n_results):
+        rows.append(f'''<div class="result results_links results_links_deep web-result">
+  <div class="links_main links_deep result__body">
+    <h2 class="result__title"><a rel="nofollow" class="result__a" href="https://vnexpress.net/kinh-doanh/{i}">
+      Thị trường bán lẻ Việt Nam 2025: xu hướng tiêu dùng mới #{i}</a></h2>
+    <div class="result__extras"><div class="result__extras__url"><span class="result__icon">
+      <img class="result__icon__img" width="16" height="16" alt="" src="//external-content.duckduckgo.com/ip3/vnexpress.net.ico" /></span>
+      <a class="result__url" href="https://vnexpress.net/kinh-doanh/{i}">vnexpress.net/kinh-doanh/{i}</a></div></div>
+    <a class="result__snippet" href="https://vnexpress.net/kinh-doanh/{i}">Doanh thu bán lẻ hàng hóa tăng <b>{i % 9 + 3}%</b>
+      so với cùng kỳ, nhóm hàng thiết yếu và điện tử dẫn đầu; người tiêu dùng chuyển dần sang kênh online...</a>
+  </div></div>''')
+    head = '<html><head><meta charset="utf-8"><title>thị trường</title>' + '<style>.x{color:red}</style>' * 40 + '</head>'
+    return (head + '<body><div id="links" class="results">' + '\n'.join(rows) + '</div></body></html>').encode('utf-8')
+
+class FakeSearch(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, page, delay):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.page, self.delay, self.requests = page, delay, 0
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.server.page)))
+        self.end_headers()
+        self.wfile.write(self.server.page)
+
+def timeit(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat): fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--delay', type=float, default=1.0, help='giây trang giả chờ trước khi trả kết quả')
+    ap.add_argument('--results', type=int, default=30)
+    ap.add_argument('--repeat', type=int, default=50)
+    ap.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = ap.parse_args()
+
+    page = fake_page(args.results)
+    server = FakeSearch(page, args.delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['DATANA_NEWS_URL'] = f"http://127.0.0.1:{server.server_port}/html/"
+    os.environ['DATANA_NEWS_CACHE'] = os.path.join(tempfile.mkdtemp(), 'news.db')
+    os.environ['DATANA_NEWS_TTL'] = '2'
+    import news
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    def old_parser():
+        soup = BeautifulSoup(page.decode('utf-8'), 'html.parser')
+        return [a.get_text(strip=True) for a in soup.find_all('a', class_='result__a', limit=3)]
+    def strainer():
+        soup = BeautifulSoup(page, 'html.parser', parse_only=SoupStrainer('a', class_='result__a'))
+        return [a.get_text(' ', strip=True) for a in soup.find_all('a', limit=3)]
+    results = {'config': vars(args), 'page_kb': round(len(page) / 1024, 1), 'parse_ms': {
+        'bs4_full': round(timeit(old_parser, args.repeat), 2),
+        'bs4_strainer': round(timeit(strainer, args.repeat), 2)}}
+    if news.lxml is not None: results['parse_ms']['lxml'] = round(timeit(lambda: news.parse_results(page), args.repeat), 2)
+
+    def timed(keyword, wait=news.NEWS_WAIT):
+        t0 = time.perf_counter()
+        text = news.lookup(keyword, wait).result()
+        return round((time.perf_counter() - t0) * 1000, 1), text
+
+    latency = {}
+    latency['miss_ms'], text = timed('Sản phẩm 00001')
+    latency['fresh_ms'], _ = timed('sản phẩm   00001')
+    time.sleep(2.1)
+    before = server.requests
+    latency['stale_ms'], _ = timed('Sản phẩm 00001')
+    time.sleep(args.delay + 0.5)
+    latency['stale_refreshed'] = server.requests == before + 1
+    latency['miss_budget_ms'], budget_text = timed('Sản phẩm 00002', wait=0.2)
+
+    before, out = server.requests, []
+    threads = [threading.Thread(target=lambda: out.append(timed('Sản phẩm 00003')[0])) for _ in range(20)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    latency['concurrent_misses'] = {'requests': 20, 'fetches': server.requests - before, 'max_ms': max(out)}
+    results['latency'] = latency
+    results['stats'] = news.stats()
+
+    p = results['parse_ms']
+    print(f"Trang giả {results['page_kb']} KB, {args.results} kết quả; nguồn chậm {args.delay}s")
+    print("Phân tích HTML (ms/trang): " + ", ".join(f"{k} {v:.2f}" for k, v in p.items()))
+    print(f"Chưa có cache:            {latency['miss_ms']:.0f} ms  ({text.splitlines()[0]})")
+    print(f"Còn mới:                  {latency['fresh_ms']:.1f} ms")
+    print(f"Đã cũ:                    {latency['stale_ms']:.1f} ms, làm mới nền: {latency['stale_refreshed']}")
+    print(f"Chưa có cache, chờ 0.2s:  {latency['miss_budget_ms']:.0f} ms ({budget_text})")
+    c = latency['concurrent_misses']
+    print(f"{c['requests']} request cùng từ khóa:  {c['fetches']} lần tải, chậm nhất {c['max_ms']:.0f} ms")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh: json.dump(results, fh, ensure_ascii=False, indent=2)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+bench_recommendations.py — đo recommendations.py trên cube tổng hợp ngẫu nhiên cỡ lớn (mặc định 120k SKU):
+  - thời gian chạy toàn bộ luật (lần đầu), đọc lại từ recommendations.json (process khác / sau khi LRU bị đẩy ra)
+    và trúng LRU
+  - số SKU khớp từng luật
+Dữ liệu: một phần SKU bán mạnh tháng 12 (mùa vụ), một phần chỉ bán ở một khu vực, biên lợi nhuận phân phối chuẩn.
+Chạy: python benchmarks/bench_recommendations.py [--skus 120000] [--rows 600000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import numpy as np
+import pandas as pd
+import cube
+import recommendations
+
+REGIONS = np.array(['Hà Nội', 'TP.HCM', 'Đà Nẵng', 'Cần Thơ', 'Khác'])
+
+def synthetic_cube(path, n_skus, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    product = rng.integers(0, n_skus, n_rows)
+    months = pd.period_range('2023-01', periods=24, freq='M').astype(str).to_numpy()
+    month = rng.integers(0, 24, n_rows)
+    seasonal = product < n_skus // 50
+    month[seasonal & (rng.random(n_rows) < 0.7)] = 11
+    region = rng.choice(len(REGIONS), n_rows, p=[.35, .35, .15, .1, .05])
+    region[(product >= n_skus // 50) & (product < n_skus // 40)] = 0
+    revenue = rng.gamma(2, 500000, n_rows) * (1 + (product % 97 == 0) * 20)
+    frame = pd.DataFrame({'product': np.char.add('SP ', product.astype(str)), 'brand': 'B', 'category': 'C',
+                          'region': REGIONS[region], 'month': months[month], 'revenue': revenue,
+                          'profit': revenue * rng.normal(0.15, 0.1, n_rows),
+                          'quantity': rng.integers(1, 20, n_rows).astype(float), 'rows': 1.0})
+    cube.save(path, frame.groupby(list(cube.DIMENSIONS), sort=False).sum().reset_index())
+    return cube.Cube(path)
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return round((time.perf_counter() - t0) * 1000, 2), out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--skus', type=int, default=120_000)
+    ap.add_argument('--rows', type=int, default=600_000)
+    ap.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = ap.parse_args()
+
+    c = synthetic_cube(os.path.join(tempfile.mkdtemp(), 'cube'), args.skus, args.rows)
+    results = {'config': vars(args), 'cube_rows': c.rows, 'skus': len(c.labels['product'])}
+    results['first_ms'], out = timed(lambda: recommendations.recommendations_for(c))
+    results['lru_ms'], _ = timed(lambda: recommendations.recommendations_for(c))
+    recommendations._CACHE = type(recommendations._CACHE)(64)
+    results['file_ms'], _ = timed(lambda: recommendations.recommendations_for(cube.Cube(c.path)))
+    results['rules'] = {r['rule']: r.get('count') for r in out['rules']}
+
+    print(f"Cube {results['cube_rows']:,} dòng, {results['skus']:,} SKU")
+    print(f"Chạy luật: {results['first_ms']:.1f} ms, đọc recommendations.json: {results['file_ms']:.1f} ms, "
+          f"trúng LRU: {results['lru_ms']:.3f} ms")
+    print("Số SKU khớp: " + ", ".join(f"{k} {v:,}" for k, v in results['rules'].items() if v is not None))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh: json.dump(results, fh, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
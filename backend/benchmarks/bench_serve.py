@@ -0,0 +1,170 @@
+"""
+bench_serve.py — thời gian khởi động và số request/giây của server thật (process riêng, client HTTP qua socket):
+  - import: thời gian `import app` trong process mới (median của --import-runs lần) + thời gian từ lúc chạy lệnh
+    tới response đầu tiên của từng server
+  - dev: cách chạy hiện có (app.run của Flask, debug=True như server.py / app.py, không reloader)
+  - prefork: serve.py (--workers process x --threads thread, nạp sẵn + làm nóng trong process cha rồi fork)
+  - mỗi server, --concurrency client trong --seconds giây cho từng endpoint (RPS, p50 / p95):
+      GET /api/user_info; POST /api/chat (LLM giả stub_llm.py, câu hỏi khác nhau nên không trúng cache prompt);
+      POST /analyze (file datagen --analyze-rows dòng, cache kết quả tắt bằng DATANA_RESULT_CACHE_MB=0)
+Database, cube, cache... của server nằm trong thư mục tạm.
+Chạy: python benchmarks/bench_serve.py [--servers dev,prefork] [--workers 4] [--threads 8] [--concurrency 8] [--seconds 10] [--json]
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+SERVERS = {
+    'dev': lambda port, args: [sys.executable, '-c', "import sys; sys.path.insert(0, '.'); from app import app; "
+                               f"app.run(host='127.0.0.1', port={port}, debug=True, use_reloader=False)"],
+    'prefork': lambda port, args: [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(port),
+                                   '--workers', str(args.workers), '--threads', str(args.threads)],
+}
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def request(port, method, path, body=None, headers=None, timeout=60):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=dict(headers or {}, Connection='close'))
+        r = conn.getresponse()
+        return r.status, r.read()
+    finally: conn.close()
+
+def multipart(filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+def import_time(runs):
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    times = [float(subprocess.run([sys.executable, '-W', 'ignore', '-c', code], cwd=BACKEND, capture_output=True,
+                                  text=True, env=dict(os.environ, PYTHONPATH='.')).stdout.strip().splitlines()[-1])
+             for _ in range(runs)]
+    return round(statistics.median(times), 3)
+
+def load(port, make_request, concurrency, seconds):
+    """concurrency thread gửi request liên tục trong seconds giây -> rps, p50, p95 (ms), lỗi."""
+    stop, lock = time.monotonic() + seconds, threading.Lock()
+    latencies, errors, counter = [], [0], [0]
+
+    def client():
+        while time.monotonic() < stop:
+            with lock:
+                counter[0] += 1
+                i = counter[0]
+            t0 = time.perf_counter()
+            try: ok = make_request(port, i)
+            except OSError: ok = False
+            dt = time.perf_counter() - t0
+            with lock:
+                if ok: latencies.append(dt)
+                else: errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    pct = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1) if latencies else None
+    return {'rps': round(len(latencies) / elapsed, 1), 'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'ok': len(latencies), 'errors': errors[0]}
+
+def run_server(name, args, env, upload):
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(SERVERS[name](port, args), cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if request(port, 'GET', '/api/user_info', timeout=2)[0] == 200: break
+            except OSError: pass
+            if proc.poll() is not None: raise RuntimeError(f"server {name} dừng khi khởi động")
+            time.sleep(0.02)
+        out = {'startup_s': round(time.perf_counter() - t0, 3)}
+        body, headers = multipart('bench.csv', upload)
+        status, data = request(port, 'POST', '/analyze', body, headers)
+        out['first_analyze_s'] = round(time.perf_counter() - t0 - out['startup_s'], 3)
+        sid = json.loads(data)['session_id']
+        chat_headers = {'Content-Type': 'application/json'}
+        cases = {
+            'user_info': lambda p, i: request(p, 'GET', '/api/user_info')[0] == 200,
+            'chat': lambda p, i: request(p, 'POST', '/api/chat', json.dumps(
+                {'message': f'Sản phẩm nào bán chạy nhất, câu {i}?', 'session_id': sid}), chat_headers)[0] == 200,
+            'analyze': lambda p, i: request(p, 'POST', '/analyze', body, headers)[0] == 200,
+        }
+        for case in args.cases.split(','):
+            out[case] = load(port, cases[case], args.concurrency, args.seconds)
+        return out
+    finally:
+        proc.terminate()
+        try: proc.wait(10)
+        except subprocess.TimeoutExpired: proc.kill()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--servers', default='dev,prefork')
+    ap.add_argument('--cases', default='user_info,chat,analyze')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--threads', type=int, default=8)
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--seconds', type=float, default=10)
+    ap.add_argument('--import-runs', type=int, default=5)
+    ap.add_argument('--analyze-rows', type=int, default=10_000)
+    ap.add_argument('--llm-ttft', type=float, default=0.05)
+    ap.add_argument('--llm-tokens', type=int, default=50)
+    ap.add_argument('--json', action='store_true', help='in kết quả dạng JSON')
+    args = ap.parse_args()
+
+    import datagen
+    import stub_llm
+    stub = stub_llm.serve(0, tokens=args.llm_tokens, ttft=args.llm_ttft, token_delay=0)
+    tmp = tempfile.mkdtemp(prefix='datana_bench_serve_')
+    path = os.path.join(tmp, 'bench.csv')
+    datagen.generate(path, args.analyze_rows, 'csv', products=500)
+    with open(path, 'rb') as fh: upload = fh.read()
+    env = dict(os.environ, PYTHONPATH='.', GROQ_API_KEY='stub', DATANA_LLM_BASE_URL=f"http://127.0.0.1:{stub.server_address[1]}",
+               DATANA_DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", DATANA_RESULT_CACHE_MB='0',
+               DATANA_LLM_CONCURRENCY='64')
+    for name, sub in (('DATANA_CUBE_DIR', 'cubes'), ('DATANA_ANALYSIS_DIR', 'analyses'), ('DATANA_STATE_DIR', 'states'),
+                      ('DATANA_RESULT_CACHE_DIR', 'results'), ('DATANA_LLM_CACHE', 'llm.db'), ('DATANA_NEWS_CACHE', 'news.db'),
+                      ('DATANA_LAYOUT_CACHE', 'layouts.db')):
+        env[name] = os.path.join(tmp, sub)
+
+    out = {'cpus': os.cpu_count(), 'workers': args.workers, 'threads': args.threads, 'concurrency': args.concurrency,
+           'import_app_s': import_time(args.import_runs), 'servers': {}}
+    for name in args.servers.split(','):
+        if name == 'prefork' and not os.path.exists(os.path.join(BACKEND, 'serve.py')): continue
+        out['servers'][name] = run_server(name, args, env, upload)
+    stub.shutdown()
+
+    if args.json:
+        print(json.dumps(out, indent=2))
+        return
+    print(f"import app: {out['import_app_s'] * 1000:.0f} ms ({out['cpus']} CPU, {args.concurrency} client đồng thời)")
+    for name, r in out['servers'].items():
+        label = name if name != 'prefork' else f"prefork {args.workers}x{args.threads}"
+        print(f"{label}: tới response đầu {r['startup_s']:.2f}s, /analyze đầu tiên {r['first_analyze_s']:.2f}s")
+        for case in args.cases.split(','):
+            c = r[case]
+            print(f"  {case:<10} {c['rps']:>8.1f} req/s   p50 {c['p50_ms']} ms   p95 {c['p95_ms']} ms   lỗi {c['errors']}")
+
+if __name__ == "__main__":
+    main()
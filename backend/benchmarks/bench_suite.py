@@ -0,0 +1,233 @@
+"""
+bench_suite.py — bộ benchmark tái lập được cho analyzer + /analyze trên file tổng hợp (datagen.py).
+Với mỗi cỡ (--sizes 10k,1m,10m) và định dạng (--formats csv,xlsx), mỗi phép đo chạy trong một process riêng
+(peak RSS không lẫn nhau), lấy thời gian tốt nhất của --repeat lần:
+  - analyze_data: DataFrame đọc thô từ file (còn dòng rác, tiền dạng chữ) -> analyzer.analyze_data
+    (bỏ qua khi số dòng > --inmem-max vì cả file phải nằm trong bộ nhớ)
+  - calculate_trend_forecast: trên DataFrame đã dò tiêu đề + làm sạch doanh thu
+  - clean_currency_text: hàm scalar trên --currency-sample giá trị tiền của file (kèm parse_currency_series để so)
+  - analyze_endpoint: POST /analyze qua Flask test client (cache kết quả trống), analyze_endpoint_cached: gửi lại cùng file
+Kết quả phân tích được đối chiếu với <file>.truth.json (số dòng, tổng doanh thu / lợi nhuận / số lượng) -> 'ok'.
+Kết quả ghi JSON (mặc định benchmarks/results/suite-<thời điểm>-<commit>.json) kèm commit, phiên bản thư viện, máy;
+--compare file_cũ.json in tỉ lệ thời gian / bộ nhớ và đánh dấu chậm hơn quá --threshold (mặc định 10%).
+Chạy: python benchmarks/bench_suite.py [--sizes 10k,1m] [--formats csv,xlsx] [--products 5000] [--regions 34]
+      [--repeat 3] [--data-dir /tmp/datana_bench] [--out kết_quả.json] [--compare kết_quả_cũ.json [--fail-on-regression]]
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, HERE)
+
+CASES = ('analyze_data', 'calculate_trend_forecast', 'clean_currency_text', 'analyze_endpoint')
+SUFFIX = {'k': 1_000, 'm': 1_000_000}
+
+def parse_size(text):
+    text = text.strip().lower()
+    return int(float(text[:-1]) * SUFFIX[text[-1]]) if text[-1] in SUFFIX else int(text)
+
+def rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def best_of(fn, repeat):
+    runs, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        runs.append(round(time.perf_counter() - t0, 4))
+    return min(runs), runs, out
+
+def matches(truth, stats):
+    """Kết quả phân tích khớp truth.json (tiền làm tròn tới đồng, sai số float tương đối 1e-9)."""
+    close = lambda a, b: abs(float(a) - float(b)) <= 1e-9 * max(abs(float(b)), 1.0)
+    return (stats.get('row_count') == truth['rows'] and close(stats.get('total_revenue', 0), truth['revenue'])
+            and close(stats.get('total_profit', 0), truth['profit']) and close(stats.get('total_quantity', 0), truth['quantity']))
+
+def read_raw(path):
+    """Đọc cả file như người dùng tự làm với pandas (còn dòng rác phía trên tiêu đề, mọi cột là chữ).
+    CSV: các dòng rác ít cột hơn nên phải đặt sẵn số cột, tiêu đề thật nằm trong dữ liệu như với XLSX."""
+    import pandas as pd
+    import datagen
+    if path.endswith('.csv'): return pd.read_csv(path, header=None, names=range(len(datagen.HEADER)), dtype=str)
+    return pd.read_excel(path, dtype=str)
+
+# --- Các phép đo (chạy trong process con) ---
+
+def case_analyze_data(path, truth, args):
+    import analyzer
+    t0 = time.perf_counter()
+    df = read_raw(path)
+    load = round(time.perf_counter() - t0, 4)
+    seconds, runs, res = best_of(lambda: analyzer.analyze_data(df.copy()), args.repeat)
+    return {'seconds': seconds, 'runs': runs, 'load_seconds': load, 'ok': matches(truth, res[0])}
+
+def case_calculate_trend_forecast(path, truth, args):
+    import analyzer
+    df = analyzer.smart_preprocess(read_raw(path))
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    detected = analyzer.detect_columns(list(df.columns))
+    df[detected['revenue']] = analyzer.parse_currency_series(df[detected['revenue']])
+    seconds, runs, res = best_of(lambda: analyzer.calculate_trend_forecast(df, detected['date'], detected['revenue']), args.repeat)
+    return {'seconds': seconds, 'runs': runs, 'ok': res is not None and len(res['labels']) >= 12 * truth['years']}
+
+def case_clean_currency_text(path, truth, args):
+    import numpy as np
+    import pandas as pd
+    import analyzer
+    df = analyzer.smart_preprocess(read_raw(path))
+    values = pd.concat([df.iloc[:, 8], df.iloc[:, 9]], ignore_index=True)
+    values = values.iloc[np.random.default_rng(0).permutation(len(values))[:args.currency_sample]].reset_index(drop=True)
+    seconds, runs, scalar = best_of(lambda: [analyzer.clean_currency_text(v) for v in values.tolist()], args.repeat)
+    vector, _, vec = best_of(lambda: analyzer.parse_currency_series(values), args.repeat)
+    same = bool(np.allclose(np.asarray(scalar, dtype='float64'), vec.to_numpy(dtype='float64'), equal_nan=True))
+    return {'seconds': seconds, 'runs': runs, 'values': len(values), 'ns_per_value': round(seconds / len(values) * 1e9, 1),
+            'vectorized_seconds': vector, 'ok': same}
+
+def case_analyze_endpoint(path, truth, args):
+    tmp = tempfile.mkdtemp(prefix='datana_bench_')
+    atexit.register(shutil.rmtree, tmp, True)
+    for name, sub in (('DATANA_CUBE_DIR', 'cubes'), ('DATANA_ANALYSIS_DIR', 'analyses'), ('DATANA_STATE_DIR', 'states'),
+                      ('DATANA_LLM_CACHE', 'llm.db'), ('DATANA_NEWS_CACHE', 'news.db'),
+                      ('DATANA_LAYOUT_CACHE', 'layouts.db')):
+        os.environ[name] = os.path.join(tmp, sub)
+    os.chdir(BACKEND)
+    import app as app_module
+    import result_cache
+    client = app_module.app.test_client()
+
+    def post():
+        with open(path, 'rb') as fh:
+            r = client.post('/analyze', data={'file': (fh, os.path.basename(path))})
+        return r.status_code, r.get_json()
+
+    def cold():
+        result_cache.CACHE_DIR = tempfile.mkdtemp(dir=tmp)  # mỗi lần một cache trống
+        return post()
+    seconds, runs, (status, body) = best_of(cold, args.repeat)
+    cached, cached_runs, _ = best_of(post, args.repeat)
+    return {'seconds': seconds, 'runs': runs, 'ok': status == 200 and matches(truth, body.get('statistics', {})),
+            'response_mb': round(len(json.dumps(body)) / 2**20, 2), 'cached_seconds': cached, 'cached_runs': cached_runs}
+
+def child(case, path, args):
+    with open(path + '.truth.json', encoding='utf-8') as fh: truth = json.load(fh)
+    base = rss_mb()
+    out = globals()[f'case_{case}'](path, truth, args)
+    out.update(base_rss_mb=base, peak_rss_mb=rss_mb())
+    print(json.dumps(out))
+
+# --- Điều phối ---
+
+def run_case(case, path, args):
+    cmd = [sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--child', case, '--child-path', path,
+           '--repeat', str(args.repeat), '--currency-sample', str(args.currency_sample)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=BACKEND)
+    if proc.returncode != 0: return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'lỗi'}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def environment():
+    import numpy as np
+    import pandas as pd
+    git = lambda *a: subprocess.run(['git', *a], capture_output=True, text=True, cwd=BACKEND).stdout.strip()
+    return {'commit': git('rev-parse', '--short', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--', '.')),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def key(r):
+    return (r['case'], r['rows'], r['format'])
+
+def compare(results, old_path, threshold):
+    """In so sánh với lần chạy cũ; trả về danh sách phép đo chậm hơn ngưỡng."""
+    with open(old_path, encoding='utf-8') as fh: old = {key(r): r for r in json.load(fh)['results'] if 'seconds' in r}
+    regressions = []
+    print(f"\nSo với {old_path}:")
+    print(f"{'phép đo':<26} {'dòng':>10} {'định dạng':>9} {'thời gian':>11} {'peak RSS':>10}")
+    for r in results:
+        o = old.get(key(r))
+        if o is None or 'seconds' not in r: continue
+        t = r['seconds'] / o['seconds'] if o['seconds'] else float('inf')
+        m = r['peak_rss_mb'] / o['peak_rss_mb'] if o.get('peak_rss_mb') else float('nan')
+        flag = ''
+        if t > 1 + threshold:
+            flag = '  ⚠️ chậm hơn'
+            regressions.append(dict(r, ratio=round(t, 3)))
+        print(f"{r['case']:<26} {r['rows']:>10,} {r['format']:>9} {t:>10.2f}x {m:>9.2f}x{flag}")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='10k,1m')
+    ap.add_argument('--formats', default='csv,xlsx')
+    ap.add_argument('--cases', default=','.join(CASES))
+    ap.add_argument('--products', type=int, default=5000)
+    ap.add_argument('--regions', type=int, default=34)
+    ap.add_argument('--years', type=int, default=3)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--inmem-max', type=parse_size, default=2_000_000, help='số dòng tối đa cho analyze_data (cả file trong RAM)')
+    ap.add_argument('--currency-sample', type=int, default=200_000)
+    ap.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'datana_bench'))
+    ap.add_argument('--out', help='file JSON kết quả (mặc định benchmarks/results/suite-<thời điểm>-<commit>.json)')
+    ap.add_argument('--compare', help='file JSON của lần chạy trước')
+    ap.add_argument('--threshold', type=float, default=0.10)
+    ap.add_argument('--fail-on-regression', action='store_true', help='thoát mã 1 nếu có phép đo chậm hơn ngưỡng')
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    ap.add_argument('--child-path', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child: return child(args.child, args.child_path, args)
+
+    import datagen
+    env = environment()
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    print(f"commit {env['commit']}{' (có thay đổi chưa commit)' if env['dirty'] else ''}, python {env['python']}, "
+          f"pandas {env['pandas']}, {env['cpus']} CPU")
+    print(f"{'phép đo':<26} {'dòng':>10} {'định dạng':>9} {'giây':>9} {'dòng/s':>12} {'peak RSS MB':>12}  ok")
+    for size in map(parse_size, args.sizes.split(',')):
+        for fmt in args.formats.split(','):
+            base = dict(rows=size, format=fmt, products=args.products, regions=args.regions)
+            if fmt == 'xlsx' and size > datagen.XLSX_MAX_ROWS:
+                results.append(dict(base, case='*', skipped='XLSX giới hạn 1.048.576 dòng'))
+                continue
+            path = os.path.join(args.data_dir, f"sales_{size}_{args.products}p_{args.regions}r_{args.years}y_s{args.seed}.{fmt}")
+            t0 = time.perf_counter()
+            truth = datagen.ensure(path, size, fmt=fmt, products=args.products, regions=args.regions,
+                                   years=args.years, seed=args.seed)
+            if time.perf_counter() - t0 > 1: print(f"  (tạo {os.path.basename(path)}: {truth['bytes'] / 2**20:.0f} MB, {truth['seconds']:.0f}s)")
+            for case in args.cases.split(','):
+                if case in ('analyze_data', 'calculate_trend_forecast', 'clean_currency_text') and size > args.inmem_max:
+                    results.append(dict(base, case=case, skipped=f'> --inmem-max {args.inmem_max:,} dòng'))
+                    continue
+                r = dict(base, case=case, file_mb=round(truth['bytes'] / 2**20, 1), **run_case(case, path, args))
+                results.append(r)
+                if 'error' in r:
+                    print(f"{case:<26} {size:>10,} {fmt:>9}  lỗi: {r['error']}")
+                    continue
+                per_s = f"{size / r['seconds']:,.0f}" if case != 'clean_currency_text' else f"{r['values'] / r['seconds']:,.0f}"
+                print(f"{case:<26} {size:>10,} {fmt:>9} {r['seconds']:>9.3f} {per_s:>12} {r['peak_rss_mb']:>12.1f}  {'✓' if r['ok'] else '✗'}")
+                if case == 'analyze_endpoint':
+                    results.append(dict(base, case='analyze_endpoint_cached', seconds=r['cached_seconds'], runs=r['cached_runs'],
+                                        peak_rss_mb=r['peak_rss_mb'], ok=r['ok']))
+                    print(f"{'analyze_endpoint_cached':<26} {size:>10,} {fmt:>9} {r['cached_seconds']:>9.3f}")
+
+    out = args.out or os.path.join(HERE, 'results', f"suite-{time.strftime('%Y%m%d-%H%M%S')}-{env['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    payload = {'environment': env, 'config': {k: v for k, v in vars(args).items() if not k.startswith('child')}, 'results': results}
+    with open(out, 'w', encoding='utf-8') as fh: json.dump(payload, fh, ensure_ascii=False, indent=2)
+    print(f"\nĐã ghi {out}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions and args.fail_on_regression: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+check_currency.py — kiểm tra parse_currency_series (vector hóa) cho kết quả giống hệt clean_currency_text (scalar):
+  - giá trị mẫu có đáp án cố định (định dạng tiền Việt thường gặp)
+  - corpus đối chiếu các trường hợp biên, cột object và cột pandas StringDtype (như khi đọc CSV)
+  - --fuzz chuỗi ngẫu nhiên ghép từ các ký tự "khó" (dấu phân cách, đơn vị, chữ số unicode, chữ hoa)
+Lỗi nào cũng in ra và thoát với mã 1.
+Chạy: python benchmarks/check_currency.py [--fuzz 20000] [--seed 1]
+"""
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyzer import clean_currency_text, parse_currency_series
+
+# Bộ dữ liệu đối chiếu: các định dạng tiền tệ thường gặp + các trường hợp biên
+CORPUS = [
+    1000, 1234.5, -7, 0, np.int64(42), np.float32(1.5), float('nan'), None, True,
+    '', ' ', 'nan', 'NaN', 'None', 'null', 'abc', 'đ', '-', '--5', '5-', '.', ',', '.5', '5.',
+    '1000', '1.000', '1,000', '1.000.000', '1,000,000', '1.234,56', '1,234.56', '1.234.567,89',
+    '12,5', '1,5', '12,345', '1234,567', '123,456', '0,123', '1.23', '1.2345', '1.2.3', '1,2,3',
+    '2.300.000đ', '2.300.000 VNĐ', '1,5 tr', '1,5 triệu', '3 tỷ', '3 ty', '2.5B', '500k', '500 nghìn',
+    '1.5m', '10 mil', 'city 5', 'tr 5', '  7.500.000  ', '-1.234,5', '-2,5 tr', '1e5', '1_000',
+    '٣٤', '12٫5', '1.000,000.5', '100%', '$1,299.99', '(1.000)', 'USD 12,50', '１２３',
+]
+
+EXPECTED = {
+    '2.300.000đ': 2_300_000, '2.300.000 VNĐ': 2_300_000, '1,5 tr': 1_500_000, '1,5 triệu': 1_500_000,
+    '3 tỷ': 3_000_000_000, '500k': 500_000, '1.234,56': 1234.56, '1,234.56': 1234.56, '12,5': 12.5,
+    '1,000': 1000, '-2,5 tr': -2_500_000, '$1,299.99': 1299.99, 'abc': 0, '': 0, None: 0, 1000: 1000,
+}
+
+def same(expected, got):
+    """Hai mảng float bằng nhau từng phần tử, NaN coi như bằng NaN."""
+    expected, got = np.asarray(expected, dtype='float64'), np.asarray(got, dtype='float64')
+    return (expected == got) | (np.isnan(expected) & np.isnan(got))
+
+def check_expected():
+    values = list(EXPECTED)
+    got = parse_currency_series(pd.Series(values, dtype=object)).to_numpy()
+    for v, g in zip(values, got):
+        assert clean_currency_text(v) == EXPECTED[v], f"clean_currency_text({v!r}) = {clean_currency_text(v)}, cần {EXPECTED[v]}"
+        assert g == EXPECTED[v], f"parse_currency_series({v!r}) = {g}, cần {EXPECTED[v]}"
+
+def check_corpus():
+    ser = pd.Series(CORPUS, dtype=object)
+    ok = same(ser.apply(clean_currency_text), parse_currency_series(ser))
+    bad = [(CORPUS[i], clean_currency_text(CORPUS[i])) for i in np.flatnonzero(~ok)]
+    assert not bad, f"khác clean_currency_text: {bad}"
+
+def check_string_dtype():
+    ser = pd.Series([v for v in CORPUS if isinstance(v, str)] + [None], dtype='string')
+    ok = same(ser.apply(clean_currency_text), parse_currency_series(ser))
+    assert ok.all(), f"khác clean_currency_text (string dtype): {list(ser[~ok])}"
+
+def check_fuzz(n, seed):
+    rng = np.random.default_rng(seed)
+    alphabet = list('0123456789' * 3 + '.,-  ,.') + ['tr', 'TR', 'k', 'K', 'tỷ', 'TỶ', 'b', 'm', 'đ', 'vnđ', '٣', 'İ', 'nghìn', 'triệu', 'x']
+    fuzz = pd.Series([''.join(rng.choice(alphabet, rng.integers(0, 12))) for _ in range(n)], dtype=object)
+    ok = same(fuzz.apply(clean_currency_text), parse_currency_series(fuzz))
+    assert ok.all(), f"khác clean_currency_text (fuzz): {list(fuzz[~ok][:10])}"
+
+def run(fuzz=20_000, seed=1):
+    """Chạy mọi kiểm tra, trả về số kiểm tra lỗi."""
+    checks = [('giá trị mẫu', check_expected), ('corpus', check_corpus), ('string dtype', check_string_dtype),
+              (f'{fuzz:,} chuỗi ngẫu nhiên', lambda: check_fuzz(fuzz, seed))]
+    failed = 0
+    for name, check in checks:
+        try:
+            check()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            failed += 1
+    return failed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--fuzz', type=int, default=20_000, help='số chuỗi ngẫu nhiên')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+    sys.exit(1 if run(args.fuzz, args.seed) else 0)
+
+if __name__ == "__main__":
+    main()
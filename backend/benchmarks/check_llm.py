@@ -0,0 +1,144 @@
+"""
+check_llm.py — kiểm tra llm_client.LLMClient với server LLM giả (stub_llm.py), không cần key thật:
+  - stream: nhận từng token, nội dung ghép lại đúng câu trả lời
+  - thử lại: 429 + 503 vài lần đầu vẫn thành công, đếm đúng số lần thử lại; lỗi quá số lần thử -> LLMError
+  - quá tải: hết slot quá DATANA_LLM_QUEUE_TIMEOUT -> LLMBusy
+  - hủy: đóng generator giữa chừng -> stream tới LLM bị đóng và slot được trả
+  - cache: hỏi lại (khác khoảng trắng / hoa thường) không gọi LLM; nhiều request giống hệt đồng thời -> một lời gọi
+Lỗi nào cũng in ra và thoát với mã 1.
+Chạy: python benchmarks/check_llm.py [--tokens 20]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+def check_stream(llm_client, stub, base_url, tokens):
+    client = llm_client.LLMClient('stub', 'stub-model', base_url=base_url)
+    parts = [t for t in client.stream('Bạn là trợ lý.', 'Tổng quan doanh thu?') if t]
+    assert len(parts) == tokens, f"nhận {len(parts)} đoạn, cần {tokens}"
+    assert ''.join(parts) == ''.join(stub.words(tokens)), "nội dung stream khác câu trả lời của stub"
+    assert client.stats()['in_flight'] == 0
+
+def check_retry(llm_client, stub, base_url, tokens):
+    client = llm_client.LLMClient('stub', 'stub-model', base_url=base_url)
+    stub.rate_limit, stub.fail = 1, 2
+    failed = stub.count()['failed']
+    assert client.complete('Bạn là trợ lý.', 'Dự báo quý tới?') == ''.join(stub.words(tokens))
+    assert stub.count()['failed'] - failed == 3, "stub phải trả lỗi đúng 3 lần"
+    assert client.stats()['retries'] == 3, f"retries = {client.stats()['retries']}, cần 3"
+
+    stub.fail = llm_client.LLM_RETRIES + 1
+    try:
+        client.complete('Bạn là trợ lý.', 'Câu hỏi luôn lỗi')
+        raise AssertionError("hết lượt thử lại mà không báo LLMError")
+    except llm_client.LLMBusy: raise AssertionError("lỗi 503 không được báo là quá tải")
+    except llm_client.LLMError: pass
+    finally: stub.fail = 0
+
+def check_busy(llm_client, stub, base_url, tokens):
+    client = llm_client.LLMClient('stub', 'stub-model', base_url=base_url, concurrency=1)
+    ttft, stub.ttft = stub.ttft, 1.0
+    holder = threading.Thread(target=client.complete, args=('Bạn là trợ lý.', 'Giữ slot'))
+    try:
+        holder.start()
+        assert wait_for(lambda: client.stats()['in_flight'] == 1), "request đầu không giữ slot"
+        t0 = time.monotonic()
+        try:
+            client.complete('Bạn là trợ lý.', 'Không còn slot')
+            raise AssertionError("hết slot mà không báo LLMBusy")
+        except llm_client.LLMBusy: pass
+        assert time.monotonic() - t0 < llm_client.LLM_QUEUE_TIMEOUT + 0.5, "chờ slot quá DATANA_LLM_QUEUE_TIMEOUT"
+    finally:
+        holder.join()
+        stub.ttft = ttft
+    assert client.stats()['busy'] == 1 and client.stats()['in_flight'] == 0
+
+def check_disconnect(llm_client, stub, base_url, tokens):
+    client = llm_client.LLMClient('stub', 'stub-model', base_url=base_url, concurrency=1)
+    delay, stub.token_delay = stub.token_delay, 0.05
+    before = stub.count()['disconnected']
+    try:
+        stream = client.stream('Bạn là trợ lý.', 'Khu vực nào tăng trưởng tốt?')
+        received = 0
+        for text in stream:
+            received += bool(text)
+            if received == 3: break
+        stream.close()
+        assert wait_for(lambda: stub.count()['disconnected'] > before), "stream tới LLM không bị đóng sau khi hủy"
+    finally: stub.token_delay = delay
+    assert client.stats()['cancelled'] == 1 and client.stats()['in_flight'] == 0
+    # Slot duy nhất đã được trả: lời gọi tiếp theo chạy được ngay
+    assert client.complete('Bạn là trợ lý.', 'Sau khi hủy') == ''.join(stub.words(tokens))
+
+def check_cache(llm_client, stub, base_url, tokens):
+    tmp = tempfile.mkdtemp(prefix='datana_check_llm_')
+    try: _check_cache(llm_client, stub, base_url, os.path.join(tmp, 'llm.db'))
+    finally: shutil.rmtree(tmp, ignore_errors=True)
+
+def _check_cache(llm_client, stub, base_url, path):
+    client = llm_client.LLMClient('stub', 'stub-model', base_url=base_url, cache=llm_client.PromptCache(path))
+    calls = stub.count()['requests']
+    first = client.complete('Bạn là trợ lý.', 'Tổng quan kinh doanh tháng này', cache=True)
+    again = client.complete('Bạn là trợ lý.', '  tổng quan   KINH DOANH tháng này ', cache=True)
+    assert again == first and stub.count()['requests'] - calls == 1, "hỏi lại không lấy từ cache"
+
+    ttft, stub.ttft = stub.ttft, 0.3
+    calls, texts = stub.count()['requests'], []
+    threads = [threading.Thread(target=lambda: texts.append(client.complete('Bạn là trợ lý.', 'Soi biên lợi nhuận', cache=True)))
+               for _ in range(4)]
+    try:
+        for t in threads: t.start()
+        for t in threads: t.join()
+    finally: stub.ttft = ttft
+    assert len(texts) == 4 and len(set(texts)) == 1, "các request gộp nhận câu trả lời khác nhau"
+    assert stub.count()['requests'] - calls == 1, f"{stub.count()['requests'] - calls} lời gọi LLM, cần 1"
+    stats = client.stats()['cache']
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['coalesced'] == 3, f"thống kê cache sai: {stats}"
+
+CHECKS = [('stream', check_stream), ('thử lại 429 / 503', check_retry), ('quá tải -> LLMBusy', check_busy),
+          ('hủy giữa chừng', check_disconnect), ('cache + gộp request', check_cache)]
+
+def run(tokens=20):
+    """Chạy mọi kiểm tra với một stub LLM riêng, trả về số kiểm tra lỗi."""
+    # Backoff / thời gian chờ slot ngắn để kiểm tra chạy nhanh (đọc khi import llm_client)
+    os.environ.setdefault('DATANA_LLM_BACKOFF_BASE', '0.01')
+    os.environ.setdefault('DATANA_LLM_QUEUE_TIMEOUT', '0.3')
+    import llm_client
+    import stub_llm
+    stub = stub_llm.serve(0, tokens=tokens, ttft=0, token_delay=0)
+    base_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    failed = 0
+    try:
+        for name, check in CHECKS:
+            try:
+                check(llm_client, stub, base_url, tokens)
+                print(f"✅ {name}")
+            except AssertionError as e:
+                print(f"❌ {name}: {e}")
+                failed += 1
+    finally: stub.shutdown()
+    return failed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--tokens', type=int, default=20, help='số token mỗi câu trả lời của stub')
+    args = ap.parse_args()
+    sys.exit(1 if run(args.tokens) else 0)
+
+if __name__ == "__main__":
+    main()
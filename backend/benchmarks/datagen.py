@@ -0,0 +1,185 @@
+"""
+datagen.py — tạo file bán hàng tổng hợp kiểu Việt Nam (CSV / XLSX) cho bộ benchmark (bench_suite.py).
+  - vài dòng rác trước dòng tiêu đề (tên báo cáo, ngày xuất, dòng trống) -> smart_preprocess / dò tiêu đề phải làm việc
+  - tiền nhiều định dạng trộn lẫn: '2.300.000đ', '1,5 tr', '3 tỷ', '2.300.000 VNĐ', '850k', '1.250.000', số thuần
+  - số sản phẩm / khu vực / thương hiệu cấu hình được, ngày dd/mm/yyyy trải nhiều năm (cao điểm tháng 12 - Tết)
+  - cùng seed -> cùng file; kèm <file>.truth.json: số dòng, tổng doanh thu / lợi nhuận / số lượng đúng
+    (giá trị được làm tròn trước khi định dạng nên chuỗi tiền đọc lại ra đúng số đó)
+XLSX tối đa 1.048.575 dòng dữ liệu (giới hạn của Excel), ghi bằng openpyxl write-only.
+Chạy: python benchmarks/datagen.py --rows 1000000 --format csv --out /tmp/sales_1m.csv [--products 5000] [--regions 63] [--years 3]
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+XLSX_MAX_ROWS = 1_048_576 - 1 - 8  # trừ dòng tiêu đề + dòng rác
+BLOCK_ROWS = 250_000
+PROVINCES = ['Hà Nội', 'TP.HCM', 'Đà Nẵng', 'Hải Phòng', 'Cần Thơ', 'Bình Dương', 'Đồng Nai', 'Khánh Hòa', 'Quảng Ninh',
+             'Thừa Thiên Huế', 'Nghệ An', 'Thanh Hóa', 'Lâm Đồng', 'Bà Rịa - Vũng Tàu', 'Long An', 'Bắc Ninh', 'Hưng Yên',
+             'Vĩnh Phúc', 'Thái Nguyên', 'Nam Định', 'Quảng Nam', 'Bình Định', 'Đắk Lắk', 'Kiên Giang', 'An Giang',
+             'Tiền Giang', 'Bến Tre', 'Hải Dương', 'Thái Bình', 'Phú Thọ', 'Gia Lai', 'Bình Thuận', 'Tây Ninh', 'Sóc Trăng']
+# Mặt hàng -> ngành hàng
+ITEMS = {'Sữa tươi': 'Đồ uống', 'Nước mắm': 'Thực phẩm', 'Cà phê rang xay': 'Đồ uống', 'Bánh quy': 'Thực phẩm',
+         'Dầu gội': 'Hóa mỹ phẩm', 'Nồi cơm điện': 'Gia dụng', 'Quạt đứng': 'Gia dụng', 'Tai nghe': 'Điện tử',
+         'Áo thun': 'Thời trang', 'Giày thể thao': 'Thời trang', 'Mì gói': 'Thực phẩm', 'Trà xanh': 'Đồ uống',
+         'Kem chống nắng': 'Hóa mỹ phẩm', 'Bột giặt': 'Hóa mỹ phẩm', 'Điện thoại': 'Điện tử', 'Bút bi': 'Văn phòng phẩm'}
+BRANDS = ['Vinamilk', 'Trung Nguyên', 'Masan', 'Kinh Đô', 'Sunhouse', 'Điện Quang', 'Biti\'s', 'Acecook', 'Unilever',
+          'Thiên Long', 'Rạng Đông', 'TH True Milk', 'Highlands', 'Vissan', 'Hảo Hảo', 'May 10']
+NOTES = ['', '', 'Giao nhanh', 'Khách quen', 'Đổi trả', 'COD', 'Khuyến mãi']
+JUNK = [['BÁO CÁO DOANH THU BÁN HÀNG'], ['Đơn vị: Công ty TNHH Thương mại DATANA'], ['Ngày xuất: 05/01/2025'], []]
+HEADER = ['STT', 'Ngày bán', 'Mã SP', 'Tên sản phẩm', 'Thương hiệu', 'Ngành hàng', 'Khu vực', 'Số lượng',
+          'Doanh thu', 'Lợi nhuận', 'Ghi chú']
+# Định dạng tiền: (tên, bước làm tròn, tỉ lệ xuất hiện; 'tỷ' chỉ dành cho đơn lớn)
+MONEY_FORMATS = (('dot_dong', 1_000, 0.30), ('trieu', 100_000, 0.20), ('ty', 100_000_000, 0.02),
+                 ('vnd', 1_000, 0.13), ('k', 1_000, 0.10), ('dots', 1_000, 0.15), ('plain', 1, 0.10))
+
+def labels(base, n, suffix_fmt):
+    """n nhãn: các nhãn thật trước, thêm hậu tố khi cần nhiều hơn."""
+    if n <= len(base): return np.array(base[:n], dtype=object)
+    return np.array(base + [suffix_fmt.format(base[i % len(base)], i // len(base)) for i in range(len(base), n)], dtype=object)
+
+def _dots(values):
+    """2300000 -> '2.300.000'."""
+    return np.array([f'{v:,}'.replace(',', '.') for v in values.tolist()], dtype=object)
+
+def _decimal(values, unit):
+    """'1,5' kiểu Việt Nam (dấu phẩy thập phân), bỏ ',0'."""
+    return np.array([(f'{v / unit:.1f}'.rstrip('0').rstrip('.')).replace('.', ',') for v in values.tolist()], dtype=object)
+
+def format_money(values, kinds):
+    """values: int64 đã làm tròn theo định dạng; kinds: chỉ số trong MONEY_FORMATS."""
+    out = np.empty(len(values), dtype=object)
+    for k, (name, _, _) in enumerate(MONEY_FORMATS):
+        m = kinds == k
+        if not m.any(): continue
+        v = values[m]
+        if name == 'dot_dong': out[m] = _dots(v) + 'đ'
+        elif name == 'trieu': out[m] = _decimal(v, 1_000_000) + ' tr'
+        elif name == 'ty': out[m] = _decimal(v, 1_000_000_000) + ' tỷ'
+        elif name == 'vnd': out[m] = _dots(v) + ' VNĐ'
+        elif name == 'k': out[m] = np.char.add((v // 1000).astype(str), 'k').astype(object)
+        elif name == 'dots': out[m] = _dots(v)
+        else: out[m] = v.astype(str).astype(object)
+    return out
+
+def money_values(rng, base):
+    """(giá trị đã làm tròn theo định dạng, mã định dạng). 'tỷ' chỉ dùng cho giá trị >= 1 tỷ (một nửa số đó)."""
+    probs = np.array([p if name != 'ty' else 0 for name, _, p in MONEY_FORMATS])
+    kinds = rng.choice(len(MONEY_FORMATS), len(base), p=probs / probs.sum())
+    big = (base >= 1_000_000_000) & (rng.random(len(base)) < 0.5)
+    kinds[big] = [i for i, f in enumerate(MONEY_FORMATS) if f[0] == 'ty'][0]
+    steps = np.array([s for _, s, _ in MONEY_FORMATS], dtype='int64')[kinds]
+    values = np.maximum(np.round(base / steps).astype('int64'), 1) * steps
+    return values, kinds
+
+def block_frame(rng, start, n, products, regions, years, end_year):
+    p = rng.integers(0, len(products['name']), n)
+    # Ngày: cao điểm tháng 12 - 1 (Tết) và tăng dần theo năm
+    days = rng.integers(0, 365 * years, n)
+    peak = rng.random(n) < 0.15
+    days[peak] = (rng.integers(0, years, peak.sum()) * 365 + rng.integers(330, 395, peak.sum())) % (365 * years)
+    dates = pd.Timestamp(f'{end_year - years + 1}-01-01') + pd.to_timedelta(days, unit='D')
+    qty = rng.integers(1, 40, n)
+    base = qty * products['price'][p]
+    # Đơn sỉ hiếm (~0,3%): 1-3 tỷ
+    wholesale = rng.random(n) < 0.003
+    base[wholesale] = rng.integers(10, 31, wholesale.sum()) * 100_000_000
+    revenue, rev_kinds = money_values(rng, base)
+    margin = products['margin'][p] + rng.normal(0, 0.05, n)
+    profit, prof_kinds = money_values(rng, np.abs(revenue * margin).astype('int64'))
+    profit = np.where(margin < 0, -profit, profit)
+    prof_text = format_money(np.abs(profit), prof_kinds)
+    prof_text = np.where(profit < 0, np.char.add('-', prof_text.astype(str)).astype(object), prof_text)
+    frame = pd.DataFrame({
+        'STT': np.arange(start + 1, start + n + 1),
+        'Ngày bán': dates.strftime('%d/%m/%Y'),
+        'Mã SP': products['code'][p],
+        'Tên sản phẩm': products['name'][p],
+        'Thương hiệu': products['brand'][p],
+        'Ngành hàng': products['category'][p],
+        'Khu vực': regions[rng.integers(0, len(regions), n)],
+        'Số lượng': qty,
+        'Doanh thu': format_money(revenue, rev_kinds),
+        'Lợi nhuận': prof_text,
+        'Ghi chú': rng.choice(NOTES, n),
+    })
+    return frame, {'revenue': int(revenue.sum()), 'profit': int(profit.sum()), 'quantity': int(qty.sum())}
+
+def catalog(rng, n_products, n_brands):
+    brands = labels(BRANDS, n_brands, '{} {}')
+    items = list(ITEMS)
+    idx = np.arange(n_products)
+    return {
+        'code': np.array([f'SP{i:07d}' for i in range(n_products)], dtype=object),
+        'name': np.array([f'{items[i % len(items)]} {brands[i % len(brands)]} {i // len(items):05d}' for i in range(n_products)], dtype=object),
+        'brand': brands[idx % len(brands)],
+        'category': np.array([ITEMS[i] for i in items], dtype=object)[idx % len(items)],
+        'price': (rng.lognormal(11.5, 1.0, n_products).astype('int64') // 1000 + 1) * 1000,
+        'margin': rng.normal(0.15, 0.12, n_products),
+    }
+
+def generate(path, rows, fmt=None, products=5000, regions=34, brands=16, years=3, end_year=2025, seed=0, junk=True):
+    """Ghi file + <path>.truth.json, trả về dict truth."""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == 'xlsx' and rows > XLSX_MAX_ROWS: raise ValueError(f"XLSX tối đa {XLSX_MAX_ROWS:,} dòng dữ liệu")
+    rng = np.random.default_rng(seed)
+    prods = catalog(rng, products, brands)
+    region_names = labels(PROVINCES, regions, '{} - Khu {}')
+    totals = {'revenue': 0, 'profit': 0, 'quantity': 0}
+    t0 = time.perf_counter()
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if fmt == 'csv':
+        with open(tmp, 'w', encoding='utf-8', newline='') as fh:
+            if junk:
+                for row in JUNK: fh.write(','.join(row) + '\n')
+            for start in range(0, rows, BLOCK_ROWS):
+                frame, part = block_frame(rng, start, min(BLOCK_ROWS, rows - start), prods, region_names, years, end_year)
+                frame.to_csv(fh, index=False, header=start == 0)
+                for k in totals: totals[k] += part[k]
+    elif fmt == 'xlsx':
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('DoanhThu')
+        if junk:
+            for row in JUNK: ws.append(row or [None])
+        ws.append(HEADER)
+        for start in range(0, rows, BLOCK_ROWS):
+            frame, part = block_frame(rng, start, min(BLOCK_ROWS, rows - start), prods, region_names, years, end_year)
+            for row in frame.itertuples(index=False, name=None): ws.append(row)
+            for k in totals: totals[k] += part[k]
+        wb.save(tmp)
+    else: raise ValueError("format phải là csv hoặc xlsx")
+    os.replace(tmp, path)
+    truth = dict(totals, rows=rows, format=fmt, products=products, regions=regions, brands=brands, years=years,
+                 seed=seed, junk_rows=len(JUNK) if junk else 0, bytes=os.path.getsize(path),
+                 seconds=round(time.perf_counter() - t0, 2))
+    with open(path + '.truth.json', 'w', encoding='utf-8') as fh: json.dump(truth, fh, ensure_ascii=False, indent=2)
+    return truth
+
+def ensure(path, rows, **options):
+    """Dùng lại file đã tạo nếu truth.json khớp số dòng + tham số, không thì tạo mới."""
+    try:
+        with open(path + '.truth.json', encoding='utf-8') as fh: truth = json.load(fh)
+        want = dict(options, rows=rows)
+        if os.path.exists(path) and all(truth.get(k) == v for k, v in want.items() if k in truth): return truth
+    except (OSError, ValueError): pass
+    return generate(path, rows, **options)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=10_000)
+    ap.add_argument('--format', choices=('csv', 'xlsx'))
+    ap.add_argument('--out', required=True)
+    ap.add_argument('--products', type=int, default=5000)
+    ap.add_argument('--regions', type=int, default=34)
+    ap.add_argument('--brands', type=int, default=16)
+    ap.add_argument('--years', type=int, default=3)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--no-junk', action='store_true', help='không thêm dòng rác trước tiêu đề')
+    args = ap.parse_args()
+    truth = generate(args.out, args.rows, args.format, args.products, args.regions, args.brands, args.years,
+                     seed=args.seed, junk=not args.no_junk)
+    print(json.dumps(truth, ensure_ascii=False, indent=2))
@@ -0,0 +1,132 @@
+"""
+stub_llm.py — server LLM giả tương thích API chat completions (Groq/OpenAI) để thử /api/chat và /api/chat/stream
+không cần key thật và không tốn quota.
+  - POST .../chat/completions: trả lời N token (stream=true -> SSE từng token, có độ trễ token đầu + giữa các token,
+    gói cuối kèm usage như Groq)
+  - --fail k: k request kế tiếp trả 503 (thử backoff), --rate-limit k: k request kế tiếp trả 429 kèm Retry-After
+    (đặt lại server.fail / server.rate_limit khi chạy trong process để gây lỗi giữa chừng)
+  - GET /stats: số request, số stream hoàn tất, số stream bị client đóng giữa chừng (kiểm tra hủy khi ngắt kết nối)
+Chạy: python benchmarks/stub_llm.py [--port 8765] [--tokens 200] [--ttft 0.3] [--token-delay 0.02]
+rồi khởi động app với DATANA_LLM_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=stub
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubLLM(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tokens=200, ttft=0.3, token_delay=0.02, fail=0, rate_limit=0):
+        super().__init__(address, Handler)
+        self.tokens, self.ttft, self.token_delay = tokens, ttft, token_delay
+        self.fail, self.rate_limit = fail, rate_limit
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'completed': 0, 'disconnected': 0, 'failed': 0, 'active': 0, 'max_active': 0}
+
+    def count(self, **delta):
+        with self.lock:
+            for k, v in delta.items(): self.counters[k] += v
+            self.counters['max_active'] = max(self.counters['max_active'], self.counters['active'])
+            return dict(self.counters)
+
+    def take_failure(self):
+        """Mã lỗi cho request này (429 trước, rồi 503) khi còn lượt lỗi đã đặt; None = trả lời bình thường."""
+        with self.lock:
+            for attr, code in (('rate_limit', 429), ('fail', 503)):
+                if getattr(self, attr) > 0:
+                    setattr(self, attr, getattr(self, attr) - 1)
+                    self.counters['failed'] += 1
+                    return code
+
+    def words(self, n):
+        return [f"từ{i} " for i in range(n)]
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args): pass
+
+    def _json(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'): return self._json(200, self.server.count())
+        self._json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'): return self._json(404, {'error': {'message': 'not found'}})
+        self.server.count(requests=1)
+        failure = self.server.take_failure()
+        if failure == 429: return self._json(429, {'error': {'message': 'rate limited'}}, {'Retry-After': '0.2'})
+        if failure == 503: return self._json(503, {'error': {'message': 'overloaded'}})
+        n = min(self.server.tokens, int(body.get('max_tokens') or self.server.tokens))
+        words, model = self.server.words(n), body.get('model', 'stub')
+        self.server.count(active=1)
+        try:
+            time.sleep(self.server.ttft)
+            if not body.get('stream'):
+                time.sleep(self.server.token_delay * n)
+                self._json(200, {'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                                 'choices': [{'index': 0, 'finish_reason': 'stop',
+                                              'message': {'role': 'assistant', 'content': ''.join(words)}}]})
+                self.server.count(completed=1)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for i, w in enumerate(words):
+                    if i: time.sleep(self.server.token_delay)
+                    self._chunk(model, {'content': w}, None)
+                prompt = sum(len(m.get('content') or '') for m in body.get('messages', [])) // 4
+                self._chunk(model, {}, 'stop', {'id': 'stub', 'usage': {'prompt_tokens': prompt, 'completion_tokens': n,
+                                                                      'total_tokens': prompt + n}})
+                self._write(b'data: [DONE]\n\n')
+                self._write(b'')
+                self.server.count(completed=1)
+            except (BrokenPipeError, ConnectionResetError):
+                self.server.count(disconnected=1)
+                self.close_connection = True
+        finally:
+            self.server.count(active=-1)
+
+    def _chunk(self, model, delta, finish, x_groq=None):
+        payload = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                   'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}]}
+        if x_groq: payload['x_groq'] = x_groq  # usage ở gói cuối như Groq
+        self._write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    def _write(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+def serve(port=8765, **options):
+    """Chạy stub trong thread nền, trả về server (server.shutdown() để dừng)."""
+    server = StubLLM(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--tokens', type=int, default=200)
+    ap.add_argument('--ttft', type=float, default=0.3, help='giây trước token đầu')
+    ap.add_argument('--token-delay', type=float, default=0.02, help='giây giữa hai token')
+    ap.add_argument('--fail', type=int, default=0, help='số request kế tiếp trả 503')
+    ap.add_argument('--rate-limit', type=int, default=0, help='số request kế tiếp trả 429')
+    args = ap.parse_args()
+    server = StubLLM(('127.0.0.1', args.port), tokens=args.tokens, ttft=args.ttft, token_delay=args.token_delay,
+                     fail=args.fail, rate_limit=args.rate_limit)
+    print(f"Stub LLM: http://127.0.0.1:{args.port} (DATANA_LLM_BASE_URL)")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
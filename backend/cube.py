@@ -0,0 +1,229 @@
+"""
+cube.py — khối tổng hợp (product × brand × category × region × month) cho API lọc / drill-down phía server.
+analyzer tạo cube trong cùng lượt tổng hợp: mỗi tổ hợp nhãn một dòng với tổng revenue/profit/quantity
+và số dòng gốc (rows), nên truy vấn phản ánh toàn bộ file chứ không chỉ raw_data mẫu.
+Lưu dạng cột .npy (mở bằng memory mapping). Mỗi chiều gồm:
+  - mã int32 theo nhãn đã sắp xếp (month 'YYYY-MM' sắp theo thời gian, 'N/A' ở cuối)
+  - chỉ mục ngược dạng CSR: các dòng có nhãn c là order[offsets[c]:offsets[c+1]]
+Ghi lại cube (nối thêm dữ liệu) dựng thư mục mới rồi đổi tên vào chỗ cũ; Cube mở mọi mảng ngay khi tạo và giữ dấu
+(inode, mtime) của meta.json (stamp) để phía dùng nhận ra cube đã được thay.
+Lọc bắt đầu từ tập dòng nhỏ nhất trong các điều kiện rồi thu hẹp bằng bảng tra mã,
+nên chi phí tỉ lệ với số dòng được chọn; group-by dùng np.bincount.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+
+DIMENSIONS = ('product', 'brand', 'category', 'region', 'month')
+MEASURES = ('revenue', 'profit', 'quantity', 'rows')
+MISSING_MONTH = 'N/A'
+ARRAYS = tuple(f'{d}.{part}' for d in DIMENSIONS for part in ('codes', 'order', 'offsets')) + MEASURES
+OPEN_RETRIES = 20
+
+def _index(codes, n_labels):
+    order = np.argsort(codes, kind='stable').astype('int64')
+    offsets = np.zeros(n_labels + 1, dtype='int64')
+    np.cumsum(np.bincount(codes, minlength=n_labels), out=offsets[1:])
+    return order, offsets
+
+def encode(frame):
+    """DataFrame cube (cột DIMENSIONS + MEASURES) -> (meta, {tên: mảng})."""
+    meta, arrays = {'rows': len(frame), 'labels': {}}, {}
+    for dim in DIMENSIONS:
+        codes, labels = pd.factorize(frame[dim].astype(str).to_numpy(dtype=object), sort=True)
+        labels = [str(l) for l in labels]
+        if dim == 'month' and MISSING_MONTH in labels:
+            # 'N/A' luôn ở cuối để khoảng tháng là một đoạn mã liên tục
+            na = labels.index(MISSING_MONTH)
+            codes = np.where(codes == na, len(labels) - 1, codes - (codes > na))
+            labels = labels[:na] + labels[na + 1:] + [MISSING_MONTH]
+        codes = codes.astype('int32')
+        meta['labels'][dim] = labels
+        arrays[f'{dim}.codes'] = codes
+        arrays[f'{dim}.order'], arrays[f'{dim}.offsets'] = _index(codes, len(labels))
+    for m in MEASURES:
+        arrays[m] = frame[m].to_numpy(dtype='float64') if m in frame else np.zeros(len(frame))
+    return meta, arrays
+
+def stamp(path):
+    """Dấu phiên bản của cube tại path: (inode, mtime ns) của meta.json, None nếu chưa có."""
+    try: st = os.stat(os.path.join(path, 'meta.json'))
+    except OSError: return None
+    return st.st_ino, st.st_mtime_ns
+
+def save(path, frame):
+    """Ghi vào thư mục tạm riêng rồi đổi tên vào path: người đọc thấy trọn bản cũ hoặc trọn bản mới, không bao giờ
+    trộn mảng mới với nhãn cũ. Bản cũ được đổi tên sang chỗ khác trước khi xóa (Cube đã mở vẫn giữ mảng của nó)."""
+    meta, arrays = encode(frame)
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp)
+    for name, arr in arrays.items(): np.save(os.path.join(tmp, f'{name}.npy'), arr)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as fh: json.dump(meta, fh, ensure_ascii=False)
+    old = []
+    while True:
+        try:
+            os.rename(tmp, path)  # không ghi đè được thư mục khác rỗng -> dời bản cũ đi rồi thử lại
+            break
+        except OSError:
+            if not os.path.exists(path): raise
+            trash = f'{path}.{uuid.uuid4().hex}.old'
+            try: os.rename(path, trash)
+            except FileNotFoundError: continue
+            old.append(trash)
+    for trash in old: shutil.rmtree(trash, ignore_errors=True)
+
+def from_records(records):
+    """Cube dựng từ raw_data (cho phân tích cũ chưa có cube; chỉ phản ánh các dòng mẫu)."""
+    import analyzer
+    df = pd.DataFrame(records)
+    if df.empty: return pd.DataFrame(columns=list(DIMENSIONS) + list(MEASURES))
+    defaults = {'product': 'Unknown', 'brand': 'Khác', 'category': 'Khác', 'region': 'Khác'}
+    keys = {d: df[d].fillna('').astype(str) if d in df else pd.Series(v, index=df.index) for d, v in defaults.items()}
+    months = df['month'] if 'month' in df else pd.Series(None, index=df.index, dtype=object)
+    keys['month'] = pd.Series(analyzer.month_labels(analyzer.month_periods(months.astype(object))), index=df.index)
+    values = pd.DataFrame({m: pd.to_numeric(df[m], errors='coerce').fillna(0.0) if m in df else 0.0
+                           for m in ('revenue', 'profit', 'quantity')}, index=df.index).assign(rows=1)
+    return values.groupby([keys[d].rename(d) for d in DIMENSIONS], sort=False).sum().reset_index()
+
+def prune(directory, ttl, keep_prefix='db_'):
+    """Xóa các cube của phiên tạm (không bắt đầu bằng keep_prefix) và thư mục tạm / bản cũ còn sót của save()
+    cũ hơn ttl giây."""
+    cutoff = time.time() - ttl
+    try: entries = list(os.scandir(directory))
+    except FileNotFoundError: return
+    for e in entries:
+        try:
+            stale = not e.name.startswith(keep_prefix) or e.name.endswith(('.tmp', '.old'))
+            if e.is_dir() and stale and e.stat().st_mtime < cutoff: shutil.rmtree(e.path)
+        except OSError: pass
+
+class Cube:
+    """Cube đã lưu, mở bằng memory mapping. Dùng lại được cho nhiều truy vấn.
+    Mọi mảng được mở ngay (cùng lượt đọc meta.json), nên cube được ghi lại sau đó không ảnh hưởng tới đối tượng này."""
+    def __init__(self, path):
+        self.path = path
+        for attempt in range(OPEN_RETRIES):
+            try:
+                self.stamp = stamp(path)
+                with open(os.path.join(path, 'meta.json'), encoding='utf-8') as fh: meta = json.load(fh)
+                arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+                # Thư mục bị thay giữa chừng -> đọc lại để meta và mảng cùng một bản
+                if stamp(path) == self.stamp: break
+            except (FileNotFoundError, ValueError):
+                # ValueError: np.load đọc header và mmap file của hai bản khác nhau
+                if attempt == OPEN_RETRIES - 1: raise
+            time.sleep(0.01)
+        self.rows = meta['rows']
+        self.labels = meta['labels']
+        self._arrays = arrays
+        self._lookup = {}
+
+    def array(self, name):
+        return self._arrays[name]
+
+    def code_of(self, dim):
+        if dim not in self._lookup: self._lookup[dim] = {l: i for i, l in enumerate(self.labels[dim])}
+        return self._lookup[dim]
+
+    def _month_range(self, date_from, date_to):
+        """Đoạn mã tháng [lo, hi) ứng với khoảng ngày (so sánh theo 'YYYY-MM')."""
+        months = self.labels['month']
+        n = len(months) - (1 if months and months[-1] == MISSING_MONTH else 0)
+        lo = int(np.searchsorted(months[:n], str(date_from)[:7], 'left')) if date_from else 0
+        hi = int(np.searchsorted(months[:n], str(date_to)[:7], 'right')) if date_to else n
+        return lo, max(lo, hi)
+
+    def select(self, filters=None, date_from=None, date_to=None):
+        """Chỉ số các dòng cube thỏa mọi điều kiện (None = tất cả).
+        filters: {chiều: [nhãn, ...]}; date_from/date_to: 'YYYY-MM' hoặc 'YYYY-MM-DD'."""
+        conds = []  # (số dòng ứng viên, chiều, bảng tra mã được chọn, danh sách đoạn posting)
+        for dim, values in (filters or {}).items():
+            if dim not in DIMENSIONS or values is None: continue
+            if isinstance(values, str): values = [values]
+            lookup = self.code_of(dim)
+            codes = sorted({lookup[str(v)] for v in values if str(v) in lookup})
+            if not codes: return np.array([], dtype='int64')
+            offsets = self.array(f'{dim}.offsets')
+            spans = [(int(offsets[c]), int(offsets[c + 1])) for c in codes]
+            lut = np.zeros(len(self.labels[dim]), dtype=bool)
+            lut[codes] = True
+            conds.append((sum(b - a for a, b in spans), dim, lut, spans))
+        if date_from or date_to:
+            lo, hi = self._month_range(date_from, date_to)
+            if lo >= hi: return np.array([], dtype='int64')
+            offsets = self.array('month.offsets')
+            lut = np.zeros(len(self.labels['month']), dtype=bool)
+            lut[lo:hi] = True
+            # mã tháng liên tiếp -> các dòng nằm trong một đoạn liên tục của order
+            conds.append((int(offsets[hi] - offsets[lo]), 'month', lut, [(int(offsets[lo]), int(offsets[hi]))]))
+        if not conds: return None
+        conds.sort(key=lambda c: c[0])
+        _, dim, _, spans = conds[0]
+        order = self.array(f'{dim}.order')
+        idx = np.concatenate([order[a:b] for a, b in spans]) if spans else np.array([], dtype='int64')
+        for _, dim, lut, _ in conds[1:]:
+            if not len(idx): break
+            idx = idx[lut[self.array(f'{dim}.codes')[idx]]]
+        return idx
+
+    def series_matrix(self, dim, filters=None, date_from=None, date_to=None, measure='revenue'):
+        """(nhãn chuỗi, PeriodIndex tháng liên tục, ma trận chuỗi × tháng) của `measure` theo chiều dim
+        trên các dòng đã lọc; bỏ tháng 'N/A' và các chuỗi không có dữ liệu. Xem forecasting.py."""
+        if dim not in DIMENSIONS or dim == 'month': raise ValueError(f"dim phải thuộc {DIMENSIONS[:-1]}")
+        if measure not in MEASURES: raise ValueError(f"measure phải thuộc {MEASURES}")
+        months = self.labels['month']
+        n_months = len(months) - (1 if months and months[-1] == MISSING_MONTH else 0)
+        if not n_months: return [], pd.PeriodIndex([], freq='M'), np.zeros((0, 0))
+        idx = self.select(filters, date_from, date_to)
+        take = (lambda a: np.asarray(a)) if idx is None else (lambda a: a[idx])
+        ords = np.array([pd.Period(m, 'M').ordinal for m in months[:n_months]], dtype='int64')
+        month_codes = take(self.array('month.codes'))
+        keep = month_codes < n_months
+        n_periods = int(ords.max() - ords.min() + 1)
+        flat = take(self.array(f'{dim}.codes'))[keep].astype('int64') * n_periods + (ords - ords.min())[month_codes[keep]]
+        n_series = len(self.labels[dim])
+        matrix = np.bincount(flat, weights=take(self.array(measure))[keep], minlength=n_series * n_periods).reshape(n_series, n_periods)
+        rows = np.flatnonzero(matrix.any(axis=1))
+        span = pd.period_range(pd.Period(ordinal=int(ords.min()), freq='M'), periods=n_periods, freq='M')
+        return [self.labels[dim][i] for i in rows.tolist()], span, matrix[rows]
+
+    def query(self, group_by, filters=None, date_from=None, date_to=None, limit=None):
+        """Tổng revenue/profit/quantity/rows theo một hoặc nhiều chiều trên các dòng đã lọc.
+        Nhóm theo month: sắp theo thời gian; các chiều khác: doanh thu giảm dần (limit = lấy n nhóm đầu)."""
+        dims = [group_by] if isinstance(group_by, str) else list(group_by)
+        if not dims or any(d not in DIMENSIONS for d in dims): raise ValueError(f"group_by phải thuộc {DIMENSIONS}")
+        idx = self.select(filters, date_from, date_to)
+        take = (lambda a: np.asarray(a)) if idx is None else (lambda a: a[idx])
+        sizes = [len(self.labels[d]) for d in dims]
+
+        if len(dims) == 1:
+            keys, n_groups = take(self.array(f'{dims[0]}.codes')), sizes[0]
+        else:
+            combined = np.zeros(self.rows if idx is None else len(idx), dtype='int64')
+            for d, size in zip(dims, sizes): combined = combined * size + take(self.array(f'{d}.codes'))
+            group_keys, keys = np.unique(combined, return_inverse=True)
+            n_groups = len(group_keys)
+        sums = {m: np.bincount(keys, weights=take(self.array(m)), minlength=n_groups) for m in MEASURES}
+        present = np.flatnonzero(sums['rows'] > 0)
+
+        if len(dims) == 1:
+            names = [self.labels[dims[0]][c] for c in present.tolist()]
+        else:
+            codes, rest = [], group_keys[present]
+            for size in reversed(sizes):
+                rest, c = np.divmod(rest, size)
+                codes.append(c.tolist())
+            names = [[self.labels[d][c] for d, c in zip(dims, row)] for row in zip(*reversed(codes))]
+
+        if dims != ['month']:
+            pick = np.argsort(-sums['revenue'][present], kind='stable')
+            if limit: pick = pick[:int(limit)]
+            names, present = [names[i] for i in pick.tolist()], present[pick]
+        out = {'group_by': dims[0] if len(dims) == 1 else dims, 'labels': names}
+        out.update({m: sums[m][present].tolist() for m in MEASURES})
+        out['totals'] = {m: float(sums[m].sum()) for m in MEASURES}
+        return out
@@ -0,0 +1,132 @@
+"""
+forecasting.py — dự báo hàng loạt cho nhiều chuỗi (theo sản phẩm / danh mục / khu vực...) cùng lúc.
+Dữ liệu được dựng thành ma trận dày chuỗi × kỳ (một lượt bincount), rồi mọi chuỗi được fit đồng thời:
+  - linear: bình phương tối thiểu dạng đóng (giống np.polyfit bậc 1 của analyzer.forecast_from_monthly)
+  - seasonal_naive: lặp lại giá trị cùng kỳ của mùa trước
+  - holt_winters: làm trơn hàm mũ Holt-Winters cộng tính (vòng lặp theo thời gian, vector theo chuỗi)
+Mỗi chuỗi bắt đầu từ kỳ đầu tiên có dữ liệu (sản phẩm mở bán sau không bị kéo xuống bởi các kỳ 0 phía trước).
+Kết quả mỗi chuỗi có cùng cấu trúc labels/history/forecast/trend_slope như forecast_data.
+"""
+import numpy as np
+import pandas as pd
+
+METHODS = ('linear', 'seasonal_naive', 'holt_winters')
+SEASON_LENGTH = {'M': 12, 'W': 52, 'Q': 4, 'Y': 1}
+MIN_POINTS = 3
+
+def series_matrix(keys, periods, values):
+    """(nhãn chuỗi, PeriodIndex liên tục, ma trận chuỗi × kỳ) từ các mảng cùng độ dài.
+    periods là Series/Index Period (NaT bị bỏ); kỳ không có dữ liệu = 0."""
+    periods = pd.PeriodIndex(periods)
+    valid = ~periods.isna()
+    key_codes, labels = pd.factorize(np.asarray(keys, dtype=object)[valid])
+    if not len(labels): return [], pd.PeriodIndex([], freq=periods.freq), np.zeros((0, 0))
+    ords = periods[valid].asi8
+    start = ords.min()
+    n_periods = int(ords.max() - start + 1)
+    flat = key_codes.astype('int64') * n_periods + (ords - start)
+    matrix = np.bincount(flat, weights=np.asarray(values, dtype='float64')[valid], minlength=len(labels) * n_periods)
+    span = pd.period_range(pd.Period(ordinal=int(start), freq=periods.freq), periods=n_periods, freq=periods.freq)
+    return list(labels), span, matrix.reshape(len(labels), n_periods)
+
+def resample_matrix(matrix, periods, freq):
+    """Gộp các cột của ma trận chuỗi × kỳ sang kỳ thô hơn (vd tháng -> quý 'Q' / năm 'Y'). Trả về (PeriodIndex, ma trận)."""
+    if not len(periods): return pd.PeriodIndex([], freq=freq), matrix
+    coarse = periods.asfreq(freq)
+    starts = np.flatnonzero(np.r_[True, coarse[1:] != coarse[:-1]])
+    return coarse[starts], np.add.reduceat(np.asarray(matrix, dtype='float64'), starts, axis=1)
+
+def _align(matrix):
+    """Dồn mỗi chuỗi về trái từ kỳ đầu tiên khác 0: (ma trận dồn, kỳ bắt đầu, độ dài, mask hợp lệ)."""
+    n_series, n_periods = matrix.shape
+    active = matrix != 0
+    start = np.where(active.any(axis=1), active.argmax(axis=1), n_periods)
+    length = n_periods - start
+    j = np.arange(n_periods)
+    valid = j[None, :] < length[:, None]
+    src = np.minimum(start[:, None] + j[None, :], n_periods - 1)
+    aligned = np.where(valid, np.take_along_axis(matrix, src, axis=1), 0.0)
+    return aligned, start, length, valid
+
+def _linear(y, length, valid, horizon):
+    """Hồi quy tuyến tính từng chuỗi (dạng đóng, vector hóa). Trả về (dự báo S×h, hệ số góc)."""
+    x = np.arange(y.shape[1], dtype='float64')[None, :]
+    n = np.maximum(length, 1)[:, None]
+    xm = (x * valid).sum(axis=1, keepdims=True) / n
+    ym = (y * valid).sum(axis=1, keepdims=True) / n
+    dx = np.where(valid, x - xm, 0.0)
+    sxx = (dx * dx).sum(axis=1)
+    slope = np.divide((dx * (y - ym)).sum(axis=1), sxx, out=np.zeros(len(y)), where=sxx > 0)
+    intercept = ym[:, 0] - slope * xm[:, 0]
+    future_x = length[:, None] + np.arange(horizon)[None, :]
+    return slope[:, None] * future_x + intercept[:, None], slope
+
+def _seasonal_naive(y, length, valid, horizon, season):
+    """Giá trị cùng vị trí của mùa gần nhất; chuỗi ngắn hơn một mùa -> giá trị cuối."""
+    h = np.arange(horizon)[None, :]
+    has_season = (length >= season)[:, None]
+    idx = np.where(has_season, length[:, None] - season + (h % season), length[:, None] - 1)
+    forecast = np.take_along_axis(y, np.clip(idx, 0, y.shape[1] - 1), axis=1)
+    _, slope = _linear(y, length, valid, 1)
+    return forecast, slope
+
+def _holt_winters(y, length, valid, horizon, season, alpha, beta, gamma):
+    """Holt-Winters cộng tính. Chuỗi có ít hơn 2 mùa dữ liệu dùng Holt (không thành phần mùa)."""
+    n_series, n_periods = y.shape
+    seasonal = (length >= 2 * season) & (season > 1)
+    m = max(season, 1)
+    # Khởi tạo: level = trung bình mùa đầu, trend = chênh lệch trung bình hai mùa đầu / m, mùa = mùa đầu - level
+    first = y[:, :m].mean(axis=1) if n_periods >= m else y[:, :1].mean(axis=1)
+    second = y[:, m:2 * m].mean(axis=1) if n_periods >= 2 * m else first
+    level = np.where(seasonal, first, y[:, 0])
+    trend = np.where(seasonal, (second - first) / m, np.where(length > 1, y[:, min(1, n_periods - 1)] - y[:, 0], 0.0))
+    season_arr = np.zeros((n_series, m))
+    if n_periods >= m: season_arr[seasonal] = y[seasonal, :m] - first[seasonal, None]
+    for t in range(1, n_periods):
+        # Chuỗi có mùa bắt đầu cập nhật sau mùa đầu tiên (mùa đầu dùng để khởi tạo)
+        live = valid[:, t] & (~seasonal | (t >= m))
+        if not valid[:, t].any(): break
+        s_prev = season_arr[:, t % m]
+        obs = y[:, t]
+        new_level = np.where(seasonal, alpha * (obs - s_prev) + (1 - alpha) * (level + trend), alpha * obs + (1 - alpha) * (level + trend))
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        new_season = np.where(seasonal, gamma * (obs - new_level) + (1 - gamma) * s_prev, s_prev)
+        level, trend = np.where(live, new_level, level), np.where(live, new_trend, trend)
+        season_arr[:, t % m] = np.where(live, new_season, s_prev)
+    h = np.arange(1, horizon + 1)[None, :]
+    phase = (length[:, None] - 1 + h) % m
+    season_part = np.where(seasonal[:, None], np.take_along_axis(season_arr, phase, axis=1), 0.0)
+    return level[:, None] + h * trend[:, None] + season_part, trend
+
+def forecast_matrix(matrix, periods, method='linear', horizon=3, season_length=None, alpha=0.5, beta=0.3, gamma=0.3):
+    """Dự báo mọi hàng của ma trận chuỗi × kỳ. Trả về list (cùng thứ tự hàng) gồm dict
+    {labels, history, forecast, trend_slope} hoặc None nếu chuỗi có ít hơn MIN_POINTS kỳ."""
+    if method not in METHODS: raise ValueError(f"method phải thuộc {METHODS}")
+    if season_length is not None and int(season_length) < 2: raise ValueError("season_length phải >= 2")
+    matrix = np.asarray(matrix, dtype='float64')
+    if matrix.size == 0: return [None] * len(matrix)
+    freq = getattr(periods, 'freqstr', 'M') or 'M'
+    season = int(season_length or SEASON_LENGTH.get(freq[0], 12))
+    y, start, length, valid = _align(matrix)
+
+    if method == 'linear': future, slope = _linear(y, length, valid, horizon)
+    elif method == 'seasonal_naive': future, slope = _seasonal_naive(y, length, valid, horizon, season)
+    else: future, slope = _holt_winters(y, length, valid, horizon, season, alpha, beta, gamma)
+    future = np.maximum(future, 0)  # Không để số âm
+
+    labels = [str(p) for p in periods]
+    last = periods[-1]
+    future_labels = [str(last + i) for i in range(1, horizon + 1)]
+    out = []
+    for i, (s, n) in enumerate(zip(start.tolist(), length.tolist())):
+        if n < MIN_POINTS:
+            out.append(None)
+            continue
+        history = matrix[i, s:].tolist()
+        out.append({
+            'labels': labels[s:] + future_labels,
+            'history': history + [None] * horizon,
+            'forecast': [None] * (n - 1) + [history[-1]] + future[i].tolist(),
+            'trend_slope': float(slope[i]),
+        })
+    return out
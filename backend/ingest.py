@@ -0,0 +1,210 @@
+"""
+ingest.py — đọc file CSV/Excel theo từng khối (chunk) để phân tích file lớn với bộ nhớ ổn định.
+CSV: pd.read_csv(chunksize=...), mã hóa được dò một lần từ phần đầu file.
+Excel (.xlsx): openpyxl read-only, đọc từng dòng. .xls (định dạng cũ) không có reader dạng stream nên đọc cả file.
+sniff_rows đọc vài dòng đầu (chưa tách tiêu đề) để xác định bố cục trước; open_chunks(layout=...) khi đó đọc
+với đúng dòng tiêu đề (header=) và chỉ các cột cần dùng (usecols=, theo vị trí).
+"""
+import codecs
+import csv
+import io
+import itertools
+import hashlib
+import os
+import uuid
+import zipfile
+import pandas as pd
+import metrics
+
+CSV_CHUNK_ROWS = int(os.environ.get('DATANA_CSV_CHUNK_ROWS', 200_000))
+EXCEL_CHUNK_ROWS = int(os.environ.get('DATANA_EXCEL_CHUNK_ROWS', 50_000))
+ENCODING_SAMPLE_BYTES = 1 << 20
+FALLBACK_ENCODING = 'cp1258'
+DATA_EXTENSIONS = ('.csv', '.xlsx', '.xlsm', '.xls')
+# Giới hạn tổng dung lượng sau giải nén của một file zip (chống zip bomb)
+ARCHIVE_MAX_BYTES = int(os.environ.get('DATANA_ARCHIVE_MAX_MB', 1024)) * 1024 * 1024
+
+def save_upload(file_storage, path, block_bytes=1 << 20):
+    """Ghi file upload xuống đĩa theo từng block và tính sha256 trong cùng lượt đọc."""
+    h = hashlib.sha256()
+    with metrics.span('upload.save', nbytes=0) as s, open(path, 'wb') as out:
+        while True:
+            block = file_storage.stream.read(block_bytes)
+            if not block: break
+            h.update(block)
+            out.write(block)
+            s.bytes += len(block)
+    return h.hexdigest()
+
+def extract_zip(path, dest_dir, max_bytes=ARCHIVE_MAX_BYTES, block_bytes=1 << 20):
+    """Giải nén các file dữ liệu (DATA_EXTENSIONS) trong file zip vào dest_dir, bỏ qua thư mục và file khác.
+    Trả về list (tên trong zip, đường dẫn, sha256) theo thứ tự trong zip. Ném ValueError nếu zip hỏng
+    hoặc tổng dung lượng giải nén vượt max_bytes (đếm theo byte thực đọc ra, không tin kích thước khai báo)."""
+    out, total = [], 0
+    try:
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                ext = os.path.splitext(name)[1].lower()
+                if info.is_dir() or ext not in DATA_EXTENSIONS or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'): continue
+                # Tên file trên đĩa không lấy từ zip (tránh đường dẫn ../), chỉ giữ đuôi để chọn reader
+                target = os.path.join(dest_dir, f"{uuid.uuid4().hex}{ext}")
+                out.append((name, target, None))
+                h = hashlib.sha256()
+                with zf.open(info) as src, open(target, 'wb') as dst:
+                    while True:
+                        block = src.read(block_bytes)
+                        if not block: break
+                        total += len(block)
+                        if total > max_bytes: raise ValueError("File zip quá lớn sau khi giải nén")
+                        h.update(block)
+                        dst.write(block)
+                out[-1] = (name, target, h.hexdigest())
+    except Exception as e:
+        for _, target, _ in out:
+            if os.path.exists(target): os.remove(target)
+        # BadZipFile, file mã hóa (RuntimeError), kiểu nén không hỗ trợ (NotImplementedError)...
+        if isinstance(e, ValueError): raise
+        raise ValueError("File zip không hợp lệ") from e
+    return out
+
+def detect_encoding(path, sample_bytes=ENCODING_SAMPLE_BYTES):
+    """utf-8 nếu phần đầu file giải mã được (bỏ qua ký tự bị cắt ở cuối mẫu), ngược lại cp1258."""
+    with open(path, 'rb') as fh:
+        sample = fh.read(sample_bytes)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8-sig' if sample.startswith(codecs.BOM_UTF8) else 'utf-8'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+def _csv_errors(encoding):
+    # Phần đầu đã là utf-8 hợp lệ: byte lỗi ở sâu trong file được thay thế thay vì phải đọc lại từ đầu
+    return 'strict' if encoding == FALLBACK_ENCODING else 'replace'
+
+def iter_csv_chunks(path, chunk_rows=None, encoding=None, on_read=None, header=0, usecols=None, dtype=None):
+    encoding = encoding or detect_encoding(path)
+    size = os.path.getsize(path) or 1
+    with open(path, 'rb') as fh, pd.read_csv(fh, encoding=encoding, encoding_errors=_csv_errors(encoding), header=header,
+                                             usecols=usecols, dtype=dtype, chunksize=chunk_rows or CSV_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            if on_read: on_read(fh.tell() / size)
+            yield chunk
+
+def header_names(row):
+    """Tên cột giống pd.read_excel: ô trống -> 'Unnamed: i', tên trùng -> 'x.1', 'x.2'..."""
+    names, seen = [], {}
+    for i, val in enumerate(row):
+        name = f'Unnamed: {i}' if val is None else val
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _excel_rows(ws):
+    """Dòng đầu của sheet + các dòng không trống sau đó (giống thứ tự mà sniff_rows / header= đếm)."""
+    rows = ws.iter_rows(values_only=True)
+    first = next(rows, None)
+    if first is None: return
+    yield first
+    for row in rows:
+        if not all(v is None for v in row): yield row
+
+def _apply_dtype(df, dtype, positions):
+    """Đổi kiểu các cột theo vị trí trong file gốc (positions = vị trí gốc của từng cột trong df)."""
+    if not dtype: return df
+    cols = {df.columns[j]: dtype[i] for j, i in enumerate(positions) if i in dtype}
+    return df.astype(cols) if cols else df
+
+def iter_excel_chunks(path, chunk_rows=None, on_read=None, header=0, usecols=None, dtype=None):
+    from openpyxl import load_workbook
+    chunk_rows = chunk_rows or EXCEL_CHUNK_ROWS
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        total = ws.max_row or 0
+        rows = _excel_rows(ws)
+        for _ in range(header): next(rows, None)
+        head = next(rows, None)
+        if head is None: return
+        names = header_names(head)
+        width = len(names)
+        pick = None if usecols is None else [i for i in usecols if i < width]
+        positions = range(width) if pick is None else pick
+        if pick is not None: names = [names[i] for i in pick]
+        buf, seen = [], 1 + header
+        for row in rows:
+            seen += 1
+            row = row[:width] + (None,) * (width - len(row))
+            buf.append(row if pick is None else tuple(row[i] for i in pick))
+            if len(buf) >= chunk_rows:
+                if on_read and total: on_read(seen / total)
+                yield _apply_dtype(pd.DataFrame(buf, columns=names), dtype, positions)
+                buf = []
+        if on_read: on_read(1.0)
+        if buf: yield _apply_dtype(pd.DataFrame(buf, columns=names), dtype, positions)
+    finally:
+        wb.close()
+
+def _iter_loaded_frame(df, chunk_rows, on_read=None):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        if on_read: on_read(min(start + chunk_rows, len(df)) / max(len(df), 1))
+        yield df.iloc[start:start + chunk_rows]
+
+def iter_file_chunks(path, chunk_rows=None, on_read=None, header=0, usecols=None, dtype=None):
+    """Các khối DataFrame của file theo đuôi file. on_read(fraction) được gọi khi đọc xong mỗi khối.
+    header: vị trí dòng tiêu đề (các dòng trước bị bỏ); usecols: vị trí các cột cần đọc (None = tất cả);
+    dtype: {vị trí cột gốc: kiểu} (vd 'category'), CSV áp dụng ngay khi parse."""
+    if path.lower().endswith('.csv'): return iter_csv_chunks(path, chunk_rows, on_read=on_read, header=header, usecols=usecols, dtype=dtype)
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        return iter_excel_chunks(path, chunk_rows, on_read=on_read, header=header, usecols=usecols, dtype=dtype)
+    df = pd.read_excel(path, header=header, usecols=usecols)
+    df = _apply_dtype(df, dtype, usecols if usecols is not None else range(df.shape[1]))
+    return _iter_loaded_frame(df, chunk_rows or EXCEL_CHUNK_ROWS, on_read)
+
+def sniff_rows(path, n_rows):
+    """n_rows dòng đầu của file dạng list các list ô (chưa tách tiêu đề; ô trống = None), bỏ dòng trống
+    như khi đọc đầy đủ, để vị trí dòng ở đây dùng được làm header= của iter_file_chunks."""
+    if path.lower().endswith('.csv'):
+        encoding = detect_encoding(path)
+        with open(path, 'rb') as fh:
+            text = io.TextIOWrapper(fh, encoding=encoding, errors=_csv_errors(encoding), newline='')
+            rows = itertools.islice((r for r in csv.reader(text) if r), n_rows)
+            return [[v if v != '' else None for v in r] for r in rows]
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try: return [list(r) for r in itertools.islice(_excel_rows(wb.active), n_rows)]
+        finally: wb.close()
+    df = pd.read_excel(path, header=None, nrows=n_rows)
+    return [[None if pd.isna(v) else v for v in r] for r in df.itertuples(index=False)]
+
+class ChunkStream:
+    """Các khối DataFrame của một file + tiến độ đọc `fraction` (0..1, ước lượng theo vị trí trong file).
+    Khối đầu tiên được đọc ngay khi khởi tạo: lỗi định dạng/mã hóa được báo tại đây, trước khi phân tích.
+    layout (xem analyzer.sniff_layout): {'header': vị trí dòng tiêu đề, 'usecols': vị trí cột cần đọc,
+    'dtype': kiểu đọc theo vị trí cột, ...}."""
+    def __init__(self, path, chunk_rows=None, layout=None):
+        self.path = path
+        self.fraction = 0.0
+        self.layout = layout
+        header, usecols, dtype = (layout['header'], layout['usecols'], layout.get('dtype')) if layout else (0, None, None)
+        self._chunks = iter_file_chunks(path, chunk_rows, on_read=self._on_read, header=header, usecols=usecols, dtype=dtype)
+        # Thời gian đọc mỗi khối (pd.read_csv / openpyxl) được ghi vào metrics giai đoạn ingest.read
+        with metrics.span('ingest.read') as s:
+            self._first = next(self._chunks, None)
+            if self._first is None: self._first = pd.DataFrame()
+            s.rows = len(self._first)
+
+    def _on_read(self, fraction):
+        self.fraction = min(max(fraction, 0.0), 1.0)
+
+    def __iter__(self):
+        yield self._first
+        yield from metrics.timed_iter(self._chunks, 'ingest.read')
+
+def open_chunks(path, chunk_rows=None, layout=None):
+    return ChunkStream(path, chunk_rows, layout)
@@ -1,4 +1,4 @@
-from app import app, db
+from app import app, db, ensure_schema, migrate_analyses
 import os
 
 # Đảm bảo tạo thư mục instance nếu chưa có
@@ -6,6 +6,8 @@ if not os.path.exists('instance'):
     os.makedirs('instance')
 
 with app.app_context():
-    db.create_all()
+    ensure_schema()
+    moved, kept = migrate_analyses()
+    if moved or kept: print(f"✅ Đã chuyển {moved} phân tích sang dạng cột ({kept} bản ghi giữ JSON)")
     print("✅ Đã tạo file database.db thành công!")
     print(f"File nằm tại: {os.path.join(os.getcwd(), 'instance', 'database.db')}")
\ No newline at end of file
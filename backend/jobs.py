@@ -0,0 +1,186 @@
+"""
+jobs.py — hàng đợi phân tích chạy nền (không cần broker ngoài).
+Upload trả về job_id ngay; analyzer chạy trong ProcessPoolExecutor (mặc định = số core).
+Pool này cũng phân tích song song các file của một lô (analyze_files).
+Bản ghi job (trạng thái, tiến độ, lỗi, session_id) + cờ hủy nằm trong SQLite (session_store, DATANA_JOBS_DB) dùng chung
+giữa các worker của serve.py và process phân tích: worker nào cũng trả lời / hủy được job của worker khác.
+Kết quả được lưu bằng callback on_done chạy trong process Flask đã nhận upload (Analysis / TEMP_SESSIONS như /analyze).
+Worker đó dừng (bị thu hồi / chết) trước khi job xong thì job được đánh dấu lỗi và file upload bị xóa: khi có lượt
+đọc trạng thái, hoặc khi recover() quét lại (serve.py gọi lúc khởi động và mỗi khi một worker dừng).
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+JOB_WORKERS = int(os.environ.get('DATANA_JOB_WORKERS', os.cpu_count() or 1))
+JOB_TTL_SECONDS = int(os.environ.get('DATANA_JOB_TTL', 3600))
+JOBS_DB_PATH = os.environ.get('DATANA_JOBS_DB', 'cache/jobs.db')
+STAGES = ('queued', 'ingest', 'preprocess', 'aggregate', 'forecast', 'done')
+FINAL = ('done', 'error', 'cancelled')
+
+_futures = {}  # job_id -> Future, chỉ có trong process đã nhận upload
+_lock = threading.Lock()
+_executor = None
+_store = None
+
+def store():
+    global _store
+    if _store is None:
+        from session_store import SessionStore
+        os.makedirs(os.path.dirname(JOBS_DB_PATH) or '.', exist_ok=True)
+        _store = SessionStore(JOBS_DB_PATH, 'jobs', ttl=JOB_TTL_SECONDS, max_bytes=16 * 1024 * 1024)
+    return _store
+
+def _cancel_key(job_id):
+    return f'cancel:{job_id}'
+
+def _alive(pid):
+    """Process pid còn chạy không. Windows: os.kill sẽ dừng process nên không kiểm tra (job treo chờ hết TTL)."""
+    if pid is None or pid == os.getpid() or os.name == 'nt': return True
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: pass
+    return True
+
+def _progress(stage, fraction):
+    """Hàm cập nhật tiến độ cho store().update: job đã kết thúc thì giữ nguyên."""
+    def apply(job):
+        if not isinstance(job, dict) or job['status'] in FINAL: return None
+        job.update(status='running', stage=stage)
+        if fraction is not None: job['progress'] = fraction
+        return job
+    return apply
+
+# --- CHẠY TRONG PROCESS CON ---
+def _init_worker(parent):
+    # Process Flask sở hữu pool chết đột ngột (SIGKILL) thì pool không được đóng: process phân tích tự thoát
+    def watch():
+        while os.getppid() == parent: time.sleep(1)
+        os._exit(1)
+    threading.Thread(target=watch, daemon=True).start()
+
+def run_analysis(job_id, path):
+    """Đọc + phân tích file theo khối, báo tiến độ từng giai đoạn; dừng nếu job bị hủy."""
+    import analyzer
+    import ingest
+
+    def report(stage, fraction=None):
+        if _cancel_key(job_id) in store(): raise analyzer.AnalysisCancelled()
+        store().update(job_id, _progress(stage, fraction))
+
+    report('ingest', 0.0)
+    try: chunks = ingest.open_chunks(path, layout=analyzer.sniff_layout(path))
+    except Exception: raise ValueError("Lỗi đọc file")
+    data_tuple = analyzer.analyze_chunks(chunks, on_progress=report)
+    if not data_tuple[0]: raise ValueError("Lỗi phân tích file")  # analyzer trả tuple rỗng khi lỗi
+    return data_tuple
+
+def run_source(path):
+    """Phân tích một file của lô nhiều file (/analyze/batch). Trả về SalesAggregate để gộp ở process Flask."""
+    import analyzer
+    import ingest
+
+    try: chunks = ingest.open_chunks(path, layout=analyzer.sniff_layout(path))
+    except Exception: raise ValueError("Lỗi đọc file")
+    aggregate = analyzer.analyze_chunks(chunks)[12]
+    if aggregate is None: raise ValueError("Lỗi phân tích file")
+    return aggregate
+
+# --- PROCESS FLASK ---
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(os.getpid(),))
+    return _executor
+
+def shutdown():
+    """Bỏ các job chưa chạy, chờ job đang chạy rồi đóng pool (worker của serve.py thoát bằng os._exit, không qua atexit)."""
+    with _lock: executor = _executor
+    if executor is not None: executor.shutdown(wait=True, cancel_futures=True)
+
+def submit(path, on_done=None, **meta):
+    """Đưa file vào hàng đợi. on_done(job, data_tuple) chạy khi xong, giá trị trả về được lưu vào job['session_id']."""
+    job_id = uuid.uuid4().hex
+    store()[job_id] = dict(meta, id=job_id, path=path, status='queued', stage='queued', progress=0.0,
+                           error=None, session_id=None, created=time.time(), finished=None, owner=os.getpid())
+    future = _pool().submit(run_analysis, job_id, path)
+    with _lock: _futures[job_id] = future
+    future.add_done_callback(lambda f: _finish(job_id, f, path, on_done))
+    return job_id
+
+def analyze_files(paths):
+    """Phân tích song song nhiều file trong process pool (mỗi file một tác vụ) và chờ tất cả xong.
+    Trả về list cùng thứ tự paths: SalesAggregate hoặc Exception của file lỗi."""
+    futures = [_pool().submit(run_source, p) for p in paths]
+    results = []
+    for f in futures:
+        try: results.append(f.result())
+        except Exception as e: results.append(e)
+    return results
+
+def _finish(job_id, future, path, on_done):
+    import analyzer
+    with _lock: _futures.pop(job_id, None)
+    fields = {}
+    try:
+        if future.cancelled():
+            fields['status'] = 'cancelled'
+        else:
+            data_tuple = future.result()
+            job = store().get(job_id) or {'id': job_id}
+            fields.update(session_id=on_done(job, data_tuple) if on_done else None, status='done', stage='done', progress=1.0)
+    except analyzer.AnalysisCancelled:
+        fields['status'] = 'cancelled'
+    except Exception as e:
+        fields.update(status='error', error=str(e))
+    finally:
+        fields['finished'] = time.time()
+        store().patch(job_id, **fields)
+        del store()[_cancel_key(job_id)]
+        if os.path.exists(path): os.remove(path)
+
+def _abandon(job_id):
+    """Job mà worker sở hữu đã dừng trước khi _finish chạy: đánh dấu lỗi, xóa file upload."""
+    def apply(job):
+        if not isinstance(job, dict) or job['status'] in FINAL: return None
+        return dict(job, status='error', error="Worker xử lý job đã dừng, hãy tải file lên lại", finished=time.time())
+    job = store().update(job_id, apply)
+    if job is None: return store().get(job_id)
+    del store()[_cancel_key(job_id)]
+    if os.path.exists(job['path']): os.remove(job['path'])
+    return job
+
+def _orphaned(job):
+    return isinstance(job, dict) and job['status'] not in FINAL and not _alive(job.get('owner'))
+
+def recover():
+    """Dọn mọi job có worker sở hữu đã dừng. Trả về số job được dọn."""
+    orphans = [job_id for job_id, job in store().items() if _orphaned(job)]
+    for job_id in orphans: _abandon(job_id)
+    return len(orphans)
+
+def get(job_id):
+    job = store().get(job_id) if job_id else None
+    return _abandon(job_id) if _orphaned(job) else job
+
+def status(job_id):
+    """Trạng thái job cho API: status, stage, progress, error, session_id."""
+    job = get(job_id)
+    if job is None: return None
+    if job['status'] not in FINAL and _cancel_key(job_id) in store(): job['status'] = 'cancelling'
+    return {k: job[k] for k in ('id', 'status', 'stage', 'progress', 'error', 'session_id', 'filename') if k in job}
+
+def cancel(job_id):
+    """Hủy job: chưa chạy thì bỏ khỏi hàng đợi (nếu hàng đợi ở process này), còn lại đặt cờ để process phân tích
+    dừng ở khối tiếp theo."""
+    job = get(job_id)
+    if job is None or job['status'] in FINAL: return False
+    with _lock: future = _futures.get(job_id)
+    if future is not None and future.cancel(): return True
+    store()[_cancel_key(job_id)] = True
+    return True
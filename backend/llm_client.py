@@ -0,0 +1,333 @@
+"""
+llm_client.py — client LLM dùng chung cho chat / báo cáo (Groq hoặc server tương thích OpenAI).
+- Một client Groq (pool kết nối httpx, tạo ở lời gọi đầu tiên) cho cả app; số lời gọi đồng thời bị giới hạn bằng semaphore,
+  request nào chờ slot quá DATANA_LLM_QUEUE_TIMEOUT giây thì báo quá tải thay vì xếp hàng mãi.
+- Lỗi tạm thời (mất kết nối, timeout, 429, 5xx) được thử lại với backoff lũy thừa + jitter ngẫu nhiên
+  (tôn trọng Retry-After của 429); lỗi khác (sai key, request sai) báo ngay.
+- stream() trả từng đoạn chữ ngay khi model sinh ra. Chỉ thử lại khi chưa gửi token nào, sau đó lỗi được báo thẳng.
+  Đóng generator (trình duyệt ngắt kết nối) sẽ đóng luôn stream tới LLM và trả slot.
+- Cache theo prompt (cache=True): khóa = hash của system + user message đã chuẩn hóa + model + tham số;
+  lưu trong SQLite cục bộ (TTL + LRU, dùng chung giữa các worker). Các request giống hệt nhau đang chạy cùng lúc
+  được gộp: chỉ request đầu gọi LLM, các request sau đọc theo từng đoạn chữ của nó (request đầu ngắt kết nối
+  thì lời gọi vẫn chạy tiếp cho các request còn lại).
+- DATANA_LLM_BASE_URL trỏ tới server khác (vd benchmarks/stub_llm.py khi thử nghiệm không cần key thật).
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+import metrics
+
+LLM_BASE_URL = os.environ.get('DATANA_LLM_BASE_URL') or None
+LLM_CONCURRENCY = int(os.environ.get('DATANA_LLM_CONCURRENCY', 8))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('DATANA_LLM_QUEUE_TIMEOUT', 10))
+LLM_CONNECT_TIMEOUT = float(os.environ.get('DATANA_LLM_CONNECT_TIMEOUT', 5))
+LLM_READ_TIMEOUT = float(os.environ.get('DATANA_LLM_READ_TIMEOUT', 30))   # tối đa giữa hai gói dữ liệu
+LLM_DEADLINE = float(os.environ.get('DATANA_LLM_DEADLINE', 120))          # tổng thời gian một request
+LLM_RETRIES = int(os.environ.get('DATANA_LLM_RETRIES', 3))
+LLM_BACKOFF_BASE = float(os.environ.get('DATANA_LLM_BACKOFF_BASE', 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get('DATANA_LLM_BACKOFF_MAX', 8))
+LLM_CACHE_PATH = os.environ.get('DATANA_LLM_CACHE', 'cache/llm.db')
+LLM_CACHE_TTL = int(os.environ.get('DATANA_LLM_CACHE_TTL', 3600))
+LLM_CACHE_MAX_BYTES = int(os.environ.get('DATANA_LLM_CACHE_MB', 64)) * 1024 * 1024
+KEEPALIVE_SECONDS = 15
+
+class LLMError(Exception):
+    """Lời gọi LLM thất bại (hết lượt thử, lỗi không thử lại được hoặc quá hạn)."""
+
+class LLMBusy(LLMError):
+    """Không lấy được slot trong LLM_QUEUE_TIMEOUT giây."""
+
+class _LeaderGone(LLMError):
+    """Request dẫn đầu của nhóm gộp bị hủy (client của nó ngắt kết nối) trước khi xong."""
+
+def backoff_delay(attempt, base=LLM_BACKOFF_BASE, cap=LLM_BACKOFF_MAX):
+    """Full jitter: ngẫu nhiên trong [0, min(cap, base·2^attempt)] để các request lỗi cùng lúc không thử lại cùng lúc."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+_SPACES = re.compile(r'\s+')
+
+def normalize(text):
+    """Chuẩn hóa để các prompt chỉ khác khoảng trắng / dạng Unicode (NFC vs NFD của tiếng Việt) cho cùng khóa."""
+    return _SPACES.sub(' ', unicodedata.normalize('NFC', text or '')).strip()
+
+def prompt_key(sys_msg, usr_msg, model, params):
+    """Khóa cache: câu hỏi người dùng không phân biệt hoa/thường; system message giữ nguyên chữ (chứa số liệu)."""
+    payload = [normalize(sys_msg), normalize(usr_msg).casefold(), model, sorted(params.items())]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def estimate_tokens(*texts):
+    """Ước lượng số token (~4 ký tự / token) khi API không trả usage."""
+    return sum(len(t or '') for t in texts) // 4
+
+class PromptCache:
+    """Câu trả lời LLM theo prompt_key: {'text', 'tokens'}. Đếm hit/miss/gộp và số token tiết kiệm được."""
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path, self.ttl, self.max_bytes = path, ttl, max_bytes
+        self._store = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'saved_tokens': 0}
+
+    def store(self):
+        if self._store is None:
+            from session_store import SessionStore
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._store = SessionStore(self.path, 'prompts', ttl=self.ttl, max_bytes=self.max_bytes)
+        return self._store
+
+    def get(self, key):
+        return self.store().get(key)
+
+    def put(self, key, text, tokens):
+        self.store()[key] = {'text': text, 'tokens': tokens}
+
+    def count(self, **delta):
+        with self._lock:
+            for k, v in delta.items(): self._stats[k] += v
+
+    def stats(self):
+        with self._lock: s = dict(self._stats)
+        served = s['hits'] + s['coalesced']
+        s['hit_rate'] = round(served / (served + s['misses']), 4) if served + s['misses'] else None
+        s.update(self.store().stats())
+        return s
+
+class _Flight:
+    """Một lời gọi LLM đang chạy mà các request giống hệt có thể đọc theo."""
+    def __init__(self):
+        self.parts, self.done, self.error, self.tokens, self.followers = [], False, None, 0, 0
+        self.cond = threading.Condition(threading.RLock())
+
+    def publish(self, text):
+        with self.cond:
+            self.parts.append(text)
+            self.cond.notify_all()
+
+    def finish(self, tokens=0, error=None):
+        with self.cond:
+            self.done, self.tokens, self.error = True, tokens, error
+            self.cond.notify_all()
+
+    def follow(self):
+        """Generator các đoạn chữ của request dẫn đầu ('' = keep-alive khi chờ lâu)."""
+        i = 0
+        with self.cond: self.followers += 1
+        try:
+            while True:
+                with self.cond:
+                    if i == len(self.parts) and not self.done: self.cond.wait(KEEPALIVE_SECONDS)
+                    new, done, error = self.parts[i:], self.done, self.error
+                i += len(new)
+                if new: yield ''.join(new)
+                elif not done: yield ''
+                if done:
+                    if error is not None: raise error
+                    return
+        finally:
+            with self.cond: self.followers -= 1
+
+class LLMClient:
+    def __init__(self, api_key, model, base_url=LLM_BASE_URL, concurrency=LLM_CONCURRENCY, cache=None):
+        self.model = model
+        self.client = None
+        self.cache = cache
+        self._flights = {}
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'errors': 0, 'retries': 0, 'busy': 0, 'cancelled': 0,
+                       'ttft_total': 0.0, 'ttft_count': 0, 'in_flight': 0}
+        # Server riêng (stub / self-host) không cần key dạng gsk_
+        self._config = (api_key, base_url, concurrency) if api_key and (base_url or 'gsk_' in api_key) else None
+
+    @property
+    def available(self):
+        return self._config is not None
+
+    def connect(self):
+        """Tạo client Groq (pool httpx) ở lời gọi đầu tiên: import groq + httpx tốn ~200ms nên không làm lúc app khởi động
+        (serve.py gọi sẵn trong process cha trước khi fork)."""
+        if self.client is not None: return self.client
+        with self._lock:
+            if self.client is None:
+                if self._config is None: raise LLMError("Chưa kết nối AI")
+                api_key, base_url, concurrency = self._config
+                try:
+                    import httpx
+                    from groq import Groq
+                    self._errors = _error_types()
+                    self._timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+                    http = httpx.Client(limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+                                        timeout=self._timeout)
+                    self.client = Groq(api_key=api_key, base_url=base_url, max_retries=0, http_client=http)
+                except Exception as e:
+                    self._config = None
+                    raise LLMError(f"Không tạo được client LLM: {e}") from e
+        return self.client
+
+    def _count(self, **delta):
+        with self._lock:
+            for k, v in delta.items(): self._stats[k] += v
+
+    def stats(self):
+        with self._lock: s = dict(self._stats)
+        s['avg_ttft_ms'] = round(s.pop('ttft_total') / s['ttft_count'] * 1000, 1) if s['ttft_count'] else None
+        s.pop('ttft_count')
+        if self.cache is not None: s['cache'] = self.cache.stats()
+        return s
+
+    def _open(self, messages, deadline, **params):
+        """Mở stream, thử lại lỗi tạm thời. Yield '' trước mỗi lần chờ backoff (để phía gọi gửi keep-alive
+        và phát hiện client đã ngắt), cuối cùng yield stream đã mở."""
+        client = self.connect()
+        retryable, rate_limited = self._errors
+        model = params.pop('model', self.model)
+        for attempt in range(LLM_RETRIES + 1):
+            try:
+                yield client.chat.completions.create(model=model, messages=messages,
+                                                          stream=True, timeout=self._timeout, **params)
+                return
+            except retryable as e:
+                delay = backoff_delay(attempt)
+                if isinstance(e, rate_limited):
+                    try: delay = max(delay, float(e.response.headers.get('retry-after', 0)))
+                    except (TypeError, ValueError): pass
+                if attempt == LLM_RETRIES or time.monotonic() + delay > deadline:
+                    raise LLMError(f"LLM không phản hồi sau {attempt + 1} lần thử: {e}") from e
+                self._count(retries=1)
+                metrics.count('datana_llm_retries_total', error=type(e).__name__)
+                yield ''
+                time.sleep(delay)
+            except Exception as e:
+                raise LLMError(str(e)) from e
+
+    def stream(self, sys_msg, usr_msg, cache=False, **params):
+        """Generator các đoạn chữ của câu trả lời ('' = keep-alive khi đang chờ).
+        cache=True: trả từ cache nếu có, gộp với request giống hệt đang chạy, lưu lại câu trả lời hoàn chỉnh.
+        params: temperature, max_tokens, model... truyền thẳng cho API."""
+        if not self.available: raise LLMError("Chưa kết nối AI")
+        if not cache or self.cache is None:
+            yield from self._generate(sys_msg, usr_msg, {}, **params)
+            return
+        key = prompt_key(sys_msg, usr_msg, params.get('model', self.model), params)
+        hit = self.cache.get(key)
+        if hit is not None:
+            self.cache.count(hits=1, saved_tokens=hit['tokens'])
+            yield hit['text']
+            return
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader: flight = self._flights[key] = _Flight()
+        if not leader:
+            sent = False
+            try:
+                for text in flight.follow():
+                    sent = sent or bool(text)
+                    yield text
+                self.cache.count(coalesced=1, saved_tokens=flight.tokens)
+                return
+            except _LeaderGone:
+                if sent: raise LLMError("Câu trả lời bị gián đoạn")
+            # Request dẫn đầu bị hủy trước khi có chữ nào -> tự gọi LLM
+            yield from self._generate(sys_msg, usr_msg, {}, **params)
+            return
+        self.cache.count(misses=1)
+        meta = {}
+        upstream = self._generate(sys_msg, usr_msg, meta, **params)
+        handed_off = False
+        try:
+            for text in upstream:
+                if text: flight.publish(text)
+                yield text
+            self._settle(key, flight, sys_msg, usr_msg, meta)
+        except GeneratorExit:
+            # Client dẫn đầu ngắt kết nối: còn request khác đang đọc theo thì đọc tiếp ở thread nền, không thì hủy hẳn
+            with flight.cond:
+                handed_off = flight.followers > 0
+                if not handed_off: flight.finish(error=_LeaderGone("Request dẫn đầu bị hủy"))
+            if handed_off:
+                threading.Thread(target=self._drain, args=(upstream, key, flight, sys_msg, usr_msg, meta), daemon=True).start()
+            else: upstream.close()
+            raise
+        except Exception as e:
+            flight.finish(error=e if isinstance(e, LLMError) else LLMError(str(e)))
+            raise
+        finally:
+            if not handed_off:
+                with self._lock: self._flights.pop(key, None)
+
+    def _settle(self, key, flight, sys_msg, usr_msg, meta):
+        """Lưu câu trả lời hoàn chỉnh vào cache rồi báo cho các request đang đọc theo."""
+        text = ''.join(flight.parts)
+        tokens = meta.get('tokens') or estimate_tokens(sys_msg, usr_msg, text)
+        try: self.cache.put(key, text, tokens)
+        except Exception: pass
+        flight.finish(tokens)
+
+    def _drain(self, upstream, key, flight, sys_msg, usr_msg, meta):
+        try:
+            for text in upstream:
+                if text: flight.publish(text)
+            self._settle(key, flight, sys_msg, usr_msg, meta)
+        except Exception as e:
+            flight.finish(error=e if isinstance(e, LLMError) else LLMError(str(e)))
+        finally:
+            with self._lock: self._flights.pop(key, None)
+
+    def _generate(self, sys_msg, usr_msg, meta, **params):
+        """Gọi LLM thật (giữ một slot), ghi meta['tokens'] = tổng token nếu API trả usage."""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+            self._count(busy=1)
+            raise LLMBusy("AI đang quá tải")
+        self._count(requests=1, in_flight=1)
+        deadline = start + LLM_DEADLINE
+        messages = [{"role": "system", "content": sys_msg}, {"role": "user", "content": usr_msg}]
+        upstream, finished, first = None, False, True
+        try:
+            for upstream in self._open(messages, deadline, **params):
+                if upstream == '': yield ''
+            for chunk in upstream:
+                if time.monotonic() > deadline: raise LLMError("LLM trả lời quá thời hạn")
+                usage = chunk.usage or getattr(chunk.x_groq, 'usage', None)
+                if usage is not None:
+                    meta['tokens'] = usage.total_tokens
+                    metrics.count('datana_llm_tokens_total', usage.prompt_tokens or 0, kind='prompt')
+                    metrics.count('datana_llm_tokens_total', usage.completion_tokens or 0, kind='completion')
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text: continue
+                if first:
+                    self._count(ttft_total=time.monotonic() - start, ttft_count=1)
+                    metrics.stage('llm.ttft', time.monotonic() - start)
+                    first = False
+                yield text
+            finished = True
+            metrics.stage('llm.generate', time.monotonic() - start)
+        except LLMError:
+            self._count(errors=1)
+            raise
+        except GeneratorExit:
+            self._count(cancelled=1)
+            raise
+        except Exception as e:
+            self._count(errors=1)
+            raise LLMError(str(e)) from e
+        finally:
+            if upstream and not finished:
+                try: upstream.close()
+                except Exception: pass
+            self._count(in_flight=-1)
+            self._slots.release()
+
+    def complete(self, sys_msg, usr_msg, cache=False, **params):
+        """Câu trả lời đầy đủ (dùng cùng đường stream nên cũng có giới hạn đồng thời, thử lại, cache)."""
+        return ''.join(self.stream(sys_msg, usr_msg, cache=cache, **params))
+
+def _error_types():
+    import groq
+    retryable = (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError, groq.ConflictError)
+    return retryable, groq.RateLimitError
@@ -0,0 +1,183 @@
+"""
+metrics.py — đo thời gian theo giai đoạn và xuất dạng Prometheus text (GET /metrics).
+- with span('analyze.read', rows=n) as s: ... — ghi histogram thời gian (giây) theo tên giai đoạn; s.rows / s.bytes
+  (đặt trước hoặc trong span) -> histogram số dòng / số byte đã xử lý của giai đoạn đó.
+- timed_iter(chunks, stage): đo thời gian lấy từng phần tử của iterator (vd pd.read_csv theo khối).
+- count(name, value, **labels): bộ đếm (token LLM, số lần thử lại...); register(prefix, fn): thêm các số liệu
+  sẵn có (stats() của cache, llm...) dạng gauge lúc xuất.
+- Số liệu giữ trong bộ nhớ, theo từng process (mỗi worker một bộ); một span tốn vài µs.
+- Profile: cProfile + các span của một request (app.py bật khi DATANA_PROFILE=1 và request có ?profile=1).
+"""
+import bisect
+import contextvars
+import cProfile
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_ENABLED = os.environ.get('DATANA_PROFILE', '0') == '1'
+PROFILE_TOP = int(os.environ.get('DATANA_PROFILE_TOP', 25))
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROWS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTES = tuple(1 << s for s in range(10, 32, 3))  # 1KB .. 1GB
+
+# tên -> (kiểu, mô tả, bucket)
+FAMILIES = {
+    'datana_stage_seconds': ('histogram', 'Thời gian theo giai đoạn xử lý', SECONDS),
+    'datana_stage_rows': ('histogram', 'Số dòng xử lý theo giai đoạn', ROWS),
+    'datana_stage_bytes': ('histogram', 'Số byte xử lý theo giai đoạn', BYTES),
+    'datana_request_seconds': ('histogram', 'Thời gian xử lý request theo endpoint (tới khi trả header)', SECONDS),
+    'datana_llm_calls_total': ('counter', 'Lời gọi AI theo kết quả', None),
+    'datana_llm_tokens_total': ('counter', 'Token LLM theo loại (prompt / completion)', None),
+    'datana_llm_retries_total': ('counter', 'Số lần thử lại lời gọi LLM theo loại lỗi', None),
+}
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds, self.counts, self.sum, self.count = bounds, [0] * (len(bounds) + 1), 0.0, 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+_lock = threading.Lock()
+_values = {}      # (tên, labels) -> Histogram | số
+_collectors = {}  # prefix -> fn() -> dict
+_trace = contextvars.ContextVar('datana_trace', default=None)
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        h = _values.get(key)
+        if h is None: h = _values[key] = Histogram(FAMILIES[name][2])
+        h.observe(value)
+
+def count(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock: _values[key] = _values.get(key, 0) + value
+
+def reset():
+    """Xóa mọi số liệu đã ghi (serve.py gọi sau khi làm nóng, trước khi fork worker)."""
+    with _lock: _values.clear()
+
+def stage(name, seconds, rows=None, nbytes=None):
+    """Ghi một lần chạy của giai đoạn `name` (và vào trace của request đang profile, nếu có)."""
+    observe('datana_stage_seconds', seconds, stage=name)
+    if rows is not None: observe('datana_stage_rows', rows, stage=name)
+    if nbytes is not None: observe('datana_stage_bytes', nbytes, stage=name)
+    trace = _trace.get()
+    if trace is not None: trace.append((name, seconds, rows, nbytes))
+
+class Span:
+    __slots__ = ('rows', 'bytes')
+
+    def __init__(self, rows, nbytes):
+        self.rows, self.bytes = rows, nbytes
+
+@contextmanager
+def span(name, rows=None, nbytes=None):
+    s = Span(rows, nbytes)
+    t0 = time.perf_counter()
+    try: yield s
+    finally: stage(name, time.perf_counter() - t0, s.rows, s.bytes)
+
+def timed_iter(items, name):
+    """Yield các phần tử của items, mỗi lần lấy một phần tử là một lần chạy của giai đoạn `name` (rows = len)."""
+    it = iter(items)
+    while True:
+        t0 = time.perf_counter()
+        try: item = next(it)
+        except StopIteration: return
+        stage(name, time.perf_counter() - t0, len(item) if hasattr(item, '__len__') else None)
+        yield item
+
+def register(prefix, fn):
+    """fn() -> dict (lồng nhau được); các giá trị số xuất thành gauge datana_<prefix>_<khóa>."""
+    _collectors[prefix] = fn
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+def _num(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _flatten(prefix, data, out):
+    for k, v in data.items():
+        name = f"{prefix}_{k}"
+        if isinstance(v, dict): _flatten(name, v, out)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool): out.append((name, v))
+        elif isinstance(v, bool): out.append((name, int(v)))
+
+def render():
+    """Toàn bộ số liệu dạng Prometheus text exposition (version 0.0.4)."""
+    with _lock:
+        snapshot = {}
+        for (name, labels), v in _values.items():
+            if isinstance(v, Histogram): v = (list(v.counts), v.sum, v.count, v.bounds)
+            snapshot.setdefault(name, []).append((labels, v))
+    lines = []
+    for name in sorted(snapshot):
+        kind, help_text, _ = FAMILIES.get(name, ('counter', name, None))
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, v in sorted(snapshot[name]):
+            if kind != 'histogram':
+                lines.append(f"{name}{_fmt(labels)} {_num(v)}")
+                continue
+            counts, total, n, bounds = v
+            cumulative = 0
+            for bound, c in zip(bounds, counts):
+                cumulative += c
+                lines.append(f"{name}_bucket{_fmt(labels, [('le', _num(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_fmt(labels, [('le', '+Inf')])} {n}")
+            lines += [f"{name}_sum{_fmt(labels)} {_num(total)}", f"{name}_count{_fmt(labels)} {n}"]
+    for prefix, fn in sorted(_collectors.items()):
+        gauges = []
+        try: _flatten(f"datana_{prefix}", fn(), gauges)
+        except Exception: continue
+        for name, v in gauges:
+            lines += [f"# TYPE {name} gauge", f"{name} {_num(v)}"]
+    return '\n'.join(lines) + '\n'
+
+class Profile:
+    """cProfile + các span trong một request (chỉ thread đang xử lý request; thread nền không tính)."""
+    def __init__(self):
+        self.spans = []
+        _trace.set(self.spans)
+        self.profiler = cProfile.Profile()
+        self.start = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self, top=PROFILE_TOP):
+        """-> {'total_ms', 'stages': [{stage, count, ms, rows, bytes}], 'functions': [top theo thời gian tích lũy]}."""
+        self.profiler.disable()
+        total = time.perf_counter() - self.start
+        _trace.set(None)
+        stages = {}
+        for name, seconds, rows, nbytes in self.spans:
+            s = stages.setdefault(name, {'stage': name, 'count': 0, 'ms': 0.0, 'rows': None, 'bytes': None})
+            s['count'] += 1
+            s['ms'] = round(s['ms'] + seconds * 1000, 3)
+            if rows is not None: s['rows'] = (s['rows'] or 0) + rows
+            if nbytes is not None: s['bytes'] = (s['bytes'] or 0) + nbytes
+        entries = sorted(pstats.Stats(self.profiler).stats.items(), key=lambda kv: kv[1][3], reverse=True)[:top]
+        functions = [{'function': f"{os.path.basename(path)}:{line}({fn})", 'calls': calls,
+                      'self_ms': round(own * 1000, 3), 'cumulative_ms': round(cum * 1000, 3)}
+                     for (path, line, fn), (_, calls, own, cum, _) in entries]
+        return {'total_ms': round(total * 1000, 3), 'stages': list(stages.values()), 'functions': functions}
+
+def server_timing(stages):
+    """Header Server-Timing (hiện trong tab Network của DevTools) từ stages của Profile.stop()."""
+    return ', '.join(f"{s['stage'].replace(' ', '_')};dur={s['ms']:.1f}" for s in stages)
@@ -0,0 +1,149 @@
+"""
+news.py — tin tức thị trường theo từ khóa (tên sản phẩm top 1) để bổ sung ngữ cảnh cho chat / báo cáo AI.
+- Kết quả được cache theo từ khóa trong SQLite cục bộ (dùng chung giữa các worker): còn mới (< DATANA_NEWS_TTL)
+  thì trả ngay; đã cũ thì vẫn trả ngay bản cũ và làm mới ở thread nền (stale-while-revalidate);
+  bị xóa hẳn sau DATANA_NEWS_MAX_AGE.
+- lookup() bắt đầu tải ngay và trả về Lookup: gọi khi vừa biết từ khóa, dựng phần còn lại của prompt, rồi mới result().
+  Chưa có cache thì chỉ chờ tối đa DATANA_NEWS_WAIT giây, lần tải vẫn chạy tiếp để lần sau có sẵn.
+- Nguồn tin thay được: set_source(hàm từ khóa -> [tiêu đề]) hoặc DATANA_NEWS_URL trỏ tới trang kết quả
+  dạng DuckDuckGo HTML (vd server giả khi thử nghiệm).
+- Phân tích HTML bằng lxml nếu có (nhanh hơn nhiều), không thì BeautifulSoup chỉ dựng các thẻ <a class="result__a">.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+NEWS_URL = os.environ.get('DATANA_NEWS_URL', 'https://html.duckduckgo.com/html/')
+NEWS_CACHE_PATH = os.environ.get('DATANA_NEWS_CACHE', 'cache/news.db')
+NEWS_TTL = int(os.environ.get('DATANA_NEWS_TTL', 1800))
+NEWS_MAX_AGE = int(os.environ.get('DATANA_NEWS_MAX_AGE', 7 * 24 * 3600))
+NEWS_WAIT = float(os.environ.get('DATANA_NEWS_WAIT', 4))
+NEWS_TIMEOUT = float(os.environ.get('DATANA_NEWS_TIMEOUT', 6))
+NEWS_WORKERS = int(os.environ.get('DATANA_NEWS_WORKERS', 4))
+NEWS_LIMIT = 3
+QUERY_TEMPLATE = "thị trường {keyword} việt nam xu hướng 2025"
+
+NO_KEYWORD = "Không có dữ liệu tìm kiếm cụ thể."
+NO_RESULTS = "Không tìm thấy tin tức mới."
+UNAVAILABLE = "Hệ thống tìm kiếm đang bảo trì."
+
+try:
+    import lxml.html
+    _RESULT_XPATH = "//a[contains(concat(' ', normalize-space(@class), ' '), ' result__a ')]"
+except ImportError:
+    lxml = None
+
+def parse_results(html, limit=NEWS_LIMIT):
+    """Tiêu đề các kết quả (thẻ a.result__a) của trang DuckDuckGo HTML."""
+    if not html: return []
+    if lxml is not None:
+        try: links = lxml.html.fromstring(html).xpath(_RESULT_XPATH)
+        except (ValueError, lxml.etree.ParserError): return []
+        titles = (' '.join(a.text_content().split()) for a in links)
+    else:
+        from bs4 import BeautifulSoup, SoupStrainer
+        soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('a', class_='result__a'))
+        titles = (a.get_text(' ', strip=True) for a in soup.find_all('a', limit=limit))
+    return [t for t in titles if t][:limit]
+
+_http = threading.local()
+
+def duckduckgo(keyword, url=None, timeout=NEWS_TIMEOUT):
+    """Nguồn mặc định: POST tới trang kết quả HTML (giữ kết nối qua requests.Session của từng thread)."""
+    import requests
+    session = getattr(_http, 'session', None)
+    if session is None:
+        session = _http.session = requests.Session()
+        session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    res = session.post(url or NEWS_URL, data={'q': QUERY_TEMPLATE.format(keyword=keyword)}, timeout=timeout)
+    res.raise_for_status()
+    return parse_results(res.content)
+
+_source = duckduckgo
+
+def set_source(fn):
+    """Đổi nguồn tin: fn(keyword) -> list tiêu đề (ném lỗi nếu không lấy được). Trả về nguồn cũ."""
+    global _source
+    old, _source = _source, fn
+    return old
+
+def format_news(items):
+    return "\n".join(f"- {t}" for t in items) if items else NO_RESULTS
+
+_store = None
+_executor = None
+_inflight = {}
+_lock = threading.Lock()
+_stats = {'fresh': 0, 'stale': 0, 'misses': 0, 'fetches': 0, 'errors': 0}
+
+def _count(name):
+    with _lock: _stats[name] += 1
+
+def store():
+    global _store
+    if _store is None:
+        from session_store import SessionStore
+        os.makedirs(os.path.dirname(NEWS_CACHE_PATH) or '.', exist_ok=True)
+        _store = SessionStore(NEWS_CACHE_PATH, 'news', ttl=NEWS_MAX_AGE, max_bytes=16 * 1024 * 1024)
+    return _store
+
+def _key(keyword):
+    return ' '.join(keyword.casefold().split())
+
+def _fetch(key, keyword):
+    try:
+        with metrics.span('news.fetch'): items = _source(keyword)
+        store()[key] = {'items': items, 'fetched': time.time()}
+        return format_news(items)
+    except Exception:
+        _count('errors')
+        raise
+    finally:
+        with _lock: _inflight.pop(key, None)
+
+def _refresh(key, keyword):
+    """Tải (lại) từ khóa ở thread nền; các lời gọi trùng nhau dùng chung một lần tải."""
+    global _executor
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None: return future
+        if _executor is None: _executor = ThreadPoolExecutor(max_workers=NEWS_WORKERS, thread_name_prefix='news')
+        _stats['fetches'] += 1
+        future = _inflight[key] = _executor.submit(_fetch, key, keyword)
+    return future
+
+class Lookup:
+    """Kết quả lookup(): result() trả văn bản tin tức, chờ tối đa `wait` giây nếu chưa có trong cache."""
+    def __init__(self, text=None, future=None, wait=NEWS_WAIT):
+        self.text, self.future, self.wait = text, future, wait
+
+    def result(self):
+        if self.text is not None: return self.text
+        try: return self.future.result(timeout=self.wait)
+        except Exception: return UNAVAILABLE
+
+def lookup(keyword, wait=NEWS_WAIT):
+    """Bắt đầu lấy tin cho từ khóa. Có cache (kể cả đã cũ) -> không chạm mạng trên luồng request."""
+    if not keyword or len(keyword) < 2: return Lookup(NO_KEYWORD)
+    key = _key(keyword)
+    entry = store().get(key)
+    if entry is not None:
+        if time.time() - entry['fetched'] < NEWS_TTL: _count('fresh')
+        else:
+            _count('stale')
+            _refresh(key, keyword)
+        return Lookup(format_news(entry['items']))
+    _count('misses')
+    return Lookup(future=_refresh(key, keyword), wait=wait)
+
+def search(keyword, wait=NEWS_WAIT):
+    return lookup(keyword, wait).result()
+
+def stats():
+    with _lock: out = dict(_stats, inflight=len(_inflight))
+    out.update(store().stats())
+    out['fresh_ttl'] = NEWS_TTL
+    out['parser'] = 'lxml' if lxml is not None else 'html.parser'
+    return out
@@ -0,0 +1,237 @@
+"""
+prompt_context.py — phần dữ liệu trong prompt chat, chọn theo câu hỏi và giới hạn theo ngân sách token.
+- build_digest(cube) chạy một lần cho mỗi phân tích (lưu digest.json trong thư mục cube, cube ghi lại thì digest mất theo):
+  KPI tổng, chuỗi theo tháng và một dòng đã định dạng sẵn cho từng nhãn của mỗi chiều (sắp theo doanh thu),
+  kèm thứ tự theo lợi nhuận để lấy nhóm kém nhất.
+- Chỉ mục từ khóa: nhãn đã bỏ dấu + chữ thường, tra theo từ đầu tiên -> khớp tên sản phẩm / thương hiệu / khu vực...
+  xuất hiện trong câu hỏi; thêm tháng/quý/năm và các từ chỉ chiều ("khu vực", "thương hiệu", "thấp nhất"...).
+- context() ghép các phần theo thứ tự ưu tiên: KPI, nhãn được nhắc tới (kèm chuỗi tháng lấy từ cube), tháng được nhắc tới,
+  các chiều được hỏi, rồi tổng quan mặc định, dừng khi hết DATANA_PROMPT_TOKENS.
+"""
+import json
+import os
+import re
+import unicodedata
+import cube as cube_mod
+from session_store import LRUCache
+
+PROMPT_TOKENS = int(os.environ.get('DATANA_PROMPT_TOKENS', 1200))
+DIGEST_VERSION = 1
+TOP_N = 10
+SERIES_MONTHS = 12
+MAX_ENTITIES = 6
+DIM_NAMES = {'product': 'SẢN PHẨM', 'brand': 'THƯƠNG HIỆU', 'category': 'DANH MỤC', 'region': 'KHU VỰC'}
+PLACEHOLDERS = {'unknown', 'khac', 'n/a', 'nan', 'none', ''}
+# Từ (đã bỏ dấu) cho biết câu hỏi quan tâm tới chiều nào
+INTENTS = {
+    'product': ('san pham', 'mat hang', 'sku', 'product'),
+    'brand': ('thuong hieu', 'nhan hieu', 'brand'),
+    'category': ('danh muc', 'nganh hang', 'nhom hang', 'loai hang', 'category'),
+    'region': ('khu vuc', 'vung', 'tinh thanh', 'thanh pho', 'mien', 'chi nhanh', 'region'),
+    'month': ('thang', 'quy', 'xu huong', 'theo thoi gian', 'mua vu', 'tang truong', 'du bao', 'trend'),
+    'bottom': ('thap nhat', 'kem nhat', 'te nhat', 'it nhat', 'ban cham', 'thua lo', 'lo nhat', 'giam'),
+}
+
+_DIGESTS = LRUCache(int(os.environ.get('DATANA_DIGEST_CACHE_SIZE', 64)))
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+def normalize(text):
+    """Bỏ dấu tiếng Việt, chữ thường, chỉ giữ chữ + số cách nhau một khoảng trắng."""
+    text = unicodedata.normalize('NFD', str(text).replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn').casefold()
+    return _NON_WORD.sub(' ', text).strip()
+
+def estimate_tokens(text):
+    """Ước lượng thận trọng cho tiếng Việt có dấu (~3 ký tự / token)."""
+    return len(text) // 3 + 1
+
+def money(v):
+    a = abs(v)
+    if a >= 1e9: return f"{v / 1e9:,.2f} tỷ"
+    if a >= 1e6: return f"{v / 1e6:,.1f} tr"
+    return f"{v:,.0f}"
+
+def _line(label, revenue, profit, quantity, total_revenue):
+    margin = profit / revenue * 100 if revenue else 0.0
+    share = revenue / total_revenue * 100 if total_revenue else 0.0
+    return f"- {label}: DT {money(revenue)} ({share:.1f}%) | LN {money(profit)} ({margin:.1f}%) | SL {quantity:,.0f}"
+
+def build_digest(c):
+    """Digest của một cube: {'totals', 'kpis', 'months', 'dims': {chiều: {'labels', 'lines', 'worst'}}}."""
+    by_month = c.query('month')
+    totals = by_month['totals']
+    revenue, profit = totals['revenue'], totals['profit']
+    months = [(m, r, p, q) for m, r, p, q in zip(by_month['labels'], by_month['revenue'], by_month['profit'], by_month['quantity'])
+              if m != cube_mod.MISSING_MONTH]
+    kpis = [f"- Tổng doanh thu: {revenue:,.0f} VNĐ", f"- Tổng lợi nhuận: {profit:,.0f} VNĐ",
+            f"- Tổng số lượng bán: {totals['quantity']:,.0f} sản phẩm",
+            f"- Biên lợi nhuận: {profit / revenue * 100 if revenue else 0:.1f}% | Số dòng dữ liệu: {totals['rows']:,.0f}"]
+    if months: kpis.append(f"- Giai đoạn: {months[0][0]} → {months[-1][0]} ({len(months)} tháng)")
+    dims = {}
+    for dim in DIM_NAMES:
+        q = c.query(dim)
+        labels = [str(l) for l in q['labels']]
+        kpis.append(f"- Số {DIM_NAMES[dim].lower()}: {len(labels)}")
+        lines = [_line(l, r, p, n, revenue) for l, r, p, n in zip(labels, q['revenue'], q['profit'], q['quantity'])]
+        worst = sorted(range(len(labels)), key=lambda i: q['profit'][i])[:TOP_N]
+        dims[dim] = {'labels': labels, 'lines': lines, 'worst': worst}
+    return {'version': DIGEST_VERSION, 'totals': totals, 'kpis': kpis,
+            'months': [[m, r, p, q] for m, r, p, q in months], 'dims': dims}
+
+class Digest:
+    """Digest đã nạp + chỉ mục từ khóa (dựng một lần, giữ trong LRU)."""
+    def __init__(self, data):
+        self.data = data
+        self.month_index = {m[0]: i for i, m in enumerate(data['months'])}
+        self.index = {}  # từ đầu của nhãn đã chuẩn hóa -> [(nhãn chuẩn hóa, chiều, vị trí)]
+        for dim, d in data['dims'].items():
+            for i, label in enumerate(d['labels']):
+                norm = normalize(label)
+                if norm in PLACEHOLDERS or len(norm) < 3: continue
+                self.index.setdefault(norm.split(' ', 1)[0], []).append((norm, dim, i))
+
+    def entities(self, question):
+        """Các nhãn xuất hiện nguyên cụm trong câu hỏi, dài trước (nhãn nằm trong nhãn khác đã khớp thì bỏ)."""
+        padded = f" {question} "
+        found = []
+        for token in set(question.split()):
+            for norm, dim, i in self.index.get(token, ()):
+                if f" {norm} " in padded: found.append((norm, dim, i))
+        found.sort(key=lambda f: (-len(f[0]), f[2]))
+        picked = []
+        for norm, dim, i in found:
+            if any(norm != p[0] and f" {norm} " in f" {p[0]} " for p in picked): continue
+            picked.append((norm, dim, i))
+        return [(dim, i) for _, dim, i in picked[:MAX_ENTITIES]]
+
+    def months_in(self, question):
+        """Tháng 'YYYY-MM' có trong dữ liệu được nhắc tới: 'tháng 3', 'tháng 3/2024', '03/2024', '2024-03', 'quý 2', 'năm 2024'."""
+        keys = list(self.month_index)
+        picked = set()
+        def add(month=None, year=None, quarter=None):
+            for k in keys:
+                y, m = int(k[:4]), int(k[5:7])
+                if year and y != year: continue
+                if month and m != month: continue
+                if quarter and (m - 1) // 3 + 1 != quarter: continue
+                picked.add(k)
+        for m, y in re.findall(r'\bthang (\d{1,2})(?: (?:nam )?(\d{4}))?\b', question):
+            if 1 <= int(m) <= 12: add(month=int(m), year=int(y) if y else None)
+        for y, m in re.findall(r'\b(\d{4}) (\d{1,2})\b', question):
+            if 1 <= int(m) <= 12: add(month=int(m), year=int(y))
+        for m, y in re.findall(r'\b(\d{1,2}) (\d{4})\b', question):
+            if 1 <= int(m) <= 12: add(month=int(m), year=int(y))
+        for qn, y in re.findall(r'\bquy ([1-4])(?: (?:nam )?(\d{4}))?\b', question):
+            add(quarter=int(qn), year=int(y) if y else None)
+        if not picked:
+            for y in re.findall(r'\bnam (\d{4})\b', question): add(year=int(y))
+        return sorted(picked)
+
+def digest_for(c):
+    """Digest của cube: LRU trong process -> digest.json -> dựng từ cube (rồi lưu lại).
+    Khóa theo dấu của chính cube c; cube đã được ghi lại sau khi c mở thì dựng từ c, không đọc / ghi file."""
+    path = os.path.join(c.path, 'digest.json')
+    key = (c.path, c.stamp)
+    hit = _DIGESTS.get(key)
+    if hit: return hit
+    data = None
+    if cube_mod.stamp(c.path) == c.stamp:
+        try:
+            with open(path, encoding='utf-8') as fh: data = json.load(fh)
+            if data.get('version') != DIGEST_VERSION: data = None
+        except (OSError, ValueError): pass
+    if data is None: data = save_digest(c)
+    digest = Digest(data)
+    _DIGESTS.set(key, digest)
+    return digest
+
+def save_digest(c):
+    data = build_digest(c)
+    if cube_mod.stamp(c.path) != c.stamp: return data
+    tmp = os.path.join(c.path, f'digest.json.{os.getpid()}.tmp')
+    try:
+        with open(tmp, 'w', encoding='utf-8') as fh: json.dump(data, fh, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, os.path.join(c.path, 'digest.json'))
+    except OSError: pass
+    return data
+
+def _month_line(m):
+    return f"- {m[0]}: DT {money(m[1])} | LN {money(m[2])} | SL {m[3]:,.0f}"
+
+def _entity_section(c, digest, dim, i):
+    d = digest.data['dims'][dim]
+    label = d['labels'][i]
+    lines = [d['lines'][i], f"  Hạng {i + 1}/{len(d['labels'])} theo doanh thu"]
+    series = c.query('month', filters={dim: [label]})
+    points = [(m, r) for m, r in zip(series['labels'], series['revenue']) if m != cube_mod.MISSING_MONTH][-SERIES_MONTHS:]
+    if len(points) > 1: lines.append("  DT theo tháng: " + "; ".join(f"{m} {money(r)}" for m, r in points))
+    if dim != 'product':
+        top = c.query('product', filters={dim: [label]}, limit=3)
+        lines.append("  Sản phẩm chính: " + "; ".join(f"{l} {money(r)}" for l, r in zip(top['labels'], top['revenue'])))
+    return f"[{DIM_NAMES[dim]}: {label}]", lines
+
+def _cross_section(c, digest, entities):
+    """Giao của các nhãn thuộc những chiều khác nhau (vd Samsung × Đà Nẵng)."""
+    filters = {}
+    for dim, i in entities: filters.setdefault(dim, [digest.data['dims'][dim]['labels'][i]])
+    if len(filters) < 2: return None
+    top = c.query('product', filters=filters, limit=3)
+    t = top['totals']
+    title = "[" + " × ".join(v[0] for v in filters.values()) + "]"
+    if not t['rows']: return title, ["- Không có dòng dữ liệu nào"]
+    lines = [_line('Tổng', t['revenue'], t['profit'], t['quantity'], digest.data['totals']['revenue']),
+             "  Sản phẩm chính: " + "; ".join(f"{l} {money(r)}" for l, r in zip(top['labels'], top['revenue']))]
+    return title, lines
+
+def _month_section(c, digest, month):
+    m = digest.data['months'][digest.month_index[month]]
+    top = c.query('product', date_from=month, date_to=month, limit=3)
+    lines = [_month_line(m), "  Sản phẩm dẫn đầu: " + "; ".join(f"{l} {money(r)}" for l, r in zip(top['labels'], top['revenue']))]
+    return f"[THÁNG {month}]", lines
+
+def context(c, question, filename='', budget=PROMPT_TOKENS):
+    """Khối văn bản dữ liệu cho system prompt, không vượt quá ~budget token."""
+    digest = digest_for(c)
+    data = digest.data
+    q = normalize(question)
+    wants = {name for name, words in INTENTS.items() if any(f" {w} " in f" {q} " for w in words)}
+
+    sections = [(f"[DỮ LIỆU TỪ FILE CỦA NGƯỜI DÙNG - {filename}]", data['kpis'])]
+    entities = digest.entities(q)
+    sections += [_entity_section(c, digest, dim, i) for dim, i in entities]
+    cross = _cross_section(c, digest, entities)
+    if cross: sections.append(cross)
+    sections += [_month_section(c, digest, m) for m in digest.months_in(q)[:SERIES_MONTHS]]
+    for dim in DIM_NAMES:
+        d = data['dims'][dim]
+        if dim in wants or (dim == 'product' and 'bottom' in wants):
+            if 'bottom' in wants:
+                sections.append((f"[{DIM_NAMES[dim]} LỢI NHUẬN THẤP NHẤT]", [d['lines'][i] for i in d['worst']]))
+            sections.append((f"[TOP {TOP_N} {DIM_NAMES[dim]}]", d['lines'][:TOP_N]))
+    if 'month' in wants:
+        sections.append(("[DOANH THU THEO THÁNG]", [_month_line(m) for m in data['months'][-SERIES_MONTHS * 2:]]))
+    # Tổng quan mặc định (bổ sung nếu còn ngân sách)
+    sections += [("[TOP SẢN PHẨM BÁN CHẠY NHẤT]", data['dims']['product']['lines'][:5]),
+                 ("[DANH MỤC CHÍNH]", data['dims']['category']['lines'][:3]),
+                 ("[KHU VỰC CHÍNH]", data['dims']['region']['lines'][:3]),
+                 ("[DOANH THU THEO THÁNG]", [_month_line(m) for m in data['months'][-SERIES_MONTHS:]]),
+                 ("[SẢN PHẨM LỢI NHUẬN THẤP NHẤT]", [data['dims']['product']['lines'][i] for i in data['dims']['product']['worst'][:3]])]
+
+    out, used, seen = [], 0, set()
+    for title, lines in sections:
+        if title in seen or not lines: continue
+        cost = estimate_tokens(title)
+        if used + cost + estimate_tokens(lines[0]) > budget: continue
+        block = [title]
+        for line in lines:
+            if line in seen: continue
+            c_line = estimate_tokens(line)
+            if used + cost + c_line > budget: break
+            block.append(line)
+            seen.add(line)
+            cost += c_line
+        if len(block) == 1: continue
+        seen.add(title)
+        out.append("\n".join(block))
+        used += cost
+    return "\n\n".join(out)
@@ -1,131 +1,287 @@
-def generate_recommendations(statistics, revenue_by_region, top_products, revenue_by_month, product_metrics):
-    """
-    Generate a multi-tier structured set of recommendations.
-
-    Returns a dict with keys:
-      - product_suggestions
-      - region_suggestions
-      - customer_suggestions
-      - marketing_suggestions
-      - overall_strategy
-
-    This function uses simple rule-based heuristics on the provided metrics
-    to produce 5-10 suggestions across different categories.
-    """
-    # Helper builders
-    product_suggestions = []
-    region_suggestions = []
-    customer_suggestions = []
-    marketing_suggestions = []
-    overall_strategy = []
-
-    # --- Trend / Time-based insights ---
-    if revenue_by_month and len(revenue_by_month) >= 2:
-        months = list(revenue_by_month.keys())
-        last_m = months[-1]
-        prev_m = months[-2]
-        last = revenue_by_month[last_m]
-        prev = revenue_by_month[prev_m] if revenue_by_month.get(prev_m) is not None else 0
-        if prev > 0:
-            change = (last - prev) / prev * 100
-            if change > 15:
-                marketing_suggestions.append(f"Doanh thu tháng {last_m} tăng {change:.0f}% so với {prev_m} — tiếp tục tăng ngân sách quảng cáo cho kênh đang vận hành tốt.")
-            elif change < -10:
-                overall_strategy.append(f"Doanh thu giảm {abs(change):.0f}% so với {prev_m}. Kiểm tra chiến dịch marketing, giá, tồn kho và phản hồi khách hàng cho kỳ này.")
-            else:
-                overall_strategy.append(f"Doanh thu ổn định (thay đổi {change:.0f}% so với {prev_m}). Theo dõi để phát hiện sớm biến động.")
-
-    # Seasonality cue: simple heuristic using month names
-    try:
-        # If there are >=6 months, look for repeating highs/lows roughly every 12 months (lightweight)
-        if len(revenue_by_month) >= 6:
-            months = list(revenue_by_month.keys())
-            vals = list(revenue_by_month.values())
-            avg = sum(vals) / len(vals)
-            highs = [m for m,v in revenue_by_month.items() if v > 1.2 * avg]
-            lows = [m for m,v in revenue_by_month.items() if v < 0.8 * avg]
-            if highs:
-                overall_strategy.append(f"Phát hiện chu kỳ: các tháng {', '.join(highs[-3:])} có doanh thu cao hơn trung bình — cân nhắc tăng tồn kho trước chu kỳ này.")
-            if lows:
-                overall_strategy.append(f"Phát hiện chu kỳ thấp điểm: {', '.join(lows[-3:])} — cân nhắc khuyến mại hoặc bundle trong những tháng này.")
-    except Exception:
-        pass
-
-    # --- Product analysis ---
-    if top_products:
-        # Top performers
-        for p in top_products[:5]:
-            product_suggestions.append(f"Tăng quảng cáo cho '{p.get('name')}' — doanh thu {p.get('revenue',0):,.0f}, lợi nhuận {p.get('profit',0):,.0f}.")
-
-    # Low performers / low margin
-    low_perf = []
-    for name, m in product_metrics.items():
-        qty = m.get('quantity', 0) or 0
-        rev = m.get('revenue', 0) or 0
-        margin = m.get('margin', None)
-        if rev < 200000 and qty < 10:
-            low_perf.append(name)
-        elif margin is not None and margin < 0.05 and rev > 0:
-            low_perf.append(name)
-    if low_perf:
-        product_suggestions.append(f"Các sản phẩm cần xem xét ngừng/khuyến mại: {', '.join(low_perf[:8])}.")
-        overall_strategy.append("Xem xét tối ưu danh mục: loại bỏ SKUs không hiệu quả hoặc chuyển sang chiến lược clearance.")
-
-    # Price suggestions (simplified)
-    high_margin = [n for n,m in product_metrics.items() if (m.get('margin') or 0) > 0.25]
-    if high_margin:
-        overall_strategy.append(f"Sản phẩm biên lợi nhuận cao: {', '.join(high_margin[:5])}. Có thể tăng nhẹ giá bán hoặc đầu tư quảng cáo để mở rộng lợi nhuận.")
-
-    # --- Region analysis ---
-    if revenue_by_region:
-        regions_sorted = sorted(revenue_by_region.items(), key=lambda x: x[1], reverse=True)
-        best_region, best_rev = regions_sorted[0]
-        region_suggestions.append(f"Tập trung marketing tại {best_region} (doanh thu cao: {best_rev:,.0f}).")
-        if len(regions_sorted) > 1:
-            worst_region, worst_rev = regions_sorted[-1]
-            if best_rev > 0 and worst_rev / max(best_rev, 1) < 0.6:
-                region_suggestions.append(f"Khu vực {worst_region} giảm mạnh so với {best_region}. Kiểm tra kênh phân phối, giá và chương trình khuyến mãi tại đây.")
-
-    # --- Customer insights (simplified) ---
-    # We don't always have detailed segments; attempt to build suggestions from provided statistics
-    cust_seg = statistics.get('top_customer_segments') if isinstance(statistics, dict) else None
-    if cust_seg:
-        for seg in cust_seg[:3]:
-            customer_suggestions.append(f"Nhóm khách '{seg.get('segment')}' mua nhiều nhất — đề xuất bundle sản phẩm phù hợp.")
-
-    # Cross-sell / upsell simple heuristics
-    if top_products and len(top_products) >= 2:
-        a = top_products[0]['name']
-        b = top_products[1]['name']
-        marketing_suggestions.append(f"Xây dựng chiến dịch cross-sell: gợi ý '{b}' khi khách xem '{a}'.")
-
-    # Marketing suggestions
-    marketing_suggestions.append("Test A/B landing pages hoặc creatives cho 2 sản phẩm bán chạy nhất để tăng conversion.")
-    marketing_suggestions.append("Đo lường ROAS theo chiến dịch trong 30 ngày gần nhất và rút ngân sách cho chiến dịch hiệu suất thấp.")
-
-    # Supply chain / cost
-    overall_strategy.append("Rà soát chi phí nhập hàng và tồn kho cho top SKUs để tối ưu chuỗi cung ứng.")
-
-    # Consolidate and trim to reasonable counts
-    def take_unique(lst, limit=6):
-        out = []
-        for x in lst:
-            if x not in out:
-                out.append(x)
-            if len(out) >= limit:
-                break
+"""
+recommendations.py — gợi ý chiến lược dạng luật trên các bảng tổng hợp của cube (toàn bộ file, không chỉ raw_data mẫu).
+- Bảng theo sản phẩm / khu vực / tháng được tính bằng np.bincount trên mã của cube; mỗi luật là một điều kiện trên
+  cột (mảng numpy) áp cho mọi SKU một lượt, chỉ các SKU được chọn để hiển thị mới đổi sang chuỗi
+  -> vẫn nhanh với 100k+ SKU.
+- Ngưỡng tương đối theo dữ liệu (phân vị, trung vị, tỉ trọng) thay vì số tuyệt đối, đổi được qua DATANA_RECS_*.
+- recommendations_for(c): tính một lần cho mỗi phân tích, lưu recommendations.json cạnh cube + LRU trong process.
+Kết quả: các nhóm câu gợi ý product / pricing / marketing / regional / operation (trang suggestions)
+và 'rules': mỗi luật khớp kèm số SKU và vài SKU tiêu biểu.
+"""
+import json
+import os
+import time
+from functools import cached_property
+import numpy as np
+import cube as cube_mod
+from session_store import LRUCache
+
+RECS_VERSION = 1
+LOW_QUANTILE = float(os.environ.get('DATANA_RECS_LOW_QUANTILE', 0.1))
+LOW_MARGIN = float(os.environ.get('DATANA_RECS_LOW_MARGIN', 0.05))
+HIGH_MARGIN = float(os.environ.get('DATANA_RECS_HIGH_MARGIN', 0.25))
+SEASON_MIN_MONTHS = 12      # cần đủ một năm dữ liệu mới xét mùa vụ theo từng SKU
+SEASON_PEAK_SHARE = 0.35    # một tháng trong năm chiếm >= 35% doanh thu của SKU (đều thì ~8%)
+SEASON_MIN_ACTIVE = 6       # ... và SKU có bán ở >= 6 tháng trong năm (SKU thưa không tính là mùa vụ)
+REGION_GAP = 0.6            # khu vực đạt < 60% doanh thu khu vực tốt nhất
+MAJOR_REGION_SHARE = 0.1    # khu vực chính: >= 10% tổng doanh thu
+TOP_SHARE = 0.05            # nhóm SKU bán chạy khi xét độ phủ khu vực: top 5% (ít nhất TOP_MIN)
+TOP_MIN = 20
+MIN_SKUS = 10               # ít SKU hơn thì phân vị không có nghĩa, bỏ luật theo phân vị
+EXAMPLES = 5
+LIMITS = {'product': 8, 'pricing': 5, 'marketing': 6, 'regional': 5, 'operation': 6}
+NO_REGION = 'Khác'
+MISSING_MONTH = 'N/A'
+
+_CACHE = LRUCache(int(os.environ.get('DATANA_RECS_CACHE_SIZE', 64)))
+
+def money(v):
+    return f"{v:,.0f}"
+
+def _top(idx, key, n=EXAMPLES):
+    """n phần tử của idx có key lớn nhất, giảm dần (argpartition, không sắp cả mảng)."""
+    if len(idx) > n: idx = idx[np.argpartition(-key[idx], n - 1)[:n]]
+    return idx[np.argsort(-key[idx], kind='stable')]
+
+def _names(labels, idx, key, n=EXAMPLES):
+    return [labels[i] for i in _top(idx, key, n).tolist()]
+
+def _quote(names, total):
+    more = f" (+{total - len(names):,} SKU khác)" if total > len(names) else ""
+    return ", ".join(f"'{n}'" for n in names) + more
+
+class Frames:
+    """Các bảng tổng hợp của một cube, tính khi luật đầu tiên cần tới (mảng theo thứ tự nhãn của cube)."""
+    def __init__(self, c):
+        self.c = c
+
+    def _sums(self, dim):
+        codes, n = np.asarray(self.c.array(f'{dim}.codes')), len(self.c.labels[dim])
+        return {m: np.bincount(codes, weights=np.asarray(self.c.array(m)), minlength=n)
+                for m in ('revenue', 'profit', 'quantity')}
+
+    @cached_property
+    def products(self):
+        p = self._sums('product')
+        rev = p['revenue']
+        p['margin'] = np.divide(p['profit'], rev, out=np.full_like(rev, np.nan), where=rev > 0)
+        p['labels'] = self.c.labels['product']
+        return p
+
+    @cached_property
+    def has_profit(self):
+        return bool(np.any(self.products['profit'] != 0))
+
+    @cached_property
+    def regions(self):
+        r = self._sums('region')
+        r['labels'] = self.c.labels['region']
+        return r
+
+    @cached_property
+    def month_count(self):
+        months = self.c.labels['month']
+        return len(months) - (1 if months and months[-1] == MISSING_MONTH else 0)
+
+    @cached_property
+    def months(self):
+        """(nhãn 'YYYY-MM', doanh thu) các tháng có dữ liệu, theo thời gian."""
+        n = self.month_count
+        rev = self._sums('month')['revenue'][:n]
+        keep = np.flatnonzero(rev != 0)
+        return [self.c.labels['month'][i] for i in keep.tolist()], rev[keep]
+
+    @cached_property
+    def product_by_month_of_year(self):
+        """Ma trận SKU × 12 tháng trong năm (doanh thu), bỏ dòng không có tháng."""
+        n = self.month_count
+        moy = np.array([int(m[5:7]) - 1 for m in self.c.labels['month'][:n]], dtype='int64')
+        months = np.asarray(self.c.array('month.codes'))
+        keep = months < n
+        flat = np.asarray(self.c.array('product.codes'))[keep].astype('int64') * 12 + moy[months[keep]]
+        n_products = len(self.products['labels'])
+        return np.bincount(flat, weights=np.asarray(self.c.array('revenue'))[keep], minlength=n_products * 12).reshape(n_products, 12)
+
+    def presence(self, regions):
+        """Ma trận bool SKU × regions: SKU có bán ở khu vực đó (regions: vài mã khu vực chính)."""
+        col = np.full(len(self.regions['labels']), -1, dtype='int64')
+        col[regions] = np.arange(len(regions))
+        cols = col[np.asarray(self.c.array('region.codes'))]
+        keep = cols >= 0
+        out = np.zeros((len(self.products['labels']), len(regions)), dtype=bool)
+        out[np.asarray(self.c.array('product.codes'))[keep], cols[keep]] = True
         return out
 
-    result = {
-        'product_suggestions': take_unique(product_suggestions, 8),
-        'region_suggestions': take_unique(region_suggestions, 5),
-        'customer_suggestions': take_unique(customer_suggestions, 5),
-        'marketing_suggestions': take_unique(marketing_suggestions, 6),
-        'overall_strategy': take_unique(overall_strategy, 6)
-    }
+# --- Luật: mỗi hàm nhận Frames, trả về list (nhóm, câu) và thêm kết quả có cấu trúc vào `found` ---
+
+def rule_top_products(f, found):
+    p = f.products
+    if not len(p['labels']): return []
+    idx = _top(np.flatnonzero(p['revenue'] > 0), p['revenue']).tolist()
+    top = [p['labels'][i] for i in idx]
+    profit = (lambda i: f", lợi nhuận {money(p['profit'][i])}") if f.has_profit else (lambda i: "")
+    out = [('product', f"Tăng quảng cáo cho '{p['labels'][i]}' — doanh thu {money(p['revenue'][i])}{profit(i)}.") for i in idx[:3]]
+    if len(top) >= 2:
+        out.append(('marketing', f"Xây dựng chiến dịch cross-sell: gợi ý '{top[1]}' khi khách xem '{top[0]}'."))
+    found.append({'rule': 'top_products', 'count': len(top), 'items': top})
+    return out
+
+def rule_low_performers(f, found):
+    p = f.products
+    rev, qty = p['revenue'], p['quantity']
+    if len(rev) < MIN_SKUS: return []
+    mask = (rev <= np.quantile(rev, LOW_QUANTILE)) & (qty <= np.quantile(qty, LOW_QUANTILE))
+    idx = np.flatnonzero(mask)
+    if not len(idx): return []
+    names = _names(p['labels'], idx, -rev)
+    found.append({'rule': 'low_performer', 'count': int(len(idx)), 'items': names})
+    return [('product', f"{len(idx):,} SKU có doanh thu và số lượng thuộc nhóm {LOW_QUANTILE:.0%} thấp nhất, "
+                        f"cân nhắc ngừng bán / xả hàng: {_quote(names, len(idx))}."),
+            ('operation', "Tối ưu danh mục: loại bỏ SKU không hiệu quả hoặc chuyển sang chiến lược clearance.")]
+
+def rule_low_margin(f, found):
+    if not f.has_profit: return []
+    p = f.products
+    idx = np.flatnonzero((p['revenue'] > 0) & (p['margin'] < LOW_MARGIN))
+    if not len(idx): return []
+    losing = int(np.count_nonzero(p['margin'][idx] < 0))
+    names = _names(p['labels'], idx, p['revenue'])
+    at_stake = float(p['revenue'][idx].sum())
+    found.append({'rule': 'low_margin', 'count': int(len(idx)), 'losing': losing, 'revenue': at_stake, 'items': names})
+    loss = f", trong đó {losing:,} SKU đang lỗ" if losing else ""
+    return [('pricing', f"{len(idx):,} SKU biên lợi nhuận dưới {LOW_MARGIN:.0%}{loss} (doanh thu {money(at_stake)}): "
+                        f"{_quote(names, len(idx))} — rà soát giá nhập, giá bán và chiết khấu.")]
+
+def rule_high_margin(f, found):
+    if not f.has_profit: return []
+    p = f.products
+    rev = p['revenue']
+    idx = np.flatnonzero((p['margin'] > HIGH_MARGIN) & (rev >= np.median(rev)))
+    if not len(idx): return []
+    names = _names(p['labels'], idx, p['profit'])
+    found.append({'rule': 'high_margin', 'count': int(len(idx)), 'items': names})
+    return [('pricing', f"SKU biên lợi nhuận trên {HIGH_MARGIN:.0%} và doanh thu khá: {_quote(names, len(idx))}. "
+                        "Có thể tăng nhẹ giá bán hoặc đầu tư quảng cáo để mở rộng lợi nhuận.")]
+
+def rule_trend(f, found):
+    labels, rev = f.months
+    if len(rev) < 2 or rev[-2] <= 0: return []
+    change = (rev[-1] - rev[-2]) / rev[-2] * 100
+    found.append({'rule': 'trend', 'month': labels[-1], 'change_pct': round(float(change), 1)})
+    if change > 15:
+        return [('marketing', f"Doanh thu tháng {labels[-1]} tăng {change:.0f}% so với {labels[-2]} — "
+                              "tiếp tục tăng ngân sách quảng cáo cho kênh đang vận hành tốt.")]
+    if change < -10:
+        return [('operation', f"Doanh thu giảm {abs(change):.0f}% so với {labels[-2]}. Kiểm tra chiến dịch marketing, "
+                              "giá, tồn kho và phản hồi khách hàng cho kỳ này.")]
+    return [('operation', f"Doanh thu ổn định (thay đổi {change:.0f}% so với {labels[-2]}). Theo dõi để phát hiện sớm biến động.")]
+
+def rule_seasonality(f, found):
+    labels, rev = f.months
+    out = []
+    if len(rev) >= 6:
+        avg = rev.mean()
+        highs = [labels[i] for i in np.flatnonzero(rev > 1.2 * avg).tolist()]
+        lows = [labels[i] for i in np.flatnonzero(rev < 0.8 * avg).tolist()]
+        if highs: out.append(('operation', f"Các tháng {', '.join(highs[-3:])} có doanh thu cao hơn trung bình — "
+                                           "cân nhắc tăng tồn kho trước chu kỳ này."))
+        if lows: out.append(('marketing', f"Thấp điểm: {', '.join(lows[-3:])} — cân nhắc khuyến mại hoặc bundle trong những tháng này."))
+        found.append({'rule': 'seasonality', 'highs': highs, 'lows': lows})
+    if len(rev) < SEASON_MIN_MONTHS or len(f.products['labels']) < MIN_SKUS: return out
+    m = f.product_by_month_of_year
+    total = m.sum(axis=1)
+    peak = m.argmax(axis=1)
+    share = np.divide(m.max(axis=1), total, out=np.zeros_like(total), where=total > 0)
+    seasonal = (share >= SEASON_PEAK_SHARE) & (np.count_nonzero(m > 0, axis=1) >= SEASON_MIN_ACTIVE) & (total >= np.median(total))
+    idx = np.flatnonzero(seasonal)
+    if not len(idx): return out
+    per_month = np.bincount(peak[idx], minlength=12)
+    months = []
+    for month in np.argsort(-per_month, kind='stable')[:2].tolist():
+        if not per_month[month]: break
+        in_month = idx[peak[idx] == month]
+        names = _names(f.products['labels'], in_month, total)
+        months.append({'month': month + 1, 'count': int(per_month[month]), 'items': names})
+        out.append(('operation', f"{per_month[month]:,} SKU bán mạnh theo mùa, đỉnh vào tháng {month + 1}: "
+                                 f"{_quote(names, int(per_month[month]))} — nhập hàng sớm 1-2 tháng trước đỉnh."))
+    found.append({'rule': 'sku_seasonality', 'count': int(len(idx)), 'peaks': months})
+    return out
+
+def rule_region_gap(f, found):
+    r = f.regions
+    rev, labels = r['revenue'], r['labels']
+    real = np.flatnonzero((rev > 0) & (np.array(labels, dtype=object) != NO_REGION))
+    if len(real) < 2: return []
+    best = int(real[np.argmax(rev[real])])
+    out = [('regional', f"Tập trung marketing tại {labels[best]} (doanh thu cao nhất: {money(rev[best])}).")]
+    weak = real[rev[real] < REGION_GAP * rev[best]]
+    weak = weak[np.argsort(rev[weak], kind='stable')]
+    for i in weak[:3].tolist():
+        out.append(('regional', f"Khu vực {labels[i]} chỉ đạt {rev[i] / rev[best]:.0%} doanh thu của {labels[best]}. "
+                                "Kiểm tra kênh phân phối, giá và chương trình khuyến mãi tại đây."))
+    found.append({'rule': 'region_gap', 'best': labels[best], 'weak': [labels[i] for i in weak.tolist()]})
+
+    # SKU bán chạy nhưng chưa có mặt ở một số khu vực chính
+    major = real[rev[real] >= MAJOR_REGION_SHARE * rev.sum()]
+    p = f.products
+    n_products = len(p['labels'])
+    if len(major) < 2 or n_products < 2: return out
+    n_top = min(n_products, max(TOP_MIN, int(n_products * TOP_SHARE)))
+    top = np.argpartition(-p['revenue'], n_top - 1)[:n_top] if n_top < n_products else np.arange(n_products)
+    present = f.presence(major)
+    idx = top[~present[top].all(axis=1)]
+    if not len(idx): return out
+    shown = _top(idx, p['revenue']).tolist()
+    names = [p['labels'][i] for i in shown]
+    gaps = [f"'{p['labels'][i]}' chưa có ở {', '.join(labels[r] for r, sold in zip(major.tolist(), present[i]) if not sold)}"
+            for i in shown[:3]]
+    found.append({'rule': 'sku_region_gap', 'count': int(len(idx)), 'major_regions': [labels[i] for i in major.tolist()], 'items': names})
+    out.append(('regional', f"{len(idx):,} SKU bán chạy chưa phủ hết các khu vực chính: {'; '.join(gaps)} — mở rộng phân phối."))
+    return out
+
+RULES = (rule_top_products, rule_low_performers, rule_low_margin, rule_high_margin, rule_trend, rule_seasonality, rule_region_gap)
+
+GENERIC = [('marketing', "Test A/B landing pages hoặc creatives cho 2 sản phẩm bán chạy nhất để tăng conversion."),
+           ('marketing', "Đo lường ROAS theo chiến dịch trong 30 ngày gần nhất và rút ngân sách cho chiến dịch hiệu suất thấp."),
+           ('operation', "Rà soát chi phí nhập hàng và tồn kho cho top SKUs để tối ưu chuỗi cung ứng.")]
 
-    # Fallback if everything empty
-    if not any(len(v) for v in result.values()):
-        result['overall_strategy'] = ["Dữ liệu không đủ để đưa ra gợi ý chi tiết. Vui lòng đảm bảo file có các cột: Date, Product, Quantity, Revenue."]
+def generate_recommendations(c):
+    """Chạy mọi luật trên cube -> {'product', 'pricing', 'marketing', 'regional', 'operation', 'rules', ...}."""
+    t0 = time.perf_counter()
+    f, found, lines = Frames(c), [], []
+    if c.rows:
+        for rule in RULES: lines += rule(f, found)
+        lines += GENERIC
+    out = {g: [] for g in LIMITS}
+    for group, text in lines:
+        if text not in out[group] and len(out[group]) < LIMITS[group]: out[group].append(text)
+    if not any(out.values()):
+        out['operation'] = ["Dữ liệu không đủ để đưa ra gợi ý chi tiết. Vui lòng đảm bảo file có các cột: Date, Product, Quantity, Revenue."]
+    out.update(version=RECS_VERSION, rules=found, skus=len(c.labels['product']),
+               elapsed_ms=round((time.perf_counter() - t0) * 1000, 1))
+    return out
 
-    return result
+def recommendations_for(c):
+    """Gợi ý của cube: LRU trong process -> recommendations.json -> tính lại (rồi lưu cạnh cube).
+    Khóa theo dấu của chính cube c; cube đã được ghi lại sau khi c mở thì tính từ c, không đọc / ghi file."""
+    path = os.path.join(c.path, 'recommendations.json')
+    key = (c.path, c.stamp)
+    hit = _CACHE.get(key)
+    if hit: return hit
+    current = c.stamp is not None and cube_mod.stamp(c.path) == c.stamp
+    data = None
+    if current:
+        try:
+            with open(path, encoding='utf-8') as fh: data = json.load(fh)
+            if data.get('version') != RECS_VERSION or os.stat(path).st_mtime_ns < c.stamp[1]: data = None
+        except (OSError, ValueError): pass
+    if data is None:
+        data = generate_recommendations(c)
+        if current:
+            tmp = f'{path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp, 'w', encoding='utf-8') as fh: json.dump(data, fh, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp, path)
+            except OSError: pass
+    _CACHE.set(key, data)
+    return data
@@ -0,0 +1,106 @@
+"""
+result_cache.py — cache kết quả phân tích theo nội dung file (content-addressed).
+Khóa = sha256(nội dung file) + phiên bản analyzer + số dòng mẫu raw_data; giá trị = JSON kết quả (gzip)
+hoặc dữ liệu nhị phân kèm theo (put_blob/get_blob, vd: trạng thái tổng hợp để nối thêm dữ liệu).
+Phía gọi thêm phiên bản dạng response của mình vào khóa (app.py: RESULT_SCHEMA_VERSION).
+Lưu trong thư mục cục bộ, giới hạn dung lượng, loại bỏ theo LRU (mtime được cập nhật mỗi lần hit),
+nên nhiều worker process dùng chung được.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+CACHE_DIR = os.environ.get('DATANA_RESULT_CACHE_DIR', 'cache/results')
+CACHE_MAX_BYTES = int(os.environ.get('DATANA_RESULT_CACHE_MB', 512)) * 1024 * 1024
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+def analyzer_version():
+    """Đổi mỗi khi mã nguồn analyzer/ingest thay đổi -> kết quả cũ tự mất hiệu lực."""
+    h = hashlib.sha1()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in ('analyzer.py', 'ingest.py'):
+        with open(os.path.join(base, name), 'rb') as fh: h.update(fh.read())
+    return h.hexdigest()[:12]
+
+ANALYZER_VERSION = analyzer_version()
+
+def make_key(file_hash, *options):
+    return hashlib.sha256(':'.join([file_hash, ANALYZER_VERSION] + [str(o) for o in options]).encode()).hexdigest()
+
+def _path(key, ext='json'):
+    return os.path.join(CACHE_DIR, f"{key}.{ext}.gz")
+
+def _count(name, n=1):
+    with _lock: _stats[name] += n
+
+def get(key):
+    """JSON (bytes UTF-8) đã lưu hoặc None."""
+    return _read(_path(key))
+
+def get_blob(key):
+    """bytes đã lưu bằng put_blob hoặc None."""
+    return _read(_path(key, 'bin'))
+
+def get_with_blob(key, blob_key):
+    """(JSON, bytes kèm theo hoặc None) trong một lượt tra: tính một hit / miss theo JSON. Không có JSON -> (None, None)."""
+    data = _read(_path(key))
+    if data is None: return None, None
+    return data, _read(_path(blob_key, 'bin'), count=False)
+
+def _read(path, count=True):
+    try:
+        with gzip.open(path, 'rb') as fh: data = fh.read()
+    except (FileNotFoundError, OSError, EOFError):
+        if count: _count('misses')
+        return None
+    try: os.utime(path)
+    except OSError: pass
+    if count: _count('hits')
+    return data
+
+def put(key, json_bytes):
+    _write(_path(key), json_bytes)
+
+def put_blob(key, data):
+    _write(_path(key, 'bin'), data)
+
+def _write(path, data):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp, 'wb', compresslevel=1) as fh: fh.write(data)
+    os.replace(tmp, path)
+    _count('stores')
+    evict()
+
+def evict(max_bytes=None):
+    """Xóa các mục ít được dùng gần đây nhất cho tới khi tổng dung lượng <= max_bytes."""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try: entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith('.gz')]
+    except FileNotFoundError: return
+    items = []
+    for e in entries:
+        try:
+            st = e.stat()
+            items.append((st.st_mtime, st.st_size, e.path))
+        except FileNotFoundError: pass
+    total = sum(size for _, size, _ in items)
+    for _, size, path in sorted(items):
+        if total <= max_bytes: break
+        try:
+            os.remove(path)
+            total -= size
+            _count('evictions')
+        except FileNotFoundError: pass
+
+def stats():
+    with _lock: out = dict(_stats)
+    lookups = out['hits'] + out['misses']
+    out['hit_rate'] = out['hits'] / lookups if lookups else 0.0
+    try:
+        sizes = [e.stat().st_size for e in os.scandir(CACHE_DIR) if e.name.endswith('.gz')]
+    except FileNotFoundError: sizes = []
+    out.update(entries=len(sizes), bytes=sum(sizes), max_bytes=CACHE_MAX_BYTES, analyzer_version=ANALYZER_VERSION)
+    return out
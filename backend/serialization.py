@@ -0,0 +1,66 @@
+"""
+serialization.py — mã hóa / giải mã JSON dùng chung: response Flask (app.json), phiên tạm (session_store),
+cache kết quả (result_cache) và bản ghi Analysis.
+- orjson nếu đã cài (nhanh hơn json chuẩn nhiều lần, tự hiểu mảng / số NumPy và datetime, không qua hook Python
+  cho từng giá trị); không có thì dùng json chuẩn với _default() chuyển kiểu NumPy. Nếu orjson từ chối một giá trị
+  (vd số nguyên > 64 bit) thì mã hóa lại bằng json chuẩn như trước.
+- dumps() -> bytes UTF-8 (không escape tiếng Việt, không khoảng trắng). Kết quả phân tích được mã hóa một lần:
+  cùng bytes đó được lưu và trả cho client; with_fields() thêm session_id... vào bytes mà không mã hóa lại.
+- compress(): nén gzip / br (khi có brotli) cho response lớn; app.py chọn theo Accept-Encoding.
+Không import NumPy: giá trị NumPy chỉ xuất hiện khi NumPy đã được nạp (sys.modules), app khởi động không cần nó.
+"""
+import gzip
+import json
+import os
+import sys
+from datetime import date, datetime
+
+try: import orjson
+except ImportError: orjson = None
+try: import brotli
+except ImportError: brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('DATANA_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('DATANA_GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.environ.get('DATANA_BROTLI_QUALITY', 4))
+# Thứ tự ưu tiên khi client chấp nhận ngang nhau
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESS_TYPES = {'application/json', 'text/plain', 'text/html', 'text/csv'}
+
+if orjson is not None: _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _default(obj):
+    """Kiểu mà bộ mã hóa không tự hiểu (json chuẩn: mọi kiểu NumPy; orjson: mảng không liên tục, datetime con...)."""
+    if isinstance(obj, (datetime, date)): return obj.isoformat()
+    np = sys.modules.get('numpy')
+    if np is None: raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    if isinstance(obj, np.integer): return int(obj)
+    if isinstance(obj, np.floating): return float(obj)
+    if isinstance(obj, np.bool_): return bool(obj)
+    if isinstance(obj, np.ndarray): return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj):
+    if orjson is not None:
+        try: return orjson.dumps(obj, default=_default, option=_OPTIONS)
+        except TypeError: pass
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def dumps_text(obj):
+    return dumps(obj).decode('utf-8')
+
+def loads(data):
+    """str hoặc bytes -> giá trị Python."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def with_fields(body, **fields):
+    """bytes của một object JSON + các khóa mới (chưa có trong object), không giải mã / mã hóa lại phần còn lại."""
+    body = body.rstrip()
+    if not body.endswith(b'}'): raise ValueError("with_fields cần một object JSON")
+    if not fields: return body
+    extra = dumps(fields)
+    return extra if body[:-1].strip() == b'{' else body[:-1] + b',' + extra[1:]
+
+def compress(data, encoding):
+    if encoding == 'br': return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
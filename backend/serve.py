@@ -0,0 +1,161 @@
+"""
+serve.py — chạy app cho production: nạp sẵn + làm nóng trong một process cha rồi fork nhiều worker.
+- Process cha import app, nạp các module nặng (pandas / NumPy / analyzer...), chạy analyzer một lần trên bảng nhỏ
+  và tạo client LLM; worker fork ra dùng chung các trang bộ nhớ đó (copy-on-write): không worker nào phải import lại
+  hay trả chi phí của request đầu tiên.
+- --workers process (DATANA_WORKERS, mặc định = số core) cùng nhận kết nối trên một socket nghe chung; mỗi worker
+  xử lý request bằng --threads thread (DATANA_THREADS): request chờ LLM / SQLite không chặn request khác.
+- Worker chết thì được fork lại (job nền đang dở của nó được đánh dấu lỗi, xem jobs.recover); SIGTERM / Ctrl-C dừng tất cả (request đang chạy được chờ tối đa DATANA_GRACEFUL_TIMEOUT giây).
+- --workers 1 hoặc hệ điều hành không có fork (Windows): chạy trong một process.
+- Job nền (/analyze/async, /api/jobs/...) ghi trạng thái vào SQLite dùng chung (jobs.py) nên worker nào cũng trả lời
+  được; pool phân tích của mỗi worker có DATANA_JOB_WORKERS / --workers process (mặc định) để tổng số process ~ số core.
+- Dùng gunicorn thay thế: gunicorn --preload -w 4 --threads 8 -b 0.0.0.0:5000 'serve:create_app()'
+Chạy: python serve.py [--host 0.0.0.0] [--port 5000] [--workers 4] [--threads 8] [--no-warm] [--access-log]
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+WORKERS = int(os.environ.get('DATANA_WORKERS', os.cpu_count() or 1))
+THREADS = int(os.environ.get('DATANA_THREADS', 8))
+GRACEFUL_TIMEOUT = float(os.environ.get('DATANA_GRACEFUL_TIMEOUT', 30))
+RESPAWN_DELAY = 1.0
+WARM_ROWS = 120
+
+def warm(app_module):
+    """Nạp module nặng và chạy đường phân tích + mã hóa kết quả một lần (không lưu gì) trong process hiện tại."""
+    import metrics
+    import pandas as pd
+    import serialization
+    for name in app_module.HEAVY_MODULES: importlib.import_module(name)
+    days = pd.date_range('2024-01-01', periods=WARM_ROWS, freq='D')
+    df = pd.DataFrame({'Ngày bán': days.strftime('%d/%m/%Y'),
+                       'Tên sản phẩm': [f'Sản phẩm {i % 4}' for i in range(WARM_ROWS)],
+                       'Khu vực': [('Hà Nội', 'TP. Hồ Chí Minh', 'Đà Nẵng')[i % 3] for i in range(WARM_ROWS)],
+                       'Số lượng': [1 + i % 5 for i in range(WARM_ROWS)],
+                       'Doanh thu': [f'{(1 + i % 7) * 250}.000 đ' for i in range(WARM_ROWS)],
+                       'Lợi nhuận': [f'{(1 + i % 7) * 40}.000 đ' for i in range(WARM_ROWS)]})
+    serialization.dumps(app_module.build_analysis_result(app_module.analyzer.analyze_data(df)))
+    if app_module.llm.available:
+        try: app_module.llm.connect()
+        except Exception as e: print(f"⚠️ Không tạo được client LLM: {e}")
+    app_module.app.test_client().get('/api/user_info')
+    metrics.reset()
+
+def create_app(warm_up=True):
+    t0 = time.perf_counter()
+    import app as app_module
+    if warm_up: warm(app_module)
+    print(f"✅ Đã nạp app trong {time.perf_counter() - t0:.2f}s{' (đã làm nóng)' if warm_up else ''}")
+    return app_module.app
+
+class RequestHandler(WSGIRequestHandler):
+    # Mỗi kết nối một request: kết nối keep-alive đang rảnh không giữ thread của pool
+    protocol_version = 'HTTP/1.0'
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Server WSGI của werkzeug (như app.run) trên socket có sẵn, mỗi request chạy trong pool thread cố định."""
+    multithread = True
+
+    def __init__(self, app, sock, threads):
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+        self.socket.setblocking(False)  # nhiều worker cùng chờ một socket: worker không nhận được kết nối thì bỏ qua
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='datana-request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try: self.finish_request(request, client_address)
+        except Exception: self.handle_error(request, client_address)
+        finally: self.shutdown_request(request)
+
+def run_worker(app, sock, threads):
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = PooledWSGIServer(app, sock, threads)
+    try: server.serve_forever()  # tự đóng socket khi dừng
+    except SystemExit: pass
+    finally:
+        server.pool.shutdown(wait=True)  # chờ các request đang chạy
+        import jobs
+        jobs.shutdown()
+
+def spawn(app, sock, threads):
+    pid = os.fork()
+    if pid: return pid
+    code = 0
+    try: run_worker(app, sock, threads)
+    except BaseException:
+        logging.exception("Worker lỗi")
+        code = 1
+    finally: os._exit(code)
+
+def stop_workers(workers):
+    for pid in workers:
+        try: os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError: pass
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT
+    while workers:
+        for pid in list(workers):
+            try: done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError: done = pid
+            if done: workers.discard(pid)
+        if workers and time.monotonic() > deadline:
+            for pid in workers: os.kill(pid, signal.SIGKILL)
+            deadline = float('inf')
+        time.sleep(0.05)
+
+def recover_jobs():
+    import jobs
+    try:
+        n = jobs.recover()
+        if n: print(f"⚠️ {n} job nền của worker đã dừng được đánh dấu lỗi")
+    except Exception: logging.exception("Không dọn được job nền")
+
+def serve(app, host, port, workers=WORKERS, threads=THREADS):
+    sock = socket.create_server((host, port), backlog=1024)
+    recover_jobs()
+    print(f"🚀 Datana tại http://{host}:{port} — {workers} worker x {threads} thread")
+    if workers <= 1 or not hasattr(os, 'fork'):
+        try: run_worker(app, sock, threads)
+        except KeyboardInterrupt: pass
+        return
+    if 'DATANA_JOB_WORKERS' not in os.environ:
+        import jobs
+        jobs.JOB_WORKERS = max(1, jobs.JOB_WORKERS // workers)
+    children = set()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while True:
+            while len(children) < workers: children.add(spawn(app, sock, threads))
+            pid, status = os.wait()
+            if pid in children:
+                children.discard(pid)
+                print(f"⚠️ Worker {pid} dừng (mã {os.waitstatus_to_exitcode(status)}), khởi động lại")
+                recover_jobs()
+                time.sleep(RESPAWN_DELAY)
+    except (KeyboardInterrupt, SystemExit): pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop_workers(children)
+        sock.close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default=os.environ.get('DATANA_HOST', '0.0.0.0'))
+    ap.add_argument('--port', type=int, default=int(os.environ.get('DATANA_PORT', 5000)))
+    ap.add_argument('--workers', type=int, default=WORKERS)
+    ap.add_argument('--threads', type=int, default=THREADS)
+    ap.add_argument('--no-warm', action='store_true', help='không làm nóng analyzer trước khi fork')
+    ap.add_argument('--access-log', action='store_true', help='ghi log từng request (werkzeug)')
+    args = ap.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.INFO if args.access_log else logging.WARNING)
+    serve(create_app(not args.no_warm), args.host, args.port, args.workers, args.threads)
@@ -0,0 +1,171 @@
+"""
+session_store.py — kho lưu phiên tạm (TEMP_SESSIONS, TEMP_CHAT_HISTORY) cho khách chưa đăng nhập.
+Mỗi giá trị được lưu dạng JSON (serialization.dumps) nén zlib trong một file SQLite cục bộ: dùng chung giữa nhiều worker process
+và không mất khi worker khởi động lại. Có hạn sống (TTL) và giới hạn tổng dung lượng (loại bỏ theo LRU).
+"""
+import os
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+import serialization
+
+SESSION_TTL_SECONDS = int(os.environ.get('DATANA_SESSION_TTL', 6 * 3600))
+SESSION_STORE_MAX_BYTES = int(os.environ.get('DATANA_SESSION_STORE_MB', 256)) * 1024 * 1024
+# Dọn mục hết hạn / vượt dung lượng sau mỗi N lượt ghi (mỗi lần dọn quét cả bảng)
+EVICT_EVERY = int(os.environ.get('DATANA_SESSION_EVICT_EVERY', 100))
+# Lượt đọc chỉ ghi lại thời điểm dùng (cho LRU) khi lần ghi trước đã cũ hơn N giây: đọc thường xuyên không giữ khóa ghi
+TOUCH_SECONDS = float(os.environ.get('DATANA_SESSION_TOUCH_SECONDS', 60))
+
+_stores = weakref.WeakSet()
+
+def _close_before_fork():
+    # Kết nối SQLite không được dùng tiếp qua fork (serve.py fork worker; process phân tích của jobs.py dùng spawn
+    # nên không bị ảnh hưởng): đóng kết nối của thread đang fork, process con tự mở kết nối mới ở lần dùng đầu
+    for store in list(_stores):
+        conn = getattr(store._local, 'conn', None)
+        if conn is not None:
+            store._local.conn = None
+            conn.close()
+
+if hasattr(os, 'register_at_fork'): os.register_at_fork(before=_close_before_fork)
+
+def encode(value):
+    return zlib.compress(serialization.dumps(value), 1)
+
+def decode(blob):
+    return serialization.loads(zlib.decompress(blob))
+
+class LRUCache:
+    """LRU nhỏ trong bộ nhớ process (vd: bản tóm tắt đã giải mã theo session id). An toàn đa luồng."""
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data: return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock: return self._data.pop(key, default)
+
+class SessionStore:
+    """Kho key -> giá trị JSON, dùng như dict: store[sid] = {...}, store.get(sid), sid in store."""
+    def __init__(self, path, table, ttl=SESSION_TTL_SECONDS, max_bytes=SESSION_STORE_MAX_BYTES):
+        self.path, self.table, self.ttl, self.max_bytes = path, table, ttl, max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        _stores.add(self)
+        with self._conn() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                         f"size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_accessed ON {table} (accessed)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        if key is None: return default
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute(f"SELECT value, expires, accessed FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None: return default
+            if row[1] < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return default
+            if now - row[2] > TOUCH_SECONDS:
+                conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+        return decode(row[0])
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None: raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        if key is None: return False
+        row = self._conn().execute(f"SELECT 1 FROM {self.table} WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+        return row is not None
+
+    def items(self):
+        """[(key, giá trị)] của mọi mục còn hạn (cho bảng nhỏ, vd job nền)."""
+        rows = self._conn().execute(f"SELECT key, value FROM {self.table} WHERE expires >= ?", (time.time(),)).fetchall()
+        return [(key, decode(blob)) for key, blob in rows]
+
+    def __setitem__(self, key, value):
+        self._put(key, encode(value))
+
+    def set_json(self, key, data):
+        """Lưu giá trị đã mã hóa sẵn (bytes JSON, vd kết quả phân tích) mà không mã hóa lại."""
+        self._put(key, zlib.compress(data, 1))
+
+    def _put(self, key, blob):
+        with self._conn() as conn: self._write(conn, key, blob)
+        self._written()
+
+    def _write(self, conn, key, blob):
+        now = time.time()
+        conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                     (key, blob, len(blob), now + self.ttl, now))
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0: self.evict()
+
+    def __delitem__(self, key):
+        with self._conn() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def update(self, key, fn):
+        """Đọc - sửa - ghi trong một giao dịch BEGIN IMMEDIATE trên cùng kết nối: lượt ghi đồng thời của thread /
+        worker khác chờ tới lượt chứ không ghi đè lên nhau. fn(giá trị hiện tại hoặc None) -> giá trị mới (None = không ghi).
+        Trả về giá trị đã ghi (None nếu không ghi)."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            value = fn(decode(row[0]) if row is not None and row[1] >= time.time() else None)
+            if value is None: return None
+            self._write(conn, key, encode(value))
+        self._written()
+        return value
+
+    def patch(self, key, **fields):
+        """Cập nhật vài trường của một giá trị dạng dict (vd: title)."""
+        self.update(key, lambda value: dict(value, **fields) if isinstance(value, dict) else None)
+
+    def append(self, key, *items):
+        """Nối thêm phần tử vào giá trị dạng list (tạo mới nếu chưa có)."""
+        self.update(key, lambda value: (value or []) + list(items))
+
+    def evict(self):
+        """Xóa mục hết hạn, sau đó xóa mục ít dùng gần đây nhất cho tới khi tổng dung lượng <= max_bytes."""
+        with self._conn() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (time.time(),))
+            total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+            if total <= self.max_bytes: return
+            for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed").fetchall():
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes: break
+
+    def stats(self):
+        count, total = self._conn().execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        return {'entries': count, 'bytes': total, 'max_bytes': self.max_bytes, 'ttl': self.ttl}
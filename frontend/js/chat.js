@@ -135,6 +135,36 @@ function renderSuggestions() {
 }
 
 // --- 4. GỬI TIN NHẮN ---
+function renderMarkdown(bubble, text) {
+    if (typeof marked !== 'undefined') bubble.innerHTML = marked.parse(text);
+    else bubble.innerHTML = text.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>').replace(/\n/g, '<br>');
+}
+
+// Đọc SSE từ /api/chat/stream: gọi onEvent(tên sự kiện, dữ liệu) cho từng sự kiện
+async function readEvents(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buf += decoder.decode(value, { stream: true });
+        let idx;
+        while ((idx = buf.indexOf('\n\n')) >= 0) {
+            const raw = buf.slice(0, idx);
+            buf = buf.slice(idx + 2);
+            let event = 'message', data = '';
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+let chatAbort = null;
+
 async function send() {
     if (!chatInput) return;
     const txt = chatInput.value.trim();
@@ -148,60 +178,122 @@ async function send() {
     chatInput.style.height = 'auto'; 
     showTypingIndicator();
 
+    // Hủy câu trả lời đang chạy (nếu có) -> server đóng luôn request tới AI
+    if (chatAbort) chatAbort.abort();
+    const controller = chatAbort = new AbortController();
+    let bubble = null, text = '', frame = 0;
+    const render = () => { frame = 0; renderMarkdown(bubble, text); scrollToBottom(); };
+
     try {
-        const res = await fetch('/api/chat', { 
+        const res = await fetch('/api/chat/stream', { 
             method: 'POST',
             headers: {'Content-Type':'application/json'},
-            body: JSON.stringify({ message: txt, session_id: sid })
+            body: JSON.stringify({ message: txt, session_id: sid }),
+            signal: controller.signal
         });
+        if (!res.ok || !res.body) throw new Error(res.statusText);
 
-        const data = await res.json(); 
-        removeTypingIndicator();
-
-        if (data.error) {
-            appendMessage('ai', `⚠️ ${data.error}`, false);
-        } else {
-            // Nếu có câu trả lời từ AI
-            const content = data.response || data.assistant;
-            appendMessage('ai', content, true, true);
-            
-            // Reload sidebar nếu tiêu đề phiên thay đổi
-            if (data.session_title) {
-                loadChatHistory(sid);
+        await readEvents(res, (event, data) => {
+            if (event === 'delta') {
+                // Token đầu: thay hiệu ứng "đang gõ" bằng bong bóng trả lời, sau đó vẽ lại mỗi khung hình
+                if (!bubble) {
+                    removeTypingIndicator();
+                    appendMessage('ai', '', true, true);
+                    bubble = chatWindow.lastElementChild.querySelector('.bubble');
+                }
+                text += data.text;
+                if (!frame) frame = requestAnimationFrame(render);
+            } else if (event === 'done') {
+                removeTypingIndicator();
+                if (bubble) { text = data.response; if (frame) cancelAnimationFrame(frame); render(); }
+                else appendMessage('ai', data.response, true, true);
+                // Reload sidebar nếu tiêu đề phiên thay đổi
+                if (data.session_title) loadChatHistory(sid);
+            } else if (event === 'error') {
+                removeTypingIndicator();
+                appendMessage('ai', `⚠️ ${data.error}`, false);
             }
-        }
+        });
     } catch(e) {
         removeTypingIndicator();
-        appendMessage('ai', `⚠️ Mất kết nối tới máy chủ.`, false);
+        if (e.name !== 'AbortError') appendMessage('ai', `⚠️ Mất kết nối tới máy chủ.`, false);
+    } finally {
+        if (chatAbort === controller) chatAbort = null;
     }
 }
 
 // --- 5. TẢI LỊCH SỬ ---
+// Server phân trang theo cursor (mỗi lần một trang phiên / tin nhắn); nút "cũ hơn" ở đầu danh sách tải trang tiếp theo
+async function fetchHistory(body) {
+    const res = await fetch('/api/chat_history', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    return res.json();
+}
+
+function sessionItem(session, sessionId) {
+    const isActive = session.session_id === sessionId;
+    const div = document.createElement('div');
+    // Style cứng để đảm bảo hiển thị đẹp ngay lập tức
+    div.style.padding = '10px'; div.style.cursor = 'pointer'; div.style.borderRadius = '8px'; div.style.marginBottom = '5px'; div.style.color = isActive ? '#fff' : '#94a3b8'; div.style.background = isActive ? 'rgba(99, 102, 241, 0.2)' : 'transparent';
+    div.innerHTML = `<div style="display:flex; align-items:center; gap:8px;"><i class="fas fa-comment-dots"></i> <span style="white-space:nowrap; overflow:hidden; text-overflow:ellipsis; max-width:160px;"></span></div>`;
+    div.querySelector('span').textContent = session.title;
+    div.onclick = () => {
+        localStorage.setItem('datana_session_id', session.session_id);
+        window.location.reload(); 
+    };
+    return div;
+}
+
+function moreButton(label, onClick) {
+    const div = document.createElement('div');
+    div.className = 'history-more';
+    div.style.padding = '8px'; div.style.cursor = 'pointer'; div.style.textAlign = 'center'; div.style.color = '#64748b'; div.style.fontSize = '0.85rem';
+    div.innerHTML = `<i class="fas fa-chevron-up"></i> ${label}`;
+    div.onclick = () => { div.onclick = null; onClick().catch(e => console.error(e)); };
+    return div;
+}
+
+// Server trả phiên mới nhất trước; sidebar hiển thị cũ ở trên, mới ở dưới -> trang cũ hơn được chèn lên đầu
+function addSessionsPage(sessions, cursor, sessionId) {
+    const more = historyList.querySelector('.history-more');
+    if (more) more.remove();
+    const first = historyList.firstChild;
+    sessions.slice().reverse().forEach(session => historyList.insertBefore(sessionItem(session, sessionId), first));
+    if (cursor) historyList.insertBefore(moreButton('Phiên cũ hơn', async () => {
+        const data = await fetchHistory({ session_id: sessionId, cursor, history_limit: 0 });
+        addSessionsPage(data.sessions || [], data.next_cursor, sessionId);
+    }), historyList.firstChild);
+}
+
+// Tin nhắn cũ hơn (theo thứ tự thời gian) chèn lên đầu khung chat, giữ nguyên vị trí đang xem
+function addOlderMessages(history, cursor, sessionId) {
+    const more = chatWindow.querySelector('.history-more');
+    if (more) more.remove();
+    const fromBottom = chatWindow.scrollHeight - chatWindow.scrollTop;
+    const first = chatWindow.firstChild;
+    history.forEach(msg => {
+        appendMessage(msg.sender, msg.message, true);
+        chatWindow.insertBefore(chatWindow.lastChild, first);
+    });
+    if (cursor) chatWindow.insertBefore(moreButton('Tin nhắn cũ hơn', async () => {
+        const data = await fetchHistory({ session_id: sessionId, limit: 0, history_cursor: cursor });
+        addOlderMessages(data.history || [], data.history_cursor, sessionId);
+    }), chatWindow.firstChild);
+    chatWindow.scrollTop = chatWindow.scrollHeight - fromBottom;
+}
+
 async function loadChatHistory(sessionId) {
     if (!historyList) return; 
     try {
-        const res = await fetch('/api/chat_history', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ session_id: sessionId })
-        });
-        const data = await res.json();
+        const data = await fetchHistory({ session_id: sessionId });
         
         // Render Sidebar
         historyList.innerHTML = '';
         if (data.sessions && data.sessions.length > 0) {
-            data.sessions.reverse().forEach(session => {
-                const isActive = session.session_id === sessionId;
-                const div = document.createElement('div');
-                // Style cứng để đảm bảo hiển thị đẹp ngay lập tức
-                div.style.padding = '10px'; div.style.cursor = 'pointer'; div.style.borderRadius = '8px'; div.style.marginBottom = '5px'; div.style.color = isActive ? '#fff' : '#94a3b8'; div.style.background = isActive ? 'rgba(99, 102, 241, 0.2)' : 'transparent';
-                div.innerHTML = `<div style="display:flex; align-items:center; gap:8px;"><i class="fas fa-comment-dots"></i> <span style="white-space:nowrap; overflow:hidden; text-overflow:ellipsis; max-width:160px;">${session.title}</span></div>`;
-                div.onclick = () => {
-                    localStorage.setItem('datana_session_id', session.session_id);
-                    window.location.reload(); 
-                };
-                historyList.appendChild(div);
-            });
+            addSessionsPage(data.sessions, data.next_cursor, sessionId);
         } else {
             historyList.innerHTML = `<div style="text-align:center; padding:15px; color:#64748b; font-size:0.9rem;">Chưa có lịch sử.</div>`;
         }
@@ -214,6 +306,7 @@ async function loadChatHistory(sessionId) {
                 appendMessage('ai', 'Xin chào! 👋\nTôi đã sẵn sàng. Bạn có thể hỏi về doanh thu, sản phẩm bán chạy hoặc xu hướng kinh doanh từ file Excel vừa tải lên.', true);
             } else {
                 data.history.forEach(msg => appendMessage(msg.sender, msg.message, true));
+                if (data.history_cursor) addOlderMessages([], data.history_cursor, sessionId);
             }
             scrollToBottom();
         }
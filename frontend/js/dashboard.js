@@ -5,6 +5,7 @@ let ALL_DATA = [];
 let CURRENT_SESSION_ID = null;
 let charts = {}; 
 let FORECAST_DATA_CACHE = null; 
+let FILTERS = {};
 
 // Bảng màu (Chart.js)
 const CHART_COLORS = ['#8b5cf6', '#10b981', '#f43f5e', '#3b82f6', '#f59e0b', '#ec4899', '#6366f1', '#14b8a6', '#84cc16', '#d946ef'];
@@ -22,7 +23,9 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (e) { console.error(e); }
     }
     if (!ALL_DATA || ALL_DATA.length === 0) ALL_DATA = generateMockData();
-    updateDashboard(ALL_DATA);
+    // Có phiên trên server -> số liệu tổng hợp trên toàn bộ file qua /api/query; lỗi thì dùng raw_data như cũ
+    if (CURRENT_SESSION_ID) loadServerDashboard().then(initFilterBar).catch(e => { console.error(e); updateDashboard(ALL_DATA); });
+    else updateDashboard(ALL_DATA);
 });
 
 // --- 2. SỰ KIỆN ---
@@ -34,6 +37,59 @@ function setupEventListeners() {
     if(printBtn) printBtn.addEventListener('click', handleExportPDF);
     const aiBtn = document.getElementById('btnAiForecast');
     if(aiBtn) aiBtn.addEventListener('click', triggerAIAnalysis);
+    document.getElementById('btnApplyFilter')?.addEventListener('click', applyFilters);
+    document.getElementById('btnClearFilter')?.addEventListener('click', () => {
+        document.querySelectorAll('#filterBar select, #filterBar input').forEach(el => el.value = '');
+        applyFilters();
+    });
+}
+
+// --- 2b. TRUY VẤN SERVER (LỌC / DRILL-DOWN) ---
+async function fetchQuery(groupBy, limit) {
+    const body = { session_id: CURRENT_SESSION_ID, group_by: groupBy, filters: {}, limit };
+    ['region', 'category', 'brand', 'product'].forEach(k => { if (FILTERS[k]) body.filters[k] = [FILTERS[k]]; });
+    if (FILTERS.date_from) body.date_from = FILTERS.date_from;
+    if (FILTERS.date_to) body.date_to = FILTERS.date_to;
+    const res = await fetch('/api/query', { method: 'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify(body) });
+    if (!res.ok) throw new Error(`query ${res.status}`);
+    return res.json();
+}
+
+async function loadServerDashboard() {
+    const [byProduct, byMonth, byRegion, byCategory, byBrand] = await Promise.all([
+        fetchQuery(['product', 'category'], 1000), fetchQuery('month'), fetchQuery('region'), fetchQuery('category'), fetchQuery('brand')
+    ]);
+    const toMap = (q) => Object.fromEntries(q.labels.map((l, i) => [l, { rev: q.revenue[i], prof: q.profit[i], qty: q.quantity[i] }]));
+    const products = {};
+    byProduct.labels.forEach(([name, cat], i) => {
+        if (!products[name]) products[name] = { rev: 0, prof: 0, qty: 0, category: cat };
+        products[name].rev += byProduct.revenue[i]; products[name].prof += byProduct.profit[i]; products[name].qty += byProduct.quantity[i];
+    });
+    renderDashboard({
+        totalRev: byMonth.totals.revenue, totalProf: byMonth.totals.profit, products,
+        months: toMap(byMonth), regions: toMap(byRegion), categories: toMap(byCategory), brands: toMap(byBrand)
+    });
+}
+
+async function initFilterBar() {
+    const bar = document.getElementById('filterBar'); if (!bar) return;
+    const res = await fetch('/api/query/dimensions', { method: 'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify({session_id: CURRENT_SESSION_ID}) });
+    if (!res.ok) return;
+    const dims = (await res.json()).dimensions;
+    ['region', 'category', 'brand'].forEach(k => {
+        const sel = document.getElementById(`filter_${k}`); if (!sel) return;
+        sel.innerHTML = '<option value="">Tất cả</option>' + (dims[k] || []).map(v => `<option value="${v}">${v}</option>`).join('');
+    });
+    bar.style.display = 'flex';
+}
+
+function applyFilters() {
+    FILTERS = {};
+    ['region', 'category', 'brand'].forEach(k => { const v = document.getElementById(`filter_${k}`)?.value; if (v) FILTERS[k] = v; });
+    const from = document.getElementById('filter_from')?.value, to = document.getElementById('filter_to')?.value;
+    if (from) FILTERS.date_from = from;
+    if (to) FILTERS.date_to = to;
+    loadServerDashboard().catch(e => console.error(e));
 }
 
 // --- 3. CHUYỂN TAB ---
@@ -47,38 +103,44 @@ function switchTab(tabName) {
 }
 
 // --- 4. CẬP NHẬT DASHBOARD ---
+// Tổng hợp raw_data trong trình duyệt (khi không có phiên trên server)
 function updateDashboard(data) {
     if(!data || data.length === 0) return;
-    
-    // A. TÍNH TOÁN
-    const totalRev = data.reduce((s, r) => s + (r.revenue||0), 0);
-    const totalProf = data.reduce((s, r) => s + (r.profit||0), 0);
-    
-    const prodMap = {}, timeMap = {}, timeProfitMap = {}, regMap = {}, categoryMap = {}, profitMap = {}, brandMetrics = {}; 
-
+    const summary = { totalRev: 0, totalProf: 0, products: {}, months: {}, regions: {}, categories: {}, brands: {} };
     data.forEach(r => {
-        const rev = r.revenue||0; const prof = r.profit||0; const qty = r.quantity||0;
-        const month = r.month || 'N/A'; const brand = r.brand || 'Khác';
-
-        prodMap[r.product] = (prodMap[r.product]||0) + rev;
-        if(!profitMap[r.product]) profitMap[r.product] = { qty: 0, profit: 0 };
-        profitMap[r.product].qty += qty; profitMap[r.product].profit += prof;
-        
-        timeMap[month] = (timeMap[month]||0) + rev;
-        timeProfitMap[month] = (timeProfitMap[month]||0) + prof;
-        regMap[r.region||'Khác'] = (regMap[r.region||'Khác']||0) + rev;
-        categoryMap[r.category||'Khác'] = (categoryMap[r.category||'Khác']||0) + qty;
-
-        if (!brandMetrics[brand]) brandMetrics[brand] = { revenue: 0, profit: 0, quantity: 0 };
-        brandMetrics[brand].revenue += rev; brandMetrics[brand].profit += prof; brandMetrics[brand].quantity += qty;
+        const rev = r.revenue || 0; const prof = r.profit || 0; const qty = r.quantity || 0;
+        const cat = r.category || 'Khác';
+        const add = (obj, key, extra = {}) => { 
+            if(!obj[key]) obj[key] = {rev:0, prof:0, qty:0, ...extra}; 
+            obj[key].rev += rev; obj[key].prof += prof; obj[key].qty += qty; 
+        };
+        summary.totalRev += rev; summary.totalProf += prof;
+        add(summary.products, r.product || 'Unknown', { category: cat });
+        add(summary.months, r.month || 'N/A');
+        add(summary.regions, r.region || 'Khác');
+        add(summary.categories, cat);
+        add(summary.brands, r.brand || 'Khác');
     });
+    renderDashboard(summary);
+}
+
+// summary: { totalRev, totalProf, products/months/regions/categories/brands: {nhãn: {rev, prof, qty}} }
+function renderDashboard(summary) {
+    const totalRev = summary.totalRev, totalProf = summary.totalProf;
+    const pick = (m, f) => Object.fromEntries(Object.entries(m).map(([k, v]) => [k, f(v)]));
+    const prodMap = pick(summary.products, v => v.rev);
+    const profitMap = pick(summary.products, v => ({ qty: v.qty, profit: v.prof }));
+    const timeMap = pick(summary.months, v => v.rev), timeProfitMap = pick(summary.months, v => v.prof);
+    const regMap = pick(summary.regions, v => v.rev);
+    const brandMetrics = pick(summary.brands, v => ({ revenue: v.rev, profit: v.prof, quantity: v.qty }));
 
     safeSetText('kpi_rev', fmtMoney(totalRev));
     safeSetText('kpi_profit', fmtMoney(totalProf));
     safeSetText('kpi_topprod', Object.keys(prodMap).sort((a,b) => prodMap[b]-prodMap[a])[0] || '-');
 
     const sortedMonths = Object.keys(timeMap).sort(); 
-    if (FORECAST_DATA_CACHE && FORECAST_DATA_CACHE.labels && FORECAST_DATA_CACHE.forecast) drawForecastChart(FORECAST_DATA_CACHE);
+    const filtered = Object.keys(FILTERS).length > 0;
+    if (!filtered && FORECAST_DATA_CACHE && FORECAST_DATA_CACHE.labels && FORECAST_DATA_CACHE.forecast) drawForecastChart(FORECAST_DATA_CACHE);
     else drawChart('chartLine', 'line', sortedMonths, sortedMonths.map(m=>timeMap[m]), 'Doanh thu');
 
     drawChart('chartBar', 'bar', Object.keys(regMap), Object.values(regMap), 'Doanh thu vùng');
@@ -96,29 +158,12 @@ function updateDashboard(data) {
     const topProfitKeys = Object.keys(profitMap).sort((a, b) => profitMap[b].profit - profitMap[a].profit).slice(0, 5);
     drawChart('chartProfitBar', 'bar', topProfitKeys, topProfitKeys.map(k => profitMap[k].profit), 'Lợi nhuận'); 
 
-    updateTables(data);
+    updateTables(summary);
 }
 
 // --- 5. LOGIC BẢNG CHI TIẾT (FULL DATA) ---
-function updateTables(data) {
-    if (!data || data.length === 0) return;
-
-    let statsBrand = {}, statsCategory = {}, statsProduct = {}, statsMonth = {};
-
-    data.forEach(r => {
-        const rev = r.revenue || 0; const prof = r.profit || 0; const qty = r.quantity || 0;
-        const cat = r.category || 'Khác'; const month = r.month || 'N/A';
-
-        const add = (obj, key, extra = {}) => { 
-            if(!obj[key]) obj[key] = {rev:0, prof:0, qty:0, ...extra}; 
-            obj[key].rev += rev; obj[key].prof += prof; obj[key].qty += qty; 
-        };
-
-        add(statsBrand, r.brand || 'Khác'); 
-        add(statsCategory, cat); 
-        add(statsProduct, r.product || 'Unknown', { category: cat });
-        add(statsMonth, month);
-    });
+function updateTables(summary) {
+    const statsBrand = summary.brands, statsCategory = summary.categories, statsProduct = summary.products, statsMonth = summary.months;
 
     renderTable('tbl_brand', Object.entries(statsBrand).sort((a,b)=>b[1].rev - a[1].rev), (k,v) => `<tr><td>${k}</td><td class="text-right">${fmtMoney(v.rev)}</td><td class="text-right" style="color:${v.prof>0?'#34d399':'#ef4444'}">${fmtMoney(v.prof)}</td></tr>`);
     renderTable('tbl_category', Object.entries(statsCategory).sort((a,b)=>b[1].rev - a[1].rev), (k,v) => `<tr><td>${k}</td><td class="text-center">${v.qty}</td><td class="text-right">${fmtMoney(v.rev)}</td><td class="text-right">${fmtMoney(v.prof)}</td></tr>`);
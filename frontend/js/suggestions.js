@@ -1,6 +1,20 @@
 // suggestions.js — render suggestions with better UI
-document.addEventListener('DOMContentLoaded', ()=>{
-  const s = JSON.parse(localStorage.getItem('datana_last_analysis_recs')||'null');
+// Gợi ý lấy từ /api/recommendations (tính trên toàn bộ dữ liệu của phiên, server cache theo phân tích)
+const esc = t => String(t).replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));
+
+async function loadRecommendations(){
+  const sid = localStorage.getItem('datana_session_id');
+  if (sid) {
+    try {
+      const res = await fetch('/api/recommendations', { method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({session_id: sid}) });
+      if (res.ok) return await res.json();
+    } catch (e) { console.error(e); }
+  }
+  return JSON.parse(localStorage.getItem('datana_last_analysis_recs')||'null');
+}
+
+document.addEventListener('DOMContentLoaded', async ()=>{
+  const s = await loadRecommendations();
   const suggestionsArea = document.getElementById('suggestionsArea');
   const noDataMsg = document.getElementById('noDataMsg');
   
@@ -29,7 +43,7 @@ document.addEventListener('DOMContentLoaded', ()=>{
       <div class="suggestion-group animate-in">
         <h3 style="color:${g.color};">${g.title}</h3>
         <ul class="suggestion-list">
-          ${items.map(item=> `<li class="suggestion-item">✓ ${item}</li>`).join('')}
+          ${items.map(item=> `<li class="suggestion-item">✓ ${esc(item)}</li>`).join('')}
         </ul>
       </div>
     `;
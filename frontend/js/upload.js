@@ -21,6 +21,7 @@ const successOverlay = document.getElementById('successOverlay');
 const uploadCard = document.getElementById('uploadCard');
 
 let selectedFile = null;
+let selectedFiles = []; // Nhiều file hoặc file .zip -> /analyze/batch
 let progressInterval = null;
 
 // --- 1. HIỆU ỨNG SPOTLIGHT (MOUSE TRACKING) ---
@@ -74,25 +75,27 @@ if (dropArea && fileInput) {
 
 function handleFiles(files) {
     if (files.length > 0) {
-        const file = files[0];
-        const ext = file.name.split('.').pop().toLowerCase();
-        
-        if (!['xlsx', 'xls', 'csv'].includes(ext)) {
-            alert("⚠️ File không hỗ trợ! Vui lòng chọn .xlsx hoặc .csv");
+        files = Array.from(files);
+        if (files.some(f => !['xlsx', 'xls', 'csv', 'zip'].includes(f.name.split('.').pop().toLowerCase()))) {
+            alert("⚠️ File không hỗ trợ! Vui lòng chọn .xlsx, .csv hoặc .zip");
             return;
         }
+        const file = files[0];
+        const ext = file.name.split('.').pop().toLowerCase();
         
         selectedFile = file;
+        selectedFiles = files;
         
         // UI Switch
         if (dropArea) dropArea.style.display = 'none';
         if (fileDisplay) fileDisplay.style.display = 'flex';
         
         // Update Info
-        if(fileNameSpan) fileNameSpan.textContent = file.name;
+        if(fileNameSpan) fileNameSpan.textContent = files.length > 1 ? `${file.name} (+${files.length - 1} file)` : file.name;
         if(fileSizeSpan) {
-            const mb = file.size / 1024 / 1024;
-            fileSizeSpan.textContent = mb > 1 ? mb.toFixed(2) + ' MB' : Math.round(file.size/1024) + ' KB';
+            const size = files.reduce((sum, f) => sum + f.size, 0);
+            const mb = size / 1024 / 1024;
+            fileSizeSpan.textContent = mb > 1 ? mb.toFixed(2) + ' MB' : Math.round(size/1024) + ' KB';
         }
         
         // Update Icon
@@ -107,6 +110,7 @@ function handleFiles(files) {
 if (removeFileBtn) {
     removeFileBtn.addEventListener('click', () => {
         selectedFile = null;
+        selectedFiles = [];
         fileInput.value = '';
         if (dropArea) dropArea.style.display = 'block';
         if (fileDisplay) fileDisplay.style.display = 'none';
@@ -157,12 +161,14 @@ if (analyzeBtn) {
         runProgress();
 
         const fd = new FormData();
-        if (selectedFile) fd.append('file', selectedFile);
+        const batch = selectedFiles.length > 1 || (selectedFile && selectedFile.name.toLowerCase().endsWith('.zip'));
+        if (batch) selectedFiles.forEach(f => fd.append('files', f));
+        else if (selectedFile) fd.append('file', selectedFile);
         else fd.append('sheet_url', url);
 
         try {
             // Dòng 164 - Sửa thành thế này:
-const res = await fetch('/analyze', { method: 'POST', body: fd });
+const res = await fetch(batch ? '/analyze/batch' : '/analyze', { method: 'POST', body: fd });
             const data = await res.json();
             
             if (res.ok) {